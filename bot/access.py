@@ -0,0 +1,110 @@
+"""Доступ к викторинам: проверка одним запросом и атомарное погашение токенов.
+
+get_quiz_access отвечает на вопрос «может ли пользователь открыть викторину и
+какие варианты он уже прошёл» одним SQL-запросом вместо цепочки Quiz →
+InviteToken → AllowedUser → QuizVariant → UserResult. Пройденные варианты
+берутся из агрегата QuizProgress (одна строка), а не из истории результатов.
+"""
+from django.db import connection, transaction
+from django.db.models import Exists, F, JSONField, OuterRef, Subquery
+
+from .models import AllowedUser, InviteToken, Quiz, QuizProgress, UserProfile
+
+
+class QuizAccess:
+    __slots__ = ("quiz_id", "allowed", "granted", "message", "variants", "passed_ids")
+
+    def __init__(self, quiz_id, allowed=False, granted=False, message="", variants=(), passed_ids=()):
+        self.quiz_id = quiz_id
+        self.allowed = allowed
+        self.granted = granted
+        self.message = message
+        self.variants = list(variants)  # [(variant_id, title)]
+        self.passed_ids = set(passed_ids)
+
+
+def get_quiz_access(user_id, quiz_id):
+    latest_token = InviteToken.objects.filter(quiz=OuterRef("pk")).order_by("-id")
+    rows = list(
+        Quiz.objects.filter(id=quiz_id)
+        .annotate(
+            token_used=Subquery(latest_token.values("used_count")[:1]),
+            token_limit=Subquery(latest_token.values("usage_limit")[:1]),
+            allowed=Exists(AllowedUser.objects.filter(user_profile__user_id=user_id, quiz=OuterRef("pk"))),
+            passed=Subquery(
+                QuizProgress.objects.filter(user_profile__user_id=user_id, quiz=OuterRef("pk"))
+                .values("passed_variant_ids")[:1],
+                output_field=JSONField(),
+            ),
+        )
+        .order_by("variants__id")
+        .values_list("token_used", "token_limit", "allowed", "variants__id", "variants__title", "passed")
+    )
+    if not rows:
+        return QuizAccess(quiz_id, message="🚫 Викторина табылмады.")
+
+    token_used, token_limit, allowed, _, _, passed = rows[0]
+    access = QuizAccess(quiz_id, allowed=allowed)
+    if token_limit is None:
+        access.message = "🚫 Бұл викторинаға арналған токен жоқ."
+    elif token_used >= token_limit:
+        access.message = "🚫 Токен қолданылып қойған. Қол жеткізу жабық."
+    elif not allowed:
+        access.message = "🚫 Бұл викторинаға қол жеткізу рұқсатыңыз жоқ."
+    else:
+        access.granted = True
+        access.variants = [(vid, title) for _, _, _, vid, title, _ in rows if vid is not None]
+        access.passed_ids = set(passed or ())
+    return access
+
+
+def redeem_invite_token(code, user_id=None, quiz_id=None):
+    """Атомарно списывает одно использование токена и возвращает quiz_id (или None).
+
+    Один условный UPDATE ... SET used_count = used_count + 1 WHERE used_count < usage_limit
+    RETURNING quiz_id — конкурентные погашения не теряются и не превышают лимит.
+    Если у user_id уже есть доступ к викторине токена, использование не списывается,
+    но quiz_id возвращается (пока токен действителен).
+    """
+    qn = connection.ops.quote_name
+    token_table = qn(InviteToken._meta.db_table)
+    where = [f"{qn('token')} = %s", f"{qn('used_count')} < {qn('usage_limit')}"]
+    params = [code]
+    if quiz_id is not None:
+        where.append(f"{qn('quiz_id')} = %s")
+        params.append(quiz_id)
+    if user_id is not None:
+        where.append(
+            f"NOT EXISTS (SELECT 1 FROM {qn(AllowedUser._meta.db_table)} a"
+            f" INNER JOIN {qn(UserProfile._meta.db_table)} p ON a.{qn('user_profile_id')} = p.{qn('id')}"
+            f" WHERE p.{qn('user_id')} = %s AND a.{qn('quiz_id')} = {token_table}.{qn('quiz_id')})"
+        )
+        params.append(user_id)
+    sql = (
+        f"UPDATE {token_table} SET {qn('used_count')} = {qn('used_count')} + 1"
+        f" WHERE {' AND '.join(where)}"
+    )
+
+    with connection.cursor() as cursor:
+        if connection.features.can_return_columns_from_insert:
+            cursor.execute(sql + f" RETURNING {qn('quiz_id')}", params)
+            row = cursor.fetchone()
+            redeemed = row[0] if row else None
+        else:
+            with transaction.atomic():
+                cursor.execute(sql, params)
+                redeemed = None
+                if cursor.rowcount:
+                    redeemed = InviteToken.objects.filter(token=code).values_list("quiz_id", flat=True).first()
+    if redeemed is not None or user_id is None:
+        return redeemed
+
+    # Не списали: токена нет, он исчерпан, либо у пользователя уже есть доступ
+    valid = InviteToken.objects.filter(
+        token=code,
+        used_count__lt=F("usage_limit"),
+        quiz__alloweduser__user_profile__user_id=user_id,
+    )
+    if quiz_id is not None:
+        valid = valid.filter(quiz_id=quiz_id)
+    return valid.values_list("quiz_id", flat=True).first()
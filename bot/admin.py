@@ -1,45 +1,84 @@
+import csv
+
 from django.contrib import admin
 from django.utils.html import format_html
 from django.http import HttpResponse
-import pandas as pd
 from io import TextIOWrapper
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
 from django.urls import path
 from django.contrib import messages
 from django.contrib.admin.sites import NotRegistered
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
 
 from .models import Quiz, QuizVariant, Question, UserResult, UserAnswer, UserProfile
 from .models import AllowedUser, InviteToken
+from .analytics import question_stats, variant_summary
+from .exports import ANSWER_COLUMNS, RESULT_COLUMNS, csv_response, export_filename
+from .images import prewarm_variants_in_background
+from .importers import CsvSource, QuestionImportError, XlsxSource, import_questions, open_google_sheet
+
+
+# ------------------- Оценка числа строк для больших таблиц -------------------
+class EstimatedCountPaginator(Paginator):
+    """Без фильтров на PostgreSQL берёт оценку pg_class.reltuples вместо COUNT(*)
+    по всей таблице (если таблица большая); с фильтрами считает точно."""
+
+    estimate_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
 
 
 # ------------------- Общий фильтр по вариантам -------------------
 class VariantFilter(admin.SimpleListFilter):
     title = "Вариант"
     parameter_name = "variant"
+    field = "variant_id"
 
     def lookups(self, request, model_admin):
-        quiz_id = request.GET.get("variant__quiz__id__exact") or request.GET.get("quiz__id__exact")
+        # Варианты показываем только после выбора викторины — один небольшой запрос
+        quiz_id = next((value for key, value in request.GET.items() if key.endswith("quiz__id__exact")), None)
         if quiz_id:
             return QuizVariant.objects.filter(quiz_id=quiz_id).values_list("id", "title")
         return []
 
     def queryset(self, request, queryset):
         if self.value():
-            return queryset.filter(variant_id=self.value())
+            return queryset.filter(**{self.field: self.value()})
         return queryset
 
 
+class AnswerVariantFilter(VariantFilter):
+    field = "result__variant_id"
+
+
 # ------------------- UserProfile -------------------
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ("user_id", "user_name")
     search_fields = ("user_id", "user_name")
+    show_full_result_count = False
 
 
 # ------------------- InviteToken -------------------
 @admin.register(InviteToken)
 class InviteTokenAdmin(admin.ModelAdmin):
     list_display = ("token", "quiz", "used_count", "usage_limit", "remaining_uses")
+    list_select_related = ("quiz",)
 
     def remaining_uses(self, obj):
         return obj.usage_limit - obj.used_count
@@ -52,6 +91,10 @@ class AllowedUserAdmin(admin.ModelAdmin):
     list_display = ("get_user_id", "get_user_name", "quiz", "get_invite_token")
     search_fields = ("user_profile__user_name", "user_profile__user_id")
     list_filter = ("quiz",)
+    list_select_related = ("user_profile", "quiz", "invite_token")
+    autocomplete_fields = ("user_profile",)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "invite_token":
@@ -78,14 +121,69 @@ class AllowedUserAdmin(admin.ModelAdmin):
 class QuestionInline(admin.TabularInline):
     model = Question
     extra = 1
-    fields = ("question", "option1", "option2", "option3", "option4", "correct_answer", "image_url")
+    fields = ("question", "option1", "option2", "option3", "option4", "correct_answer", "image_url", "tag", "difficulty")
 
 
 @admin.register(QuizVariant)
 class QuizVariantAdmin(admin.ModelAdmin):
-    list_display = ("id", "title", "quiz")
+    list_display = ("id", "title", "quiz", "shuffle_questions", "shuffle_options", "sample_size", "analytics_link")
     list_filter = ("quiz",)
+    list_select_related = ("quiz",)
+    search_fields = ("title", "quiz__title")
     inlines = [QuestionInline]
+    actions = ["prewarm_images"]
+    change_list_template = "admin/quizvariant_changelist.html"
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path("analytics/", self.admin_site.admin_view(self.analytics_view), name="bot_quizvariant_analytics"),
+            path(
+                "<int:variant_id>/analytics/",
+                self.admin_site.admin_view(self.question_analytics_view),
+                name="bot_quizvariant_question_analytics",
+            ),
+        ]
+        return custom_urls + urls
+
+    @admin.display(description="Аналитика")
+    def analytics_link(self, obj):
+        return format_html('<a href="{}/analytics/">📈</a>', obj.pk)
+
+    def analytics_view(self, request):
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Аналитика вариантов",
+            "rows": variant_summary(),
+        }
+        return TemplateResponse(request, "admin/variant_analytics.html", context)
+
+    def question_analytics_view(self, request, variant_id):
+        variant = get_object_or_404(QuizVariant.objects.select_related("quiz"), pk=variant_id)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": f"Аналитика вопросов: {variant}",
+            "variant": variant,
+            "stats": question_stats(variant_id),
+        }
+        return TemplateResponse(request, "admin/question_analytics.html", context)
+
+    @admin.action(description="Прогреть картинки (загрузить в Telegram заранее)")
+    def prewarm_images(self, request, queryset):
+        # Загрузка долгая (паузы по лимитам Telegram) — не в HTTP-запросе
+        try:
+            prewarm_variants_in_background(list(queryset.values_list("id", flat=True)))
+        except ValueError as e:
+            self.message_user(request, str(e), level=messages.ERROR)
+            return
+        self.message_user(
+            request,
+            "Прогрев запущен в фоне, итог — в логе. Для большого числа картинок удобнее "
+            "manage.py prewarm_images: отчёт сразу в консоли.",
+            messages.SUCCESS,
+        )
 
 
 # ------------------- Question -------------------
@@ -93,11 +191,15 @@ class QuizVariantAdmin(admin.ModelAdmin):
 class QuestionAdmin(admin.ModelAdmin):
     list_display = ("id", "question", "variant", "correct_answer", "get_correct_option", "image_preview")
     list_filter = ("variant__quiz", VariantFilter)
+    list_select_related = ("variant__quiz",)
+    search_fields = ("question",)
+    autocomplete_fields = ("variant",)
     readonly_fields = ("image_preview",)
     fields = (
         "variant", "question",
         "option1", "option2", "option3", "option4",
-        "correct_answer", "image_url", "image_preview"
+        "correct_answer", "image_url", "image_preview",
+        "tag", "difficulty",
     )
 
     def get_correct_option(self, obj):
@@ -120,6 +222,9 @@ class UserAnswerInline(admin.TabularInline):
     extra = 0
     readonly_fields = ("question", "selected_option", "is_correct")
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("question")
+
 
 @admin.register(UserResult)
 class UserResultAdmin(admin.ModelAdmin):
@@ -127,6 +232,11 @@ class UserResultAdmin(admin.ModelAdmin):
     list_filter = ("quiz", VariantFilter, "timestamp")
     search_fields = ("user_profile__user_name", "user_profile__user_id")
     inlines = [UserAnswerInline]
+    list_select_related = ("user_profile", "quiz", "variant__quiz")
+    autocomplete_fields = ("user_profile", "variant", "quiz")
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ["export_results_csv", "export_answers_csv"]
 
     def get_user_name(self, obj):
         return obj.user_profile.user_name if obj.user_profile else "-"
@@ -136,18 +246,40 @@ class UserResultAdmin(admin.ModelAdmin):
         return obj.user_profile.user_id if obj.user_profile else "-"
     get_user_id.short_description = "User ID"
 
+    # «Выбрать все N» в changelist передаёт весь отфильтрованный queryset —
+    # строки читаются порциями, поэтому размер выгрузки не ограничен памятью.
+    # XLSX — только через manage.py export_results (книгу не отдать потоком)
+    @admin.action(description="Выгрузить результаты (CSV)")
+    def export_results_csv(self, request, queryset):
+        return csv_response(queryset, RESULT_COLUMNS, export_filename("results", "csv"))
+
+    @admin.action(description="Выгрузить ответы выбранных результатов (CSV)")
+    def export_answers_csv(self, request, queryset):
+        answers = UserAnswer.objects.filter(result__in=queryset.values("id"))
+        return csv_response(answers, ANSWER_COLUMNS, export_filename("answers", "csv"))
+
 
 # ------------------- UserAnswer -------------------
 @admin.register(UserAnswer)
 class UserAnswerAdmin(admin.ModelAdmin):
     list_display = ["result", "question", "selected_option", "is_correct"]
-    list_filter = ("question__variant__quiz", VariantFilter, "is_correct")
+    list_filter = ("result__quiz", AnswerVariantFilter, "is_correct")
     search_fields = ("result__user_profile__user_id", "question__question")
+    list_select_related = ("result__user_profile", "result__quiz", "question")
+    raw_id_fields = ("result", "question")
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ["export_csv"]
+
+    @admin.action(description="Выгрузить ответы (CSV)")
+    def export_csv(self, request, queryset):
+        return csv_response(queryset, ANSWER_COLUMNS, export_filename("answers", "csv"))
 
 
-# ------------------- Импорт CSV в Quiz -------------------
+# ------------------- Импорт вопросов в Quiz (CSV, XLSX, Google Sheets) -------------------
 class QuizAdmin(admin.ModelAdmin):
     list_display = ("id", "title")
+    search_fields = ("title",)
     change_list_template = "admin/quiz_changelist.html"
 
     def get_urls(self):
@@ -158,54 +290,36 @@ class QuizAdmin(admin.ModelAdmin):
         return custom_urls + urls
 
     def import_csv(self, request):
-        if request.method == "POST" and request.FILES.get("csv_file"):
-            csv_file = TextIOWrapper(request.FILES["csv_file"].file, encoding="utf-8")
-            try:
-                df = pd.read_csv(csv_file)
-            except Exception as e:
-                self.message_user(request, f"Ошибка чтения CSV: {e}", level=messages.ERROR)
-                return redirect("..")
-
-            quiz_title = request.POST.get("quiz_title", "Импортированная тема")
-            quiz, _ = Quiz.objects.get_or_create(title=quiz_title)
-
-            required_cols = {"variant_title", "question_text", "answer_1", "answer_2", "answer_3", "answer_4"}
-            if not required_cols.issubset(set(df.columns)):
-                self.message_user(
-                    request,
-                    "CSV должен содержать колонки: variant_title, question_text, answer_1..answer_4",
-                    level=messages.ERROR,
-                )
-                return redirect("..")
-
-            for variant_title in df["variant_title"].unique():
-                variant_df = df[df["variant_title"] == variant_title]
-                variant, _ = QuizVariant.objects.get_or_create(title=variant_title, quiz=quiz)
-
-                for _, row in variant_df.iterrows():
-                    correct_option = None
-                    for i in range(1, 5):
-                        cell = row.get(f"is_correct_{i}", "")
-                        if str(cell).strip().lower() == "true":
-                            correct_option = i
-                            break
-                    if correct_option is None:
-                        continue
-
-                    Question.objects.create(
-                        variant=variant,
-                        question=str(row.get("question_text", "") or ""),
-                        option1=str(row.get("answer_1", "") or ""),
-                        option2=str(row.get("answer_2", "") or ""),
-                        option3=str(row.get("answer_3", "") or ""),
-                        option4=str(row.get("answer_4", "") or ""),
-                        correct_answer=correct_option,
-                        image_url=row.get("image_url", "") or None,
-                    )
-
-            self.message_user(request, "CSV импорт выполнен успешно ✅", messages.SUCCESS)
+        if request.method != "POST":
+            return HttpResponse("Ошибка: выберите файл", status=400)
+        uploaded = request.FILES.get("csv_file")
+        sheet_url = request.POST.get("sheet_url", "").strip()
+        if not uploaded and not sheet_url:
+            return HttpResponse("Ошибка: выберите CSV/XLSX-файл или укажите ссылку на Google Sheets", status=400)
+
+        quiz_title = request.POST.get("quiz_title", "Импортированная тема")
+        worksheet = request.POST.get("worksheet", "").strip() or None
+        try:
+            if sheet_url:
+                source = open_google_sheet(sheet_url, worksheet)
+            elif uploaded.name.lower().endswith(".xlsx"):
+                source = XlsxSource(uploaded.file, worksheet)
+            else:
+                source = CsvSource(TextIOWrapper(uploaded.file, encoding="utf-8-sig", newline=""))
+            report = import_questions(source, quiz_title, incremental=bool(request.POST.get("incremental")))
+        except QuestionImportError as e:
+            self.message_user(request, str(e), level=messages.ERROR)
             return redirect("..")
-        return HttpResponse("Ошибка: выберите CSV-файл", status=400)
+        except (UnicodeDecodeError, csv.Error) as e:
+            self.message_user(request, f"Ошибка чтения CSV: {e}", level=messages.ERROR)
+            return redirect("..")
+
+        self.message_user(request, f"Импорт выполнен ✅ {report.summary()}", messages.SUCCESS)
+        if report.skipped:
+            shown = "; ".join(f"строка {line}: {reason}" for line, reason in report.skipped[:20])
+            more = f" … и ещё {len(report.skipped) - 20}" if len(report.skipped) > 20 else ""
+            self.message_user(request, f"Пропущены строки — {shown}{more}", messages.WARNING)
+        return redirect("..")
 
 
 # Перерегистрируем Quiz с новой админкой
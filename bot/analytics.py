@@ -0,0 +1,119 @@
+"""Аналитика вопросов для админки: сложность, ответы по вариантам, дискриминация.
+
+Всё считается сгруппированными SQL-агрегатами (COUNT ... FILTER) без обхода
+строк UserAnswer в Python: одна выборка по вариантам, а для страницы варианта —
+пороги групп и одна выборка по его вопросам.
+
+Индекс дискриминации — метод верхних и нижних 27 %: D = p(верх) − p(низ), где
+группы — попытки варианта с лучшим и худшим результатом (score / total).
+Результаты кэшируются на ANALYTICS_CACHE_TTL секунд.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, ExpressionWrapper, F, FloatField, Q
+
+from .models import Question, QuizVariant, UserAnswer, UserResult
+
+GROUP_SHARE = 0.27
+
+
+def score_ratio(prefix=""):
+    return ExpressionWrapper(F(f"{prefix}score") * 1.0 / F(f"{prefix}total"), output_field=FloatField())
+
+
+def percent(part, whole):
+    return round(100.0 * part / whole, 1) if whole else None
+
+
+def _variant_summary():
+    rows = (
+        QuizVariant.objects.values("id", "title", "quiz__title")
+        .annotate(
+            attempts=Count("userresult"),
+            avg_ratio=Avg(score_ratio("userresult__"), filter=Q(userresult__total__gt=0)),
+        )
+        .order_by("quiz__title", "title")
+    )
+    return [
+        dict(row, avg_percent=round(row["avg_ratio"] * 100, 1) if row["avg_ratio"] is not None else None)
+        for row in rows
+    ]
+
+
+def group_thresholds(variant_id):
+    """(число попыток, порог нижней группы, порог верхней группы); пороги None,
+    если группы не выделить (мало попыток или результаты одинаковы)."""
+    ratios = (
+        UserResult.objects.filter(variant_id=variant_id, total__gt=0)
+        .annotate(ratio=score_ratio())
+        .order_by("ratio")
+        .values_list("ratio", flat=True)
+    )
+    n = ratios.count()
+    size = int(n * GROUP_SHARE)
+    if size < 1:
+        return n, None, None
+    low, high = ratios[size - 1], ratios[n - size]
+    if low >= high:
+        return n, None, None
+    return n, low, high
+
+
+def _question_stats(variant_id):
+    results, low, high = group_thresholds(variant_id)
+    grouped = low is not None
+    aggregates = {
+        "attempts": Count("id"),
+        "correct": Count("id", filter=Q(is_correct=True)),
+        **{f"option{i}": Count("id", filter=Q(selected_option=i)) for i in range(1, 5)},
+    }
+    if grouped:
+        aggregates.update(
+            upper=Count("id", filter=Q(ratio__gte=high)),
+            upper_correct=Count("id", filter=Q(ratio__gte=high, is_correct=True)),
+            lower=Count("id", filter=Q(ratio__lte=low)),
+            lower_correct=Count("id", filter=Q(ratio__lte=low, is_correct=True)),
+        )
+    rows = list(
+        UserAnswer.objects.filter(result__variant_id=variant_id, result__total__gt=0)
+        .alias(ratio=score_ratio("result__"))
+        .values("question_id")
+        .annotate(**aggregates)
+        .order_by("question_id")
+    )
+    questions = {
+        qid: (text, correct_answer)
+        for qid, text, correct_answer in Question.objects.filter(
+            id__in=[row["question_id"] for row in rows]
+        ).values_list("id", "question", "correct_answer")
+    }
+
+    stats = []
+    for row in rows:
+        attempts = row["attempts"]
+        discrimination = None
+        if grouped and row["upper"] and row["lower"]:
+            discrimination = round(
+                row["upper_correct"] / row["upper"] - row["lower_correct"] / row["lower"], 2
+            )
+        text, correct_answer = questions.get(row["question_id"], ("—", None))
+        stats.append({
+            "question_id": row["question_id"],
+            "question": text,
+            "correct_answer": correct_answer,
+            "attempts": attempts,
+            "percent_correct": percent(row["correct"], attempts),
+            "options": [(i, percent(row[f"option{i}"], attempts), i == correct_answer) for i in range(1, 5)],
+            "discrimination": discrimination,
+        })
+    return {"results": results, "grouped": grouped, "questions": stats}
+
+
+def variant_summary():
+    return cache.get_or_set("analytics:variants", _variant_summary, settings.ANALYTICS_CACHE_TTL)
+
+
+def question_stats(variant_id):
+    return cache.get_or_set(
+        f"analytics:variant:{variant_id}", lambda: _question_stats(variant_id), settings.ANALYTICS_CACHE_TTL
+    )
@@ -0,0 +1,145 @@
+"""Сборка telegram Application — общая для polling (run_bot.py) и webhook (ASGI)."""
+import asyncio
+import logging
+
+from django.conf import settings
+from telegram.ext import (
+    ApplicationBuilder,
+    CallbackQueryHandler,
+    CommandHandler,
+    MessageHandler,
+    filters,
+)
+
+from .dispatcher import PerUserUpdateProcessor
+from .journal import answer_journal
+from .maintenance import maintenance_loop
+from .ratelimit import QuizRateLimiter
+from .telegram_logic import (
+    start,
+    handle_quiz_selection,
+    handle_variant_selection,
+    handle_answer,
+    handle_quiz_repeat,
+    show_results,
+    handle_results_page,
+    handle_text_message
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def post_init(application):
+    answer_journal.start()
+    application.bot_data["maintenance_task"] = asyncio.create_task(
+        maintenance_loop(settings.MAINTENANCE_INTERVAL, application.update_processor)
+    )
+
+
+async def post_shutdown(application):
+    task = application.bot_data.pop("maintenance_task", None)
+    if task is not None:
+        task.cancel()
+    # Дописываем в БД ответы, оставшиеся в журнале
+    await answer_journal.stop()
+
+
+def build_application(token=None, request=None):
+    """request — свой BaseRequest для Bot API (в тестах — запись вызовов вместо сети)."""
+    token = token or settings.TELEGRAM_TOKEN
+    if not token:
+        raise ValueError("Не найден TOKEN в переменных окружения")
+
+    builder = ApplicationBuilder().token(token)
+    if request is not None:
+        builder = builder.request(request)
+    app = (
+        builder
+        .concurrent_updates(PerUserUpdateProcessor(
+            max_concurrent_updates=settings.BOT_MAX_PENDING_UPDATES,
+            max_concurrent_handlers=settings.BOT_CONCURRENT_UPDATES,
+        ))
+        .rate_limiter(QuizRateLimiter(
+            global_rate=settings.BOT_RATE_LIMIT_GLOBAL,
+            chat_rate=settings.BOT_RATE_LIMIT_PER_CHAT,
+            chat_burst=settings.BOT_RATE_LIMIT_CHAT_BURST,
+            max_retries=settings.BOT_RATE_LIMIT_MAX_RETRIES,
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("results", show_results))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    app.add_handler(CallbackQueryHandler(handle_answer, pattern=r"^(\d+:)?[1-4]$"))
+    app.add_handler(CallbackQueryHandler(handle_quiz_selection, pattern="^quiz_"))
+    app.add_handler(CallbackQueryHandler(handle_variant_selection, pattern="^variant_"))
+    app.add_handler(CallbackQueryHandler(handle_quiz_repeat, pattern="^again$"))
+    app.add_handler(CallbackQueryHandler(show_results, pattern="^view_results$"))
+    app.add_handler(CallbackQueryHandler(handle_results_page, pattern="^results_[on]_"))
+    return app
+
+
+_webhook_app = None
+_webhook_lock = asyncio.Lock()
+
+
+async def get_webhook_application():
+    """Application для webhook-режима: создаётся и запускается при первом апдейте
+    в том же event loop, что и ASGI-сервер (рядом с админкой)."""
+    global _webhook_app
+    if _webhook_app is None:
+        async with _webhook_lock:
+            if _webhook_app is None:
+                app = build_application()
+                await app.initialize()
+                if app.post_init:
+                    await app.post_init(app)
+                await app.start()
+                _webhook_app = app
+    return _webhook_app
+
+
+async def stop_webhook_application():
+    """Останавливает webhook-Application: post_shutdown дописывает журнал ответов
+    и отменяет фоновую очистку."""
+    global _webhook_app
+    async with _webhook_lock:
+        app, _webhook_app = _webhook_app, None
+        if app is None:
+            return
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def with_bot_lifespan(django_app):
+    """ASGI-обёртка: Django не принимает lifespan-события, поэтому запуск и
+    остановку бота (редеплой, SIGTERM) обрабатываем здесь, остальное — Django."""
+
+    async def application(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await django_app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if settings.TELEGRAM_TOKEN and settings.TELEGRAM_WEBHOOK_SECRET:
+                    try:
+                        await get_webhook_application()
+                    except Exception:
+                        # Не валим сервер (админка работает); повторим на первом апдейте
+                        logger.exception("Не удалось запустить бота при старте")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await stop_webhook_application()
+                except Exception:
+                    logger.exception("Ошибка при остановке бота")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return application
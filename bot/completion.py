@@ -0,0 +1,45 @@
+"""Сохранение результата викторины одной транзакцией."""
+from django.db import transaction
+
+from .models import PendingAnswer, QuizProgress, UserAnswer, UserProfile, UserResult
+from .progress import apply_result
+
+
+def build_answers(result, answers):
+    """UserAnswer-объекты из ответов сессии ([question_id, selected, is_correct]).
+
+    Проверка UserAnswer.clean выполняется здесь, т.к. bulk_create не вызывает save().
+    """
+    objs = []
+    for question_id, selected, is_correct in answers:
+        answer = UserAnswer(result=result, question_id=question_id, selected_option=selected, is_correct=is_correct)
+        answer.clean()
+        objs.append(answer)
+    return objs
+
+
+def save_quiz_result(user_id, quiz_id, variant_id, score, total, answers, attempt=None):
+    """Создаёт UserResult и все UserAnswer одной транзакцией.
+
+    6 запросов при любом числе ответов (до 500, дальше +1 INSERT на каждые 500):
+    профиль, UserResult, UserAnswer одной вставкой, удаление строк журнала
+    попытки (PendingAnswer; без attempt — не выполняется), QuizProgress —
+    SELECT FOR UPDATE и UPDATE (на первой попытке викторины ещё INSERT).
+    """
+    with transaction.atomic():
+        profile = UserProfile.objects.only("id").get(user_id=user_id)
+        result = UserResult.objects.create(
+            user_profile=profile,
+            quiz_id=quiz_id,
+            variant_id=variant_id,
+            score=score,
+            total=total,
+        )
+        UserAnswer.objects.bulk_create(build_answers(result, answers), batch_size=500)
+        if attempt:
+            PendingAnswer.objects.filter(attempt=attempt).delete()
+
+        progress, _ = QuizProgress.objects.select_for_update().get_or_create(user_profile=profile, quiz_id=quiz_id)
+        apply_result(progress, score, total, variant_id, result.timestamp)
+        progress.save()
+    return result
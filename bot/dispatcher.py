@@ -0,0 +1,84 @@
+"""Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+Апдейты разных пользователей обрабатываются одновременно (не больше
+max_concurrent_handlers), апдейты одного пользователя — строго по очереди.
+Поэтому обработчики одного пользователя (например, handle_answer и проверка
+state["answered"]) никогда не выполняются параллельно.
+"""
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """max_concurrent_updates — сколько апдейтов может ждать/выполняться всего,
+    max_concurrent_handlers — сколько обработчиков выполняется одновременно."""
+
+    def __init__(self, max_concurrent_updates=1024, max_concurrent_handlers=16):
+        super().__init__(max_concurrent_updates)
+        self.max_concurrent_handlers = max_concurrent_handlers
+        self._handlers = asyncio.Semaphore(max_concurrent_handlers)
+        self._locks = {}  # user_id -> asyncio.Lock
+        self._pending = {}  # user_id -> число апдейтов в очереди пользователя (вкл. текущий)
+        self.active = 0
+        self.processed = 0
+        self.max_queue_depth = 0
+
+    @staticmethod
+    def user_key(update):
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    def queue_depths(self):
+        """Глубина очереди по пользователям: {user_id: pending}."""
+        return dict(self._pending)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "users": len(self._pending),
+            "pending": sum(self._pending.values()),
+            "max_queue_depth": self.max_queue_depth,
+            "processed": self.processed,
+        }
+
+    async def do_process_update(self, update, coroutine):
+        key = self.user_key(update)
+        if key is None:
+            async with self._handlers:
+                await self._run(coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        depth = self._pending.get(key, 0) + 1
+        self._pending[key] = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        try:
+            async with lock:
+                async with self._handlers:
+                    await self._run(coroutine)
+        finally:
+            depth = self._pending[key] - 1
+            if depth:
+                self._pending[key] = depth
+            else:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
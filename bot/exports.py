@@ -0,0 +1,166 @@
+"""Выгрузка результатов и ответов в CSV/XLSX с постоянным расходом памяти.
+
+Строки читаются порциями по EXPORT_CHUNK_SIZE с курсором по id (keyset:
+WHERE id > последний ORDER BY id LIMIT n) через values_list с JOIN
+пользователя, викторины, варианта и вопроса — без моделей и без кэша QuerySet.
+
+В админке CSV отдаётся StreamingHttpResponse из асинхронного генератора:
+под ASGI (uvicorn) каждая порция читается через sync_to_async и сразу уходит
+клиенту. Синхронный итератор Django под ASGI сначала собрал бы весь файл в
+память. XLSX (openpyxl write_only, файл на диске) формируется только командой
+manage.py export_results — книгу нельзя отдавать по мере записи.
+"""
+import csv
+import io
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+# (заголовок, поле values_list)
+RESULT_COLUMNS = (
+    ("result_id", "id"),
+    ("user_id", "user_profile__user_id"),
+    ("user_name", "user_profile__user_name"),
+    ("quiz", "quiz__title"),
+    ("variant", "variant__title"),
+    ("score", "score"),
+    ("total", "total"),
+    ("timestamp", "timestamp"),
+)
+
+ANSWER_COLUMNS = (
+    ("result_id", "result_id"),
+    ("user_id", "result__user_profile__user_id"),
+    ("user_name", "result__user_profile__user_name"),
+    ("quiz", "result__quiz__title"),
+    ("variant", "result__variant__title"),
+    ("timestamp", "result__timestamp"),
+    ("question_id", "question_id"),
+    ("question", "question__question"),
+    ("selected_option", "selected_option"),
+    ("correct_answer", "question__correct_answer"),
+    ("is_correct", "is_correct"),
+)
+
+# Символы, с которых Excel начинает формулу: такие ячейки экранируем апострофом
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _local(value):
+    # openpyxl не пишет aware datetime — выгружаем местное время без tzinfo
+    return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+
+
+def fetch_chunk(queryset, columns, after_id, chunk_size):
+    """(последний id, строки) — до chunk_size строк с id > after_id в порядке columns."""
+    fields = [field for _, field in columns]
+    dates = [i for i, field in enumerate(fields) if field.endswith("timestamp")]
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    rows = []
+    last_id = after_id
+    for last_id, *row in queryset.order_by("id").values_list("id", *fields)[:chunk_size]:
+        for i in dates:
+            if row[i] is not None:
+                row[i] = _local(row[i])
+        rows.append(row)
+    return last_id, rows
+
+
+def export_chunks(queryset, columns, chunk_size=None):
+    """Генератор порций строк (по одному запросу на порцию)."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    after_id = None
+    while True:
+        after_id, rows = fetch_chunk(queryset, columns, after_id, chunk_size)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+
+
+async def aexport_chunks(queryset, columns, chunk_size=None):
+    """То же для async-кода: каждая порция читается в потоке через sync_to_async."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    after_id = None
+    while True:
+        after_id, rows = await sync_to_async(fetch_chunk)(queryset, columns, after_id, chunk_size)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+
+
+def export_rows(queryset, columns, chunk_size=None):
+    """Генератор строк в порядке columns."""
+    for rows in export_chunks(queryset, columns, chunk_size):
+        yield from rows
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    if hasattr(value, "isoformat"):
+        return value.isoformat(sep=" ", timespec="seconds")
+    return value
+
+
+def csv_header(columns):
+    # UTF-8 с BOM — Excel открывает кириллицу без вопросов
+    return "\ufeff" + csv_text([[header for header, _ in columns]])
+
+
+def csv_text(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+    return buffer.getvalue()
+
+
+def iter_csv(columns, chunks):
+    """Текст CSV порциями: заголовок, затем по порции на каждую порцию строк."""
+    yield csv_header(columns)
+    for rows in chunks:
+        yield csv_text(rows)
+
+
+async def aiter_csv(columns, chunks):
+    yield csv_header(columns)
+    async for rows in chunks:
+        yield csv_text(rows)
+
+
+def _xlsx_value(sheet, value):
+    # openpyxl считает строку с «=» формулой: такие значения пишем явной строковой ячейкой
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.data_type = "s"
+        return cell
+    return value
+
+
+def write_xlsx(fileobj, columns, rows, title="export"):
+    """Пишет строки в XLSX (openpyxl write_only: строки сбрасываются на диск по мере записи)."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append([header for header, _ in columns])
+    for row in rows:
+        sheet.append([_xlsx_value(sheet, value) for value in row])
+    workbook.save(fileobj)
+
+
+def csv_response(queryset, columns, filename):
+    response = StreamingHttpResponse(
+        aiter_csv(columns, aexport_chunks(queryset, columns)), content_type="text/csv; charset=utf-8"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_filename(kind, extension):
+    return f"{kind}_{timezone.localtime():%Y%m%d_%H%M}.{extension}"
@@ -0,0 +1,316 @@
+"""Доставка картинок вопросов в Telegram с кэшем file_id.
+
+После первой отправки фото по image_url Telegram возвращает file_id — повторные
+отправки идут по нему, без скачивания внешнего URL. Кэш ключуется самим URL
+(в памяти процесса + таблица TelegramImage), поэтому смена image_url у вопроса
+автоматически даёт промах; старую запись сбрасывает сигнал (bot/signals.py).
+Если Telegram отверг сохранённый file_id, он забывается и фото уходит по URL.
+
+prewarm_variants заранее (перед экзаменом) скачивает картинки вариантов
+пулом с ограниченной параллельностью (ограничение держится до загрузки в чат,
+поэтому в памяти не больше concurrency картинок), проверяет и при необходимости уменьшает
+их (Pillow) и загружает по одному разу в служебный чат, чтобы кэш был тёплым.
+Загрузки в чат идут по одной (лимит Telegram — на чат) через ограничитель
+QuizRateLimiter; на RetryAfter загрузка ждёт указанное время и повторяется.
+"""
+import asyncio
+import io
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import ExtBot
+
+from .ratelimit import QuizRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFileCache:
+    """url -> file_id: LRU в памяти перед таблицей TelegramImage."""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, url):
+        with self._lock:
+            file_id = self._data.get(url)
+            if file_id is not None:
+                self._data.move_to_end(url)
+            return file_id
+
+    def _set_local(self, url, file_id):
+        with self._lock:
+            self._data[url] = file_id
+            self._data.move_to_end(url)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, url):
+        file_id = self._get_local(url)
+        if file_id is None:
+            from .models import TelegramImage
+
+            file_id = TelegramImage.objects.filter(url=url).values_list("file_id", flat=True).first()
+            if file_id is not None:
+                self._set_local(url, file_id)
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    def known(self, urls):
+        """Множество urls, для которых уже есть file_id (одним запросом к БД)."""
+        from .models import TelegramImage
+
+        found = {url for url in urls if self._get_local(url) is not None}
+        rest = [url for url in urls if url not in found]
+        if rest:
+            for url, file_id in TelegramImage.objects.filter(url__in=rest).values_list("url", "file_id"):
+                self._set_local(url, file_id)
+                found.add(url)
+        return found
+
+    def remember(self, url, file_id):
+        from .models import TelegramImage
+
+        self._set_local(url, file_id)
+        TelegramImage.objects.update_or_create(url=url, defaults={"file_id": file_id})
+
+    def forget(self, url):
+        from .models import TelegramImage
+
+        with self._lock:
+            self._data.pop(url, None)
+        TelegramImage.objects.filter(url=url).delete()
+
+    def clear_local(self):
+        with self._lock:
+            self._data.clear()
+
+    async def aget(self, url):
+        file_id = self._get_local(url)
+        if file_id is not None:
+            self.hits += 1
+            return file_id
+        return await sync_to_async(self.get)(url)
+
+    async def aremember(self, url, file_id):
+        await sync_to_async(self.remember)(url, file_id)
+
+    async def aforget(self, url):
+        await sync_to_async(self.forget)(url)
+
+
+image_files = ImageFileCache()
+
+
+async def send_photo_cached(bot, chat_id, url, **kwargs):
+    """send_photo по кэшированному file_id, иначе по URL (с запоминанием file_id)."""
+    file_id = await image_files.aget(url)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning("Сохранённый file_id для %s отклонён: %s", url, e)
+            await image_files.aforget(url)
+
+    message = await bot.send_photo(chat_id=chat_id, photo=url, **kwargs)
+    if message.photo:
+        await image_files.aremember(url, message.photo[-1].file_id)
+    return message
+
+
+# Ограничения Telegram для фото: до 10 МБ, сумма сторон до 10000, соотношение до 1:20
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_SIDES_SUM = 10000
+DOWNLOAD_MAX_BYTES = 50 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 30
+UPLOAD_MAX_RETRIES = 5
+
+
+class PrewarmReport:
+    def __init__(self, total=0):
+        self.total = total
+        self.cached = 0
+        self.warmed = 0
+        self.resized = 0
+        self.failed = []  # [(url, причина)]
+
+    def summary(self):
+        return (
+            f"Картинок: {self.total}, уже в кэше: {self.cached}, загружено: {self.warmed}"
+            f" (уменьшено: {self.resized}), ошибок: {len(self.failed)}"
+        )
+
+
+def prepare_image(data, max_side=None):
+    """Проверяет картинку; возвращает (bytes, уменьшена ли) или бросает ValueError."""
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise ValueError(f"не изображение: {e}")
+
+    width, height = image.size
+    if max(width, height) > 20 * min(width, height):
+        raise ValueError(f"недопустимые пропорции {width}x{height}")
+
+    max_side = max_side or settings.IMAGE_MAX_SIDE
+    if max(width, height) <= max_side and width + height <= PHOTO_MAX_SIDES_SUM and len(data) <= PHOTO_MAX_BYTES:
+        return data, False
+
+    image.thumbnail((max_side, max_side))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85, optimize=True)
+    if buffer.tell() > PHOTO_MAX_BYTES:
+        raise ValueError("слишком большой файл после уменьшения")
+    return buffer.getvalue(), True
+
+
+async def _download(client, url):
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > DOWNLOAD_MAX_BYTES:
+                raise ValueError("файл больше 50 МБ")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _upload(bot, upload_lock, chat_id, data):
+    """Одна загрузка за раз; RetryAfter — пауза на указанное время и повтор."""
+    async with upload_lock:
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=data, disable_notification=True)
+            except RetryAfter as e:
+                if attempt == UPLOAD_MAX_RETRIES:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("Прогрев: RetryAfter %s с, повтор %d", retry_after, attempt + 1)
+                await asyncio.sleep(retry_after)
+
+
+async def _prewarm_one(bot, client, semaphore, upload_lock, chat_id, url, resize, report):
+    """Возвращает file_id или None (причина — в report.failed).
+
+    Семафор держится до конца загрузки в чат: в памяти не больше concurrency
+    скачанных картинок, даже если загрузки в чат идут медленнее скачивания.
+    """
+    async with semaphore:
+        try:
+            data = await _download(client, url)
+        except (httpx.HTTPError, ValueError) as e:
+            report.failed.append((url, f"скачивание: {e}"))
+            return None
+        try:
+            if resize:
+                data, resized = await asyncio.to_thread(prepare_image, data)
+                report.resized += resized
+            message = await _upload(bot, upload_lock, chat_id, data)
+        except (ValueError, TelegramError) as e:
+            report.failed.append((url, str(e)))
+            return None
+    report.warmed += 1
+    return message.photo[-1].file_id
+
+
+async def prewarm_urls(urls, chat_id, bot=None, concurrency=None, resize=True, report=None):
+    """Загружает urls в чат chat_id; возвращает {url: file_id} для успешных."""
+    report = report or PrewarmReport(len(urls))
+    semaphore = asyncio.Semaphore(concurrency or settings.IMAGE_PREWARM_CONCURRENCY)
+    upload_lock = asyncio.Lock()
+    own_bot = bot is None
+    if own_bot:
+        bot = ExtBot(settings.TELEGRAM_TOKEN, rate_limiter=QuizRateLimiter(
+            global_rate=settings.BOT_RATE_LIMIT_GLOBAL,
+            chat_rate=settings.BOT_RATE_LIMIT_PER_CHAT,
+            chat_burst=settings.BOT_RATE_LIMIT_CHAT_BURST,
+            max_retries=settings.BOT_RATE_LIMIT_MAX_RETRIES,
+        ))
+        await bot.initialize()
+    try:
+        async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT, follow_redirects=True) as client:
+            file_ids = await asyncio.gather(
+                *(_prewarm_one(bot, client, semaphore, upload_lock, chat_id, url, resize, report) for url in urls)
+            )
+    finally:
+        if own_bot:
+            await bot.shutdown()
+    return {url: file_id for url, file_id in zip(urls, file_ids) if file_id}
+
+
+def variant_image_urls(variant_ids):
+    from .models import Question
+
+    return list(
+        Question.objects.filter(variant_id__in=variant_ids)
+        .exclude(image_url__isnull=True)
+        .exclude(image_url="")
+        .order_by("image_url")
+        .values_list("image_url", flat=True)
+        .distinct()
+    )
+
+
+def prewarm_variants(variant_ids, chat_id=None, bot=None, concurrency=None, resize=True, force=False):
+    """Синхронная обёртка для команды (и фоновой задачи админки): прогревает картинки вариантов."""
+    chat_id = chat_id or settings.IMAGE_STAGING_CHAT_ID
+    if not chat_id:
+        raise ValueError("Не задан служебный чат (IMAGE_STAGING_CHAT_ID)")
+
+    urls = variant_image_urls(variant_ids)
+    report = PrewarmReport(len(urls))
+    if not force:
+        known = image_files.known(urls)
+        report.cached = len(known)
+        urls = [url for url in urls if url not in known]
+    if urls:
+        warmed = asyncio.run(prewarm_urls(urls, chat_id, bot, concurrency, resize, report))
+        for url, file_id in warmed.items():
+            image_files.remember(url, file_id)
+    return report
+
+
+def prewarm_variants_in_background(variant_ids, chat_id=None):
+    """Прогрев в отдельном потоке (для админки: не держать HTTP-запрос); итог — в лог."""
+    chat_id = chat_id or settings.IMAGE_STAGING_CHAT_ID
+    if not chat_id:
+        raise ValueError("Не задан служебный чат (IMAGE_STAGING_CHAT_ID)")
+
+    def run():
+        from django.db import close_old_connections
+
+        try:
+            report = prewarm_variants(variant_ids, chat_id=chat_id)
+            logger.info("Прогрев вариантов %s: %s", variant_ids, report.summary())
+            for url, reason in report.failed:
+                logger.warning("Прогрев %s: %s", url, reason)
+        except Exception:
+            logger.exception("Ошибка прогрева вариантов %s", variant_ids)
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name="prewarm-images", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,337 @@
+"""Потоковый импорт банка вопросов из CSV, XLSX и Google Sheets.
+
+Источник (CsvSource, XlsxSource, GoogleSheetSource) отдаёт заголовок и
+генератор строк (номер строки, {колонка: текст}); дальше путь общий: строки
+группируются по variant_title за один проход, вопросы пишутся bulk_create
+пачками внутри одной транзакции — при ошибке не остаётся частичного импорта.
+Пропущенные и некорректные строки попадают в отчёт с номером строки и причиной.
+
+Источники не держат файл целиком: CSV читается построчно, XLSX — openpyxl в
+режиме read_only, таблица Google — диапазонами по SHEETS_BATCH_ROWS строк.
+
+Инкрементальный режим (incremental=True) сравнивает отпечатки строк
+(Question.content_hash) с вопросами варианта и пишет только разницу:
+новые — bulk_create, изменённые (правильный ответ, картинка, тег, сложность) —
+bulk_update, исчезнувшие — удаляются, а если на них уже есть ответы
+UserAnswer — открепляются от варианта (variant=None), чтобы не терять историю.
+
+Необязательные колонки tag и difficulty заполняют страты для вариантов-пулов.
+"""
+import csv
+import zipfile
+
+import gspread
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+from gspread.utils import extract_id_from_url, rowcol_to_a1
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from .models import Question, Quiz, QuizVariant, UserAnswer, question_content_hash
+from .question_cache import question_bank
+
+REQUIRED_COLUMNS = {"variant_title", "question_text", "answer_1", "answer_2", "answer_3", "answer_4"}
+
+OPTION_MAX_LENGTH = Question._meta.get_field("option1").max_length
+IMAGE_URL_MAX_LENGTH = Question._meta.get_field("image_url").max_length
+VARIANT_TITLE_MAX_LENGTH = QuizVariant._meta.get_field("title").max_length
+TAG_MAX_LENGTH = Question._meta.get_field("tag").max_length
+
+# Поля, которые обновляются у найденного по отпечатку вопроса
+SYNC_FIELDS = ("correct_answer", "image_url", "tag", "difficulty")
+
+_validate_url = URLValidator()
+
+
+class QuestionImportError(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.detached = 0
+        self.unchanged = 0
+        self.variants = 0
+        self.skipped = []  # [(номер строки, причина)]
+
+    def skip(self, line, reason):
+        self.skipped.append((line, reason))
+
+    def summary(self):
+        text = f"Создано вопросов: {self.created}, вариантов: {self.variants}, пропущено строк: {len(self.skipped)}"
+        if self.updated or self.deleted or self.detached or self.unchanged:
+            text += (
+                f", обновлено: {self.updated}, удалено: {self.deleted},"
+                f" откреплено: {self.detached}, без изменений: {self.unchanged}"
+            )
+        return text
+
+
+def _text(value):
+    """Значение ячейки XLSX/Sheets → строка, как её записал бы CSV."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class CsvSource:
+    """Текстовый CSV-поток (csv.DictReader)."""
+
+    def __init__(self, fileobj):
+        self._reader = csv.DictReader(fileobj)
+        self.fieldnames = self._reader.fieldnames or []
+
+    def rows(self):
+        for row in self._reader:
+            yield self._reader.line_num, row
+
+    def close(self):
+        pass  # файл закрывает тот, кто его открыл
+
+
+class XlsxSource:
+    """Лист книги XLSX; openpyxl read_only разбирает лист потоком, не загружая его целиком."""
+
+    def __init__(self, fileobj, sheet=None):
+        try:
+            self._workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+            raise QuestionImportError(f"Не удалось открыть XLSX: {e}")
+        try:
+            self._sheet = self._workbook[sheet] if sheet else self._workbook.active
+        except KeyError:
+            self._workbook.close()
+            raise QuestionImportError(f"В книге нет листа «{sheet}»")
+        header = next(self._sheet.iter_rows(max_row=1, values_only=True), ())
+        self.fieldnames = [_text(value).strip() for value in header]
+
+    def rows(self):
+        for line, values in enumerate(self._sheet.iter_rows(min_row=2, values_only=True), start=2):
+            if all(value is None for value in values):
+                continue
+            yield line, {name: _text(value) for name, value in zip(self.fieldnames, values) if name}
+
+    def close(self):
+        # read_only-книга держит открытый zip до явного close()
+        self._workbook.close()
+
+
+class GoogleSheetSource:
+    """Лист таблицы Google (gspread.Worksheet), читается диапазонами по batch_rows строк."""
+
+    def __init__(self, worksheet, batch_rows=None):
+        self._worksheet = worksheet
+        self.batch_rows = batch_rows or settings.SHEETS_BATCH_ROWS
+        self.fieldnames = [name.strip() for name in worksheet.row_values(1)]
+
+    def rows(self):
+        width = len(self.fieldnames)
+        if not width:
+            return
+        last_row = self._worksheet.row_count
+        for start in range(2, last_row + 1, self.batch_rows):
+            end = min(start + self.batch_rows - 1, last_row)
+            values = self._worksheet.get(f"{rowcol_to_a1(start, 1)}:{rowcol_to_a1(end, width)}")
+            for line, cells in enumerate(values, start=start):
+                if any(cells):
+                    yield line, {name: _text(value) for name, value in zip(self.fieldnames, cells) if name}
+
+    def close(self):
+        pass
+
+
+def open_google_sheet(url_or_key, worksheet=None, client=None, batch_rows=None):
+    """GoogleSheetSource по ссылке или ключу таблицы. client — gspread.Client
+    (по умолчанию сервисный аккаунт из GOOGLE_SERVICE_ACCOUNT_FILE)."""
+    key = extract_id_from_url(url_or_key) if url_or_key.startswith("http") else url_or_key
+    try:
+        if client is None:
+            client = gspread.service_account(filename=settings.GOOGLE_SERVICE_ACCOUNT_FILE)
+        spreadsheet = client.open_by_key(key)
+        sheet = spreadsheet.worksheet(worksheet) if worksheet else spreadsheet.sheet1
+        return GoogleSheetSource(sheet, batch_rows)
+    except gspread.exceptions.WorksheetNotFound:
+        raise QuestionImportError(f"В таблице нет листа «{worksheet}»")
+    except gspread.exceptions.SpreadsheetNotFound:
+        raise QuestionImportError("Таблица не найдена или не открыта сервисному аккаунту")
+    except (gspread.exceptions.GSpreadException, OSError, ValueError) as e:
+        raise QuestionImportError(f"Ошибка доступа к Google Sheets: {e}")
+
+
+def _cell(row, key):
+    return (row.get(key) or "").strip()
+
+
+def parse_row(row):
+    """Возвращает (variant_title, поля Question) или бросает ValueError с причиной."""
+    variant_title = _cell(row, "variant_title")
+    if not variant_title:
+        raise ValueError("пустой variant_title")
+    if len(variant_title) > VARIANT_TITLE_MAX_LENGTH:
+        raise ValueError("слишком длинный variant_title")
+
+    question = _cell(row, "question_text")
+    if not question:
+        raise ValueError("пустой question_text")
+
+    options = [_cell(row, f"answer_{i}") for i in range(1, 5)]
+    if any(len(o) > OPTION_MAX_LENGTH for o in options):
+        raise ValueError(f"вариант ответа длиннее {OPTION_MAX_LENGTH} символов")
+
+    correct_option = None
+    for i in range(1, 5):
+        if _cell(row, f"is_correct_{i}").lower() == "true":
+            correct_option = i
+            break
+    if correct_option is None:
+        raise ValueError("не указан правильный ответ (is_correct_1..4)")
+
+    image_url = _cell(row, "image_url") or None
+    if image_url:
+        if len(image_url) > IMAGE_URL_MAX_LENGTH:
+            raise ValueError("слишком длинный image_url")
+        try:
+            _validate_url(image_url)
+        except ValidationError:
+            raise ValueError("некорректный image_url")
+
+    tag = _cell(row, "tag")
+    if len(tag) > TAG_MAX_LENGTH:
+        raise ValueError("слишком длинный tag")
+    difficulty = _cell(row, "difficulty") or None
+    if difficulty is not None:
+        if not difficulty.isdigit():
+            raise ValueError("difficulty должен быть целым неотрицательным числом")
+        difficulty = int(difficulty)
+
+    return variant_title, {
+        "question": question,
+        "option1": options[0],
+        "option2": options[1],
+        "option3": options[2],
+        "option4": options[3],
+        "correct_answer": correct_option,
+        "image_url": image_url,
+        "tag": tag,
+        "difficulty": difficulty,
+        "content_hash": question_content_hash(question, options),
+    }
+
+
+def sync_variant(variant, incoming, report, batch_size=1000):
+    """Приводит вопросы варианта к incoming ({content_hash: поля}), записывая только разницу."""
+    existing = {}
+    duplicates = []
+    rows = (
+        Question.objects.filter(variant=variant)
+        .order_by("id")
+        .values_list("id", "content_hash", *SYNC_FIELDS)
+    )
+    for qid, content_hash, *values in rows:
+        if content_hash in existing:
+            duplicates.append(qid)  # дубликаты прошлых повторных импортов
+        else:
+            existing[content_hash] = (qid, tuple(values))
+
+    to_create, to_update = [], []
+    for content_hash, fields in incoming.items():
+        current = existing.pop(content_hash, None)
+        if current is None:
+            to_create.append(Question(variant=variant, **fields))
+        elif current[1] != tuple(fields[name] for name in SYNC_FIELDS):
+            to_update.append(Question(id=current[0], **{name: fields[name] for name in SYNC_FIELDS}))
+        else:
+            report.unchanged += 1
+
+    Question.objects.bulk_create(to_create, batch_size=batch_size)
+    Question.objects.bulk_update(to_update, SYNC_FIELDS, batch_size=batch_size)
+    report.created += len(to_create)
+    report.updated += len(to_update)
+
+    stale = duplicates + [qid for qid, _ in existing.values()]
+    if stale:
+        answered = set(
+            UserAnswer.objects.filter(question_id__in=stale).values_list("question_id", flat=True).distinct()
+        )
+        if answered:
+            report.detached += Question.objects.filter(id__in=answered).update(variant=None)
+        removable = [qid for qid in stale if qid not in answered]
+        if removable:
+            _, per_model = Question.objects.filter(id__in=removable).delete()
+            report.deleted += per_model.get(Question._meta.label, 0)
+
+
+def import_questions(source, quiz_title, batch_size=1000, incremental=False):
+    """Импортирует вопросы из источника (CsvSource, XlsxSource, GoogleSheetSource) в викторину quiz_title.
+
+    Источник закрывается в любом случае — и при отказе по колонкам, и при ошибке записи.
+    """
+    try:
+        return _import_questions(source, quiz_title, batch_size, incremental)
+    finally:
+        source.close()
+
+
+def _import_questions(source, quiz_title, batch_size, incremental):
+    missing = REQUIRED_COLUMNS - set(source.fieldnames)
+    if missing:
+        raise QuestionImportError(
+            "Файл должен содержать колонки: variant_title, question_text, answer_1..answer_4"
+        )
+
+    report = ImportReport()
+    with transaction.atomic():
+        quiz, _ = Quiz.objects.get_or_create(title=quiz_title)
+        variants = {}
+        pending = {}  # variant_title -> {content_hash: поля} (только incremental)
+        batch = []
+        for line, row in source.rows():
+            try:
+                variant_title, fields = parse_row(row)
+            except ValueError as e:
+                report.skip(line, str(e))
+                continue
+
+            variant = variants.get(variant_title)
+            if variant is None:
+                variant, _ = QuizVariant.objects.get_or_create(title=variant_title, quiz=quiz)
+                variants[variant_title] = variant
+
+            if incremental:
+                incoming = pending.setdefault(variant_title, {})
+                if fields["content_hash"] in incoming:
+                    report.skip(line, "дубликат вопроса в файле")
+                else:
+                    incoming[fields["content_hash"]] = fields
+                continue
+
+            batch.append(Question(variant=variant, **fields))
+            if len(batch) >= batch_size:
+                Question.objects.bulk_create(batch)
+                report.created += len(batch)
+                batch = []
+        if batch:
+            Question.objects.bulk_create(batch)
+            report.created += len(batch)
+        for variant_title, incoming in pending.items():
+            sync_variant(variants[variant_title], incoming, report, batch_size)
+
+        report.variants = len(variants)
+        # bulk_create не шлёт сигналы — сбрасываем кэш банка вопросов вручную
+        variant_ids = [v.id for v in variants.values()]
+        transaction.on_commit(lambda: [question_bank.invalidate(vid) for vid in variant_ids])
+    return report
+
+
+def import_questions_csv(fileobj, quiz_title, batch_size=1000, incremental=False):
+    """Импортирует вопросы из текстового CSV-потока в викторину quiz_title."""
+    return import_questions(CsvSource(fileobj), quiz_title, batch_size, incremental)
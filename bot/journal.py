@@ -0,0 +1,146 @@
+"""Журнал ответов с отложенной записью (write-behind).
+
+handle_answer только добавляет ответ в очередь в памяти; фоновая asyncio-задача
+пачками пишет очередь в PendingAnswer. Пачка, которую не удалось записать,
+возвращается в начало очереди и повторяется на следующем такте. После падения
+процесса прогресс попытки восстанавливается из PendingAnswer (см.
+restore_pending_answers).
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerJournal:
+    def __init__(self, flush_interval=1.0, batch_size=200):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = []  # (attempt, user_id, question_id, selected, is_correct)
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, attempt, user_id, question_id, selected, is_correct):
+        self._buffer.append((attempt, user_id, question_id, selected, is_correct))
+        if self._task is None:
+            self.start()
+        elif len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и дописывает всё, что осталось в очереди."""
+        if self._task is not None:
+            self._closed = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Пишет очередь в БД; возвращает False, если пачку записать не удалось
+        (она остаётся в очереди до следующей попытки)."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                try:
+                    await sync_to_async(write_pending_answers)(batch)
+                except Exception:
+                    logger.exception("Не удалось записать %d ответ(ов) из журнала, повтор позже", len(batch))
+                    return False
+                del self._buffer[:len(batch)]
+        return True
+
+    async def discard(self, attempt):
+        """Убирает из очереди ответы попытки (перед её сохранением в UserAnswer)
+        и возвращает их — если сохранить не удалось, их возвращают через requeue."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            removed = [r for r in self._buffer if r[0] == attempt]
+            self._buffer = [r for r in self._buffer if r[0] != attempt]
+        return removed
+
+    async def requeue(self, rows):
+        """Возвращает в начало очереди ответы, снятые discard."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._buffer[:0] = rows
+
+
+def write_pending_answers(batch):
+    from .models import PendingAnswer
+
+    PendingAnswer.objects.bulk_create(
+        PendingAnswer(attempt=attempt, user_id=user_id, question_id=question_id,
+                      selected_option=selected, is_correct=is_correct)
+        for attempt, user_id, question_id, selected, is_correct in batch
+    )
+
+
+def restore_pending_answers(state):
+    """Дополняет состояние, загруженное из БД, ответами из журнала."""
+    from .models import PendingAnswer
+
+    attempt = state.get("attempt")
+    if not attempt or state.get("stage") != "in_quiz":
+        return state
+    rows = list(
+        PendingAnswer.objects.filter(attempt=attempt)
+        .order_by("id")
+        .values_list("question_id", "selected_option", "is_correct")
+    )
+    if len(rows) > len(state.get("answers", [])):
+        state["answers"] = [list(r) for r in rows]
+        state["index"] = len(rows)
+        state["score"] = sum(1 for r in rows if r[2])
+    # Показанное сообщение может быть дальше восстановленного индекса (ответы,
+    # не дошедшие до БД при падении): handle_answer тогда показывает вопрос заново
+    state["answered"] = False
+    state["restored"] = True
+    state.pop("message_id", None)
+    return state
+
+
+def purge_stale_pending_answers(max_age):
+    """Удаляет ответы брошенных попыток старше max_age секунд."""
+    from .models import PendingAnswer
+
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    deleted, _ = PendingAnswer.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+answer_journal = AnswerJournal(
+    flush_interval=getattr(settings, "ANSWER_JOURNAL_FLUSH_INTERVAL", 1.0),
+    batch_size=getattr(settings, "ANSWER_JOURNAL_BATCH_SIZE", 200),
+)
@@ -0,0 +1,59 @@
+"""Периодическая очистка: истёкший доступ, старые сессии и журнал брошенных попыток.
+
+Запускается фоновой задачей бота (см. bot/application.py) и командой
+manage.py run_maintenance — вне обработки запросов пользователей. Фоновая
+задача заодно пишет в лог статистику PerUserUpdateProcessor.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+
+from .journal import purge_stale_pending_answers
+from .models import AllowedUser, InviteToken
+from .sessions import purge_expired_sessions
+
+logger = logging.getLogger(__name__)
+
+
+def expire_access(user_id=None):
+    """Удаляет AllowedUser викторин, у которых не осталось действующих токенов.
+
+    Один DELETE с подзапросом (used_count < usage_limit). Возвращает число удалённых строк.
+    """
+    valid_tokens = InviteToken.objects.filter(quiz=OuterRef("quiz"), used_count__lt=F("usage_limit"))
+    expired = AllowedUser.objects.filter(~Exists(valid_tokens))
+    if user_id is not None:
+        expired = expired.filter(user_profile__user_id=user_id)
+    deleted, _ = expired.delete()
+    return deleted
+
+
+def run_maintenance():
+    ttl = getattr(settings, "QUIZ_SESSION_TTL", 6 * 3600)
+    return {
+        "access": expire_access(),
+        "sessions": purge_expired_sessions(ttl),
+        "pending_answers": purge_stale_pending_answers(ttl),
+    }
+
+
+def report_updates(update_processor, top=5):
+    """Пишет в лог нагрузку диспетчера апдейтов и самые длинные очереди пользователей."""
+    depths = update_processor.queue_depths()
+    deepest = sorted(depths.items(), key=lambda item: item[1], reverse=True)[:top]
+    logger.info("Апдейты: %s, самые длинные очереди: %s", update_processor.stats(), deepest)
+
+
+async def maintenance_loop(interval, update_processor=None):
+    while True:
+        try:
+            removed = await sync_to_async(run_maintenance)()
+            logger.info("Очистка: %s", removed)
+        except Exception:
+            logger.exception("Ошибка периодической очистки")
+        if update_processor is not None:
+            report_updates(update_processor)
+        await asyncio.sleep(interval)
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from bot.completion import save_quiz_result
+from bot.models import Question, Quiz, QuizVariant, UserAnswer, UserProfile, UserResult
+
+
+def save_quiz_result_legacy(user_id, quiz_id, variant_id, score, total, answers):
+    """Старый путь из send_question: по одному create на каждый ответ."""
+    quiz = Quiz.objects.get(id=quiz_id)
+    variant = QuizVariant.objects.get(id=variant_id)
+    profile = UserProfile.objects.filter(user_id=user_id).first()
+    result = UserResult.objects.create(user_profile=profile, quiz=quiz, variant=variant, score=score, total=total)
+    for question_id, selected, is_correct in answers:
+        UserAnswer.objects.create(result=result, question_id=question_id, selected_option=selected, is_correct=is_correct)
+    return result
+
+
+class Command(BaseCommand):
+    help = "Сравнивает старый и новый путь сохранения результата (число запросов и время). Данные откатываются."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--answers", type=int, default=40)
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        n, runs = options["answers"], options["runs"]
+        with transaction.atomic():
+            quiz = Quiz.objects.create(title="__bench__")
+            variant = QuizVariant.objects.create(quiz=quiz, title="__bench__")
+            Question.objects.bulk_create(
+                Question(variant=variant, question=f"Q{i}", option1="a", option2="b", option3="c", option4="d", correct_answer=1)
+                for i in range(n)
+            )
+            question_ids = list(Question.objects.filter(variant=variant).values_list("id", flat=True))
+            UserProfile.objects.create(user_id=-1, user_name="__bench__")
+            answers = [[qid, 1 + i % 4, i % 4 == 0] for i, qid in enumerate(question_ids)]
+            score = sum(1 for a in answers if a[2])
+
+            for label, func in (("legacy", save_quiz_result_legacy), ("bulk", save_quiz_result)):
+                queries, elapsed = 0, 0.0
+                for _ in range(runs):
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        func(-1, quiz.id, variant.id, score, n, answers)
+                        elapsed += time.perf_counter() - start
+                    queries += len(ctx.captured_queries)
+                self.stdout.write(
+                    f"{label:>6}: {queries / runs:.0f} запросов, {elapsed / runs * 1000:.2f} мс на результат ({n} ответов)"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.exports import ANSWER_COLUMNS, RESULT_COLUMNS, export_chunks, export_rows, iter_csv, write_xlsx
+from bot.models import UserAnswer, UserResult
+
+
+class Command(BaseCommand):
+    help = "Выгружает результаты (или ответы) в CSV/XLSX порциями, без загрузки всех строк в память."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--answers", action="store_true", help="Выгрузить ответы вместо результатов")
+        parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+        parser.add_argument("--quiz", type=int, help="Только викторина с этим ID")
+        parser.add_argument("--variant", type=int, help="Только вариант с этим ID")
+        parser.add_argument("--chunk-size", type=int, help="Строк за один запрос к БД (по умолчанию EXPORT_CHUNK_SIZE)")
+        parser.add_argument("-o", "--output", help="Файл (по умолчанию CSV пишется в stdout)")
+
+    def handle(self, *args, **options):
+        prefix = "result__" if options["answers"] else ""
+        queryset = UserAnswer.objects.all() if options["answers"] else UserResult.objects.all()
+        if options["quiz"]:
+            queryset = queryset.filter(**{f"{prefix}quiz_id": options["quiz"]})
+        if options["variant"]:
+            queryset = queryset.filter(**{f"{prefix}variant_id": options["variant"]})
+
+        columns = ANSWER_COLUMNS if options["answers"] else RESULT_COLUMNS
+        chunk_size = options["chunk_size"]
+
+        output = options["output"]
+        if options["format"] == "xlsx":
+            if not output:
+                raise CommandError("Для XLSX укажите файл: -o export.xlsx")
+            title = "answers" if options["answers"] else "results"
+            write_xlsx(output, columns, export_rows(queryset, columns, chunk_size), title=title)
+        elif output:
+            with open(output, "w", encoding="utf-8", newline="") as f:
+                f.writelines(iter_csv(columns, export_chunks(queryset, columns, chunk_size)))
+        else:
+            for text in iter_csv(columns, export_chunks(queryset, columns, chunk_size)):
+                self.stdout.write(text, ending="")
+            return
+        self.stdout.write(f"Выгрузка сохранена: {output}")
@@ -0,0 +1,45 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.importers import CsvSource, QuestionImportError, XlsxSource, import_questions, open_google_sheet
+
+
+class Command(BaseCommand):
+    help = "Импортирует банк вопросов из CSV, XLSX или Google Sheets (ссылка или ключ таблицы)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Путь к .csv/.xlsx или ссылка/ключ таблицы Google (с --sheets)")
+        parser.add_argument("--quiz", required=True, help="Название викторины")
+        parser.add_argument("--sheets", action="store_true", help="source — таблица Google Sheets")
+        parser.add_argument("--worksheet", help="Лист XLSX/Google Sheets (по умолчанию первый)")
+        parser.add_argument("--incremental", action="store_true", help="Обновить варианты по файлу без дубликатов")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        source_name = options["source"]
+        try:
+            if options["sheets"]:
+                report = import_questions(
+                    open_google_sheet(source_name, options["worksheet"]), options["quiz"],
+                    options["batch_size"], options["incremental"],
+                )
+            elif source_name.lower().endswith(".xlsx"):
+                with open(source_name, "rb") as f:
+                    report = import_questions(
+                        XlsxSource(f, options["worksheet"]), options["quiz"],
+                        options["batch_size"], options["incremental"],
+                    )
+            else:
+                with open(source_name, encoding="utf-8-sig", newline="") as f:
+                    report = import_questions(
+                        CsvSource(f), options["quiz"], options["batch_size"], options["incremental"],
+                    )
+        except QuestionImportError as e:
+            raise CommandError(str(e))
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(f"Ошибка чтения {source_name}: {e}")
+
+        for line, reason in report.skipped:
+            self.stderr.write(f"строка {line}: {reason}")
+        self.stdout.write(report.summary())
@@ -0,0 +1,51 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bot.access import redeem_invite_token
+from bot.models import InviteToken, Quiz
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест: конкурентные погашения одного токена против локальной БД."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=32)
+        parser.add_argument("--attempts", type=int, default=2000)
+        parser.add_argument("--limit", type=int, default=500)
+
+    def handle(self, *args, **options):
+        threads, attempts, limit = options["threads"], options["attempts"], options["limit"]
+        quiz = Quiz.objects.create(title=f"__loadtest__{uuid.uuid4().hex[:8]}")
+        token = InviteToken.objects.create(token=f"__loadtest__{uuid.uuid4().hex}", quiz=quiz, usage_limit=limit)
+
+        def redeem(i):
+            try:
+                return redeem_invite_token(token.token, user_id=-(i + 1)) is not None, None
+            except Exception as e:
+                return False, e
+            finally:
+                connection.close()
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                outcomes = list(pool.map(redeem, range(attempts)))
+            elapsed = time.perf_counter() - start
+
+            succeeded = sum(1 for ok, _ in outcomes if ok)
+            errors = [e for _, e in outcomes if e is not None]
+            token.refresh_from_db()
+            self.stdout.write(
+                f"{attempts} погашений в {threads} потоков за {elapsed:.2f} с: "
+                f"успешно {succeeded}, ошибок {len(errors)}, used_count={token.used_count}/{limit}"
+            )
+            if errors:
+                self.stdout.write(f"Первая ошибка: {errors[0]!r}")
+            if token.used_count != succeeded or token.used_count > limit:
+                raise CommandError("Потерянные или лишние списания использования токена")
+        finally:
+            quiz.delete()
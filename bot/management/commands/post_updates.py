@@ -0,0 +1,32 @@
+import json
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Отправляет записанные апдейты Telegram (JSON-массив или JSON Lines) на webhook-эндпоинт."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл с апдейтами")
+        parser.add_argument("--url", default="http://127.0.0.1:8000/telegram/webhook/")
+        parser.add_argument("--secret", default=None, help="По умолчанию — WEBHOOK_SECRET")
+
+    def handle(self, *args, **options):
+        with open(options["path"], encoding="utf-8") as f:
+            raw = f.read().strip()
+        if raw.startswith("["):
+            updates = json.loads(raw)
+        else:
+            updates = [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+        secret = options["secret"] or settings.TELEGRAM_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError("Не задан секрет webhook (--secret или WEBHOOK_SECRET)")
+
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+        with httpx.Client(timeout=10) as client:
+            for update in updates:
+                response = client.post(options["url"], json=update, headers=headers)
+                self.stdout.write(f"update {update.get('update_id')}: {response.status_code}")
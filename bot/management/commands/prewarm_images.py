@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.images import prewarm_variants
+from bot.models import QuizVariant
+
+
+class Command(BaseCommand):
+    help = "Заранее загружает картинки вопросов вариантов в Telegram, чтобы кэш file_id был тёплым."
+
+    def add_arguments(self, parser):
+        parser.add_argument("variant_ids", nargs="*", type=int, help="ID вариантов (по умолчанию — все)")
+        parser.add_argument("--quiz", type=int, help="Все варианты викторины с этим ID")
+        parser.add_argument("--chat", help="Служебный чат для загрузки (по умолчанию IMAGE_STAGING_CHAT_ID)")
+        parser.add_argument("--concurrency", type=int, help="Одновременных скачиваний")
+        parser.add_argument("--no-resize", action="store_true", help="Не проверять и не уменьшать картинки")
+        parser.add_argument("--force", action="store_true", help="Загрузить заново даже закэшированные")
+
+    def handle(self, *args, **options):
+        variants = QuizVariant.objects.all()
+        if options["variant_ids"]:
+            variants = variants.filter(id__in=options["variant_ids"])
+        if options["quiz"]:
+            variants = variants.filter(quiz_id=options["quiz"])
+        try:
+            report = prewarm_variants(
+                list(variants.values_list("id", flat=True)),
+                chat_id=options["chat"],
+                concurrency=options["concurrency"],
+                resize=not options["no_resize"],
+                force=options["force"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for url, reason in report.failed:
+            self.stderr.write(f"{url}: {reason}")
+        self.stdout.write(report.summary())
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot.progress import rebuild_quiz_progress
+
+
+class Command(BaseCommand):
+    help = "Пересобирает агрегаты QuizProgress (попытки, лучший балл, пройденные варианты) из UserResult."
+
+    def handle(self, *args, **options):
+        created = rebuild_quiz_progress()
+        self.stdout.write(f"Пересобрано строк QuizProgress: {created}")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bot.maintenance import run_maintenance
+
+
+class Command(BaseCommand):
+    help = "Удаляет истёкший доступ (AllowedUser), старые сессии и журнал брошенных попыток."
+
+    def handle(self, *args, **options):
+        removed = run_maintenance()
+        self.stdout.write(
+            f"Удалено: доступов {removed['access']}, сессий {removed['sessions']}, "
+            f"ответов журнала {removed['pending_answers']}"
+        )
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_question_image_alter_question_correct_answer_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='question',
+            name='image',
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='image_url',
+            field=models.URLField(blank=True, max_length=1000, null=True, verbose_name='Изображение (URL)'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_quizsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.CharField(db_index=True, max_length=32)),
+                ('user_id', models.BigIntegerField()),
+                ('selected_option', models.IntegerField()),
+                ('is_correct', models.BooleanField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.question')),
+            ],
+        ),
+    ]
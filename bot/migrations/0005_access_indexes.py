@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_pendinganswer'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invitetoken',
+            index=models.Index(fields=['quiz', '-id'], name='invitetoken_quiz_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userresult',
+            index=models.Index(fields=['user_profile', 'quiz'], name='userresult_profile_quiz_idx'),
+        ),
+    ]
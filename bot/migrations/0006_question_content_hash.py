@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:50
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    Question = apps.get_model("bot", "Question")
+    batch = []
+    for q in Question.objects.only("id", "question", "option1", "option2", "option3", "option4").iterator(chunk_size=2000):
+        payload = "\x1f".join((v or "").strip() for v in (q.question, q.option1, q.option2, q.option3, q.option4))
+        q.content_hash = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        batch.append(q)
+        if len(batch) >= 2000:
+            Question.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        Question.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_access_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_quiz_progress(apps, schema_editor):
+    # Своя копия пересборки (bot.progress.rebuild_quiz_progress): миграция не должна
+    # зависеть от текущего кода приложения, только от исторических моделей
+    UserResult = apps.get_model("bot", "UserResult")
+    QuizProgress = apps.get_model("bot", "QuizProgress")
+
+    rows = (
+        UserResult.objects.order_by("user_profile_id", "quiz_id", "id")
+        .values_list("user_profile_id", "quiz_id", "score", "total", "variant_id", "timestamp")
+        .iterator(chunk_size=2000)
+    )
+    batch, current, key = [], None, None
+    for user_profile_id, quiz_id, score, total, variant_id, timestamp in rows:
+        if (user_profile_id, quiz_id) != key:
+            key = (user_profile_id, quiz_id)
+            current = QuizProgress(user_profile_id=user_profile_id, quiz_id=quiz_id, passed_variant_ids=[])
+            batch.append(current)
+            if len(batch) > 2000:
+                QuizProgress.objects.bulk_create(batch[:-1])
+                batch = batch[-1:]
+        current.attempts += 1
+        if current.best_score is None or score * (current.best_total or 0) > current.best_score * total:
+            current.best_score, current.best_total = score, total
+        if current.last_attempt_at is None or timestamp > current.last_attempt_at:
+            current.last_attempt_at = timestamp
+        if variant_id and variant_id not in current.passed_variant_ids:
+            current.passed_variant_ids.append(variant_id)
+    QuizProgress.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_question_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('best_score', models.IntegerField(blank=True, null=True)),
+                ('best_total', models.IntegerField(blank=True, null=True)),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('passed_variant_ids', models.JSONField(blank=True, default=list)),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.quiz')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.userprofile')),
+            ],
+            options={
+                'unique_together': {('user_profile', 'quiz')},
+            },
+        ),
+        migrations.RunPython(fill_quiz_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_telegramimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizvariant',
+            name='shuffle_options',
+            field=models.BooleanField(default=False, verbose_name='Перемешивать варианты ответов'),
+        ),
+        migrations.AddField(
+            model_name='quizvariant',
+            name='shuffle_questions',
+            field=models.BooleanField(default=False, verbose_name='Перемешивать вопросы'),
+        ),
+    ]
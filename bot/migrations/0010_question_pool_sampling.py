@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_quizvariant_shuffle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='difficulty',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Сложность'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='tag',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Тег'),
+        ),
+        migrations.AddField(
+            model_name='quizvariant',
+            name='sample_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Вопросов в попытке (выборка)'),
+        ),
+        migrations.AddField(
+            model_name='quizvariant',
+            name='sample_strata',
+            field=models.CharField(blank=True, choices=[('', 'Без стратификации'), ('tag', 'По тегу'), ('difficulty', 'По сложности')], default='', max_length=20, verbose_name='Стратификация выборки'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+def check_correct_answer(apps, schema_editor):
+    # Значения вне 1–4 (обход clean() через bulk-операции) не затираем молча:
+    # миграция останавливается со списком вопросов, их нужно исправить вручную
+    Question = apps.get_model("bot", "Question")
+    invalid = list(
+        Question.objects.exclude(correct_answer__isnull=True)
+        .exclude(correct_answer__range=(1, 4))
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    if invalid:
+        raise RuntimeError(
+            "correct_answer вне диапазона 1–4 у вопросов с ID: "
+            + ", ".join(map(str, invalid))
+            + ". Исправьте их и запустите миграцию снова."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_question_pool_sampling'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quiz',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='invitetoken',
+            index=models.Index(condition=models.Q(('used_count__lt', models.F('usage_limit'))), fields=['quiz'], name='invitetoken_quiz_valid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userresult',
+            index=models.Index(fields=['user_profile', '-id'], name='userresult_profile_latest_idx'),
+        ),
+        migrations.RunPython(check_correct_answer, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='question',
+            constraint=models.CheckConstraint(condition=models.Q(('correct_answer__isnull', True), models.Q(('correct_answer__gte', 1), ('correct_answer__lte', 4)), _connector='OR'), name='question_correct_answer_range'),
+        ),
+    ]
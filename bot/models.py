@@ -1,9 +1,12 @@
+import hashlib
+
 from django.db import models
-from django.db.models import F
+from django.db.models import F, Q
 from django.core.exceptions import ValidationError
 
 class Quiz(models.Model):
-    title = models.CharField(max_length=255)
+    # Поиск по названию: check_quiz_access_by_title и get_or_create в импорте
+    title = models.CharField(max_length=255, db_index=True)
 
     def __str__(self):
         return self.title
@@ -12,6 +15,15 @@ class Quiz(models.Model):
 class QuizVariant(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name="variants", null=True, blank=True)
     title = models.CharField(max_length=100, null=True, blank=True)
+    shuffle_questions = models.BooleanField(default=False, verbose_name="Перемешивать вопросы")
+    shuffle_options = models.BooleanField(default=False, verbose_name="Перемешивать варианты ответов")
+    # Пул вопросов: каждой попытке достаётся случайная выборка из sample_size вопросов
+    sample_size = models.PositiveIntegerField(null=True, blank=True, verbose_name="Вопросов в попытке (выборка)")
+    sample_strata = models.CharField(
+        max_length=20, blank=True, default="",
+        choices=[("", "Без стратификации"), ("tag", "По тегу"), ("difficulty", "По сложности")],
+        verbose_name="Стратификация выборки",
+    )
 
     def __str__(self):
         if self.quiz:
@@ -19,6 +31,12 @@ class QuizVariant(models.Model):
         return f"(Без викторины) — {self.title}"
 
 
+def question_content_hash(question, options):
+    """Отпечаток вопроса (текст + варианты ответов) для инкрементального импорта."""
+    payload = "\x1f".join((value or "").strip() for value in (question, *options))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 class Question(models.Model):
     variant = models.ForeignKey(QuizVariant, on_delete=models.CASCADE, related_name="questions", null=True, blank=True)
     question = models.TextField()
@@ -31,15 +49,33 @@ class Question(models.Model):
     # NEW: внешняя ссылка (URL), удобна при импорте из CSV/Google Sheets
     image_url = models.URLField(max_length=1000, null=True, blank=True, verbose_name="Изображение (URL)")
 
+    tag = models.CharField(max_length=100, blank=True, default="", verbose_name="Тег")
+    difficulty = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Сложность")
+
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True, editable=False)
+
+    class Meta:
+        constraints = [
+            # clean() не вызывается при bulk_create/update — диапазон проверяет БД
+            models.CheckConstraint(
+                condition=Q(correct_answer__isnull=True) | Q(correct_answer__gte=1, correct_answer__lte=4),
+                name="question_correct_answer_range",
+            ),
+        ]
+
     def __str__(self):
         return self.question
 
+    def compute_content_hash(self):
+        return question_content_hash(self.question, (self.option1, self.option2, self.option3, self.option4))
+
     def clean(self):
         if self.correct_answer is not None and not 1 <= self.correct_answer <= 4:
             raise ValidationError("correct_answer должен быть числом от 1 до 4.")
 
     def save(self, *args, **kwargs):
         self.clean()
+        self.content_hash = self.compute_content_hash()
         super().save(*args, **kwargs)
 
 
@@ -59,10 +95,36 @@ class UserResult(models.Model):
     total = models.IntegerField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_profile", "quiz"], name="userresult_profile_quiz_idx"),
+            # /results: результаты пользователя от новых к старым с курсором по id
+            models.Index(fields=["user_profile", "-id"], name="userresult_profile_latest_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user_profile} - {self.quiz.title} ({self.score}/{self.total})"
 
 
+class QuizProgress(models.Model):
+    """Агрегат по пользователю и викторине: обновляется при завершении викторины
+    (bot/completion.py) и удалении результата (bot/signals.py), пересобирается
+    командой rebuild_quiz_progress."""
+    user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    attempts = models.PositiveIntegerField(default=0)
+    best_score = models.IntegerField(null=True, blank=True)
+    best_total = models.IntegerField(null=True, blank=True)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    passed_variant_ids = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        unique_together = ("user_profile", "quiz")
+
+    def __str__(self):
+        return f"{self.user_profile} — {self.quiz.title}: {self.attempts}"
+
+
 class UserAnswer(models.Model):
     result = models.ForeignKey(UserResult, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
@@ -87,15 +149,27 @@ class InviteToken(models.Model):
     usage_limit = models.PositiveIntegerField(default=1)
     used_count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # последний токен викторины: filter(quiz=...).order_by("-id")
+            models.Index(fields=["quiz", "-id"], name="invitetoken_quiz_latest_idx"),
+            # действующие токены викторины (expire_access, погашение)
+            models.Index(
+                fields=["quiz"], name="invitetoken_quiz_valid_idx", condition=Q(used_count__lt=F("usage_limit"))
+            ),
+        ]
+
     def is_valid(self):
         return self.used_count < self.usage_limit
 
     def mark_used(self):
-        if self.is_valid():
-            self.used_count += 1
-            self.save()
-            return True
-        return False
+        # Условный UPDATE: конкурентные вызовы не превышают usage_limit
+        updated = InviteToken.objects.filter(pk=self.pk, used_count__lt=F("usage_limit")).update(
+            used_count=F("used_count") + 1
+        )
+        if updated:
+            self.refresh_from_db(fields=["used_count"])
+        return bool(updated)
 
     def __str__(self):
         return self.token
@@ -118,6 +192,37 @@ class AllowedUser(models.Model):
         return f"{self.user_profile} — {self.quiz.title}"
 
 
-def clean_expired_access(user_id):
-    expired_tokens = InviteToken.objects.filter(usage_limit__lte=F("used_count"))
-    AllowedUser.objects.filter(user_profile__user_id=user_id, invite_token__in=expired_tokens).delete()
+class QuizSession(models.Model):
+    """Сериализованное состояние пользователя в боте (см. bot/sessions.py)."""
+    user_id = models.BigIntegerField(unique=True)
+    data = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Session {self.user_id}"
+
+
+class PendingAnswer(models.Model):
+    """Ответ незавершённой попытки (журнал, см. bot/journal.py).
+
+    При завершении викторины строки попытки переносятся в UserAnswer и удаляются.
+    """
+    attempt = models.CharField(max_length=32, db_index=True)
+    user_id = models.BigIntegerField()
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    selected_option = models.IntegerField()
+    is_correct = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.attempt}: {self.question_id} → {self.selected_option}"
+
+
+class TelegramImage(models.Model):
+    """file_id фото, уже загруженного в Telegram по image_url (см. bot/images.py)."""
+    url = models.URLField(max_length=1000, unique=True)
+    file_id = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
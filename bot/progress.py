@@ -0,0 +1,72 @@
+"""Агрегаты QuizProgress: попытки, лучший балл, последняя попытка, пройденные варианты.
+
+При удалении UserResult агрегат пары (пользователь, викторина) пересчитывается
+сигналом (bot/signals.py); rebuild_quiz_progress нужен только после изменений
+в обход ORM (сырой SQL, правка таблиц вручную).
+"""
+from django.db import transaction
+
+
+def apply_result(progress, score, total, variant_id, timestamp):
+    """Учитывает один результат в агрегате (без сохранения)."""
+    progress.attempts += 1
+    if progress.best_score is None or score * (progress.best_total or 0) > progress.best_score * total:
+        progress.best_score, progress.best_total = score, total
+    if progress.last_attempt_at is None or timestamp > progress.last_attempt_at:
+        progress.last_attempt_at = timestamp
+    if variant_id and variant_id not in progress.passed_variant_ids:
+        progress.passed_variant_ids = progress.passed_variant_ids + [variant_id]
+
+
+def recompute_quiz_progress(user_profile_id, quiz_id):
+    """Пересчитывает QuizProgress одной пары по её UserResult (удаляет, если результатов нет)."""
+    from .models import QuizProgress, UserResult
+
+    progress = QuizProgress(user_profile_id=user_profile_id, quiz_id=quiz_id, passed_variant_ids=[])
+    rows = (
+        UserResult.objects.filter(user_profile_id=user_profile_id, quiz_id=quiz_id)
+        .order_by("id")
+        .values_list("score", "total", "variant_id", "timestamp")
+    )
+    for score, total, variant_id, timestamp in rows:
+        apply_result(progress, score, total, variant_id, timestamp)
+    if not progress.attempts:
+        QuizProgress.objects.filter(user_profile_id=user_profile_id, quiz_id=quiz_id).delete()
+        return None
+    fields = ("attempts", "best_score", "best_total", "last_attempt_at", "passed_variant_ids")
+    progress, _ = QuizProgress.objects.update_or_create(
+        user_profile_id=user_profile_id, quiz_id=quiz_id,
+        defaults={field: getattr(progress, field) for field in fields},
+    )
+    return progress
+
+
+def rebuild_quiz_progress(batch_size=2000):
+    """Пересобирает QuizProgress из всей истории UserResult одним потоковым проходом.
+
+    Возвращает число созданных строк.
+    """
+    from .models import QuizProgress, UserResult
+
+    rows = (
+        UserResult.objects.order_by("user_profile_id", "quiz_id", "id")
+        .values_list("user_profile_id", "quiz_id", "score", "total", "variant_id", "timestamp")
+        .iterator(chunk_size=batch_size)
+    )
+    created = 0
+    with transaction.atomic():
+        QuizProgress.objects.all().delete()
+        batch, current, key = [], None, None
+        for user_profile_id, quiz_id, score, total, variant_id, timestamp in rows:
+            if (user_profile_id, quiz_id) != key:
+                key = (user_profile_id, quiz_id)
+                current = QuizProgress(user_profile_id=user_profile_id, quiz_id=quiz_id, passed_variant_ids=[])
+                batch.append(current)
+                if len(batch) > batch_size:
+                    QuizProgress.objects.bulk_create(batch[:-1])
+                    created += len(batch) - 1
+                    batch = batch[-1:]
+            apply_result(current, score, total, variant_id, timestamp)
+        QuizProgress.objects.bulk_create(batch)
+        created += len(batch)
+    return created
@@ -0,0 +1,242 @@
+"""Кэш банка вопросов по вариантам (read-through, в пределах процесса).
+
+Хранит неизменяемые снимки варианта: заголовки и кортеж QuestionRecord
+(а не ORM-объекты) с уже отрендеренным текстом вопроса. Инвалидируется
+сигналами post_save/post_delete (см. bot/signals.py) и дополнительно по TTL —
+на случай, если админка работает в другом процессе. Зависимые кэши (готовые
+меню, bot/render.py) подписываются на сброс через subscribe().
+
+Вариант-пул (QuizVariant.sample_size) в снимке держит только массив ID (и
+массивы по стратам); каждой попытке достаётся случайная выборка из него, а
+записи догружаются одним запросом лишь для выбранных вопросов (prefetch).
+"""
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+def render_question(question, options):
+    return (
+        f"{question}\n\n"
+        f"1️⃣ {options[0]}\n\n"
+        f"2️⃣ {options[1]}\n\n"
+        f"3️⃣ {options[2]}\n\n"
+        f"4️⃣ {options[3]}"
+    )
+
+
+class QuestionRecord:
+    __slots__ = ("id", "question", "options", "correct_answer", "image_url", "text", "_texts")
+
+    def __init__(self, id, question, options, correct_answer, image_url):
+        self.id = id
+        self.question = question
+        self.options = options
+        self.correct_answer = correct_answer
+        self.image_url = image_url
+        self.text = render_question(question, options)
+        self._texts = {}  # перестановка ответов -> текст (не больше 24)
+
+    def render(self, order=None):
+        """Текст вопроса с ответами в порядке order (см. bot/shuffle.py)."""
+        if order is None:
+            return self.text
+        text = self._texts.get(order)
+        if text is None:
+            text = self._texts[order] = render_question(self.question, [self.options[i] for i in order])
+        return text
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("QuestionRecord is immutable")
+        super().__setattr__(name, value)
+
+
+def allocate(sizes, n):
+    """Пропорционально делит n между стратами {ключ: размер} (метод наибольших остатков)."""
+    total = sum(sizes.values())
+    quotas = {key: n * size / total for key, size in sizes.items()}
+    counts = {key: int(quota) for key, quota in quotas.items()}
+    remaining = n - sum(counts.values())
+    for key in sorted(quotas, key=lambda k: quotas[k] - counts[k], reverse=True):
+        if remaining <= 0:
+            break
+        if counts[key] < sizes[key]:
+            counts[key] += 1
+            remaining -= 1
+    return counts
+
+
+class VariantSnapshot:
+    __slots__ = (
+        "variant_id", "variant_title", "quiz_id", "quiz_title",
+        "shuffle_questions", "shuffle_options", "questions", "by_id",
+        "pool_ids", "strata", "sample_size",
+    )
+
+    def __init__(self, variant_id, variant_title, quiz_id, quiz_title, questions,
+                 shuffle_questions=False, shuffle_options=False,
+                 pool_ids=None, strata=None, sample_size=None):
+        self.variant_id = variant_id
+        self.variant_title = variant_title
+        self.quiz_id = quiz_id
+        self.quiz_title = quiz_title
+        self.shuffle_questions = shuffle_questions
+        self.shuffle_options = shuffle_options
+        self.questions = tuple(questions)
+        # У пула by_id пополняется по мере выборок (QuestionBankCache.prefetch)
+        self.by_id = {q.id: q for q in self.questions}
+        self.pool_ids = array("q", self.by_id if pool_ids is None else pool_ids)
+        self.strata = strata or {}  # ключ страты -> array ID
+        self.sample_size = sample_size or None
+
+    @property
+    def question_ids(self):
+        return list(self.pool_ids)
+
+    def draw(self, rng=random):
+        """ID вопросов новой попытки: весь вариант или выборка sample_size из пула."""
+        if self.sample_size is None or self.sample_size >= len(self.pool_ids):
+            return list(self.pool_ids)
+        if not self.strata:
+            return sorted(rng.sample(self.pool_ids, self.sample_size))
+        sizes = {key: len(ids) for key, ids in self.strata.items()}
+        picked = []
+        for key, count in allocate(sizes, self.sample_size).items():
+            picked.extend(rng.sample(self.strata[key], count))
+        return sorted(picked)
+
+
+class QuestionBankCache:
+    """LRU-кэш снимков вариантов со счётчиками попаданий/промахов."""
+
+    def __init__(self, max_variants=256, ttl=300):
+        self.max_variants = max_variants
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # variant_id -> (expires_at, snapshot)
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def _lookup(self, variant_id):
+        with self._lock:
+            item = self._data.get(variant_id)
+            if item is not None and item[0] >= time.monotonic():
+                self._data.move_to_end(variant_id)
+                self.hits += 1
+                return item[1]
+            self._data.pop(variant_id, None)
+            self.misses += 1
+        return None
+
+    def _store(self, variant_id, snapshot):
+        with self._lock:
+            self._data[variant_id] = (time.monotonic() + self.ttl, snapshot)
+            self._data.move_to_end(variant_id)
+            while len(self._data) > self.max_variants:
+                self._data.popitem(last=False)
+
+    @staticmethod
+    def _records(queryset):
+        rows = queryset.values_list(
+            "id", "question", "option1", "option2", "option3", "option4", "correct_answer", "image_url"
+        )
+        return [
+            QuestionRecord(qid, text, (o1, o2, o3, o4), correct, image_url)
+            for qid, text, o1, o2, o3, o4, correct, image_url in rows
+        ]
+
+    def _load(self, variant_id):
+        from .models import Question, QuizVariant
+
+        row = (
+            QuizVariant.objects.filter(id=variant_id)
+            .values_list(
+                "title", "quiz_id", "quiz__title", "shuffle_questions", "shuffle_options",
+                "sample_size", "sample_strata",
+            )
+            .first()
+        )
+        if row is None:
+            return None
+        title, quiz_id, quiz_title, shuffle_questions, shuffle_options, sample_size, strata_field = row
+        # Вопросы без правильного ответа в тест не попадают: их нечем проверить
+        questions = Question.objects.filter(variant_id=variant_id, correct_answer__isnull=False).order_by("id")
+        if not sample_size:
+            return VariantSnapshot(
+                variant_id, title, quiz_id, quiz_title, self._records(questions), shuffle_questions, shuffle_options
+            )
+
+        # Пул: только ID (и ключ страты), без текстов вопросов
+        pool_ids, strata = array("q"), {}
+        for qid, key in questions.values_list("id", strata_field or "id"):
+            pool_ids.append(qid)
+            if strata_field:
+                strata.setdefault(key, array("q")).append(qid)
+        return VariantSnapshot(
+            variant_id, title, quiz_id, quiz_title, (), shuffle_questions, shuffle_options,
+            pool_ids=pool_ids, strata=strata, sample_size=sample_size,
+        )
+
+    def prefetch(self, snapshot, question_ids):
+        """Догружает в снимок пула записи question_ids, которых ещё нет (один запрос)."""
+        from .models import Question
+
+        missing = [qid for qid in question_ids if qid not in snapshot.by_id]
+        if not missing:
+            return
+        records = self._records(Question.objects.filter(variant_id=snapshot.variant_id, id__in=missing))
+        with self._lock:
+            for record in records:
+                snapshot.by_id.setdefault(record.id, record)
+
+    async def aprefetch(self, snapshot, question_ids):
+        if any(qid not in snapshot.by_id for qid in question_ids):
+            await sync_to_async(self.prefetch)(snapshot, question_ids)
+
+    def get(self, variant_id):
+        snapshot = self._lookup(variant_id)
+        if snapshot is None:
+            snapshot = self._load(variant_id)
+            if snapshot is not None:
+                self._store(variant_id, snapshot)
+        return snapshot
+
+    async def aget(self, variant_id):
+        snapshot = self._lookup(variant_id)
+        if snapshot is None:
+            snapshot = await sync_to_async(self._load)(variant_id)
+            if snapshot is not None:
+                self._store(variant_id, snapshot)
+        return snapshot
+
+    def subscribe(self, callback):
+        """callback(variant_id) вызывается при каждом сбросе (None — сброс всего)."""
+        self._subscribers.append(callback)
+
+    def invalidate(self, variant_id=None):
+        with self._lock:
+            if variant_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(variant_id, None)
+        for callback in self._subscribers:
+            callback(variant_id)
+
+
+question_bank = QuestionBankCache(
+    max_variants=getattr(settings, "QUESTION_CACHE_MAX_VARIANTS", 256),
+    ttl=getattr(settings, "QUESTION_CACHE_TTL", 300),
+)
@@ -0,0 +1,182 @@
+"""Планировщик исходящих запросов к Bot API с учётом лимитов Telegram.
+
+Запросы, адресованные чату (есть chat_id), проходят через два token bucket:
+свой для каждого чата и общий для бота. Общий bucket выдаёт токены по
+приоритету: вопросы викторины раньше меню. При RetryAfter отправка
+приостанавливается на указанное Telegram время и запрос повторяется.
+Остальные запросы (answerCallbackQuery, getMe, ...) идут без ожидания.
+
+Приоритет передаётся через rate_limit_args={"priority": ...}; без него он
+выбирается по методу API (ENDPOINT_PRIORITY).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_QUESTION = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_MENU = 2
+
+ENDPOINT_PRIORITY = {
+    "sendPhoto": PRIORITY_QUESTION,
+    "editMessageText": PRIORITY_QUESTION,
+    "editMessageCaption": PRIORITY_QUESTION,
+    "editMessageReplyMarkup": PRIORITY_QUESTION,
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать, пока появится целый токен."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def reserve(self):
+        """Берёт токен (возможно, в долг) и возвращает, сколько ждать до его использования."""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    @property
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class QuizRateLimiter(BaseRateLimiter):
+    """global_rate — сообщений в секунду на бота, chat_rate/chat_burst — на один чат."""
+
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, max_retries=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = {}  # chat_id -> TokenBucket
+        self._waiters = []  # куча (priority, seq, future) ожидающих общий токен
+        self._seq = itertools.count()
+        self._pump_task = None
+        self._paused_until = 0.0
+        self.chat_waiting = 0
+        self.sent = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        by_priority = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            "queued": sum(by_priority.values()),
+            "queued_by_priority": by_priority,
+            "chat_waiting": self.chat_waiting,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "retries": self.retries,
+            "avg_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                # Полные bucket'ы ничем не отличаются от новых — выбрасываем
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_pause(self):
+        delay = self._paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._paused_until - time.monotonic()
+
+    async def _acquire_global(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        # Раздаёт общие токены ожидающим строго по приоритету (внутри — по очереди)
+        while self._waiters:
+            await self._wait_pause()
+            delay = self.global_bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.global_bucket.take()
+                future.set_result(None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", ENDPOINT_PRIORITY.get(endpoint, PRIORITY_DEFAULT))
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await self._wait_pause()
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                self.chat_waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.chat_waiting -= 1
+            await self._acquire_global(priority)
+
+            waited = time.monotonic() - started
+            self.sent += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning("%s в чат %s: RetryAfter %s с, повтор %d", endpoint, chat_id, retry_after, attempt + 1)
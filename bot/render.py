@@ -0,0 +1,73 @@
+"""Готовые клавиатуры меню: список викторин и кнопки вариантов.
+
+Кнопки строятся один раз и переиспользуются (объекты telegram неизменяемы);
+на каждый запрос собирается только пользовательская часть — какие викторины
+доступны и отметки ✅ у пройденных вариантов. Кэш сбрасывается вместе с банком
+вопросов (question_bank.subscribe) и по тому же TTL.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .question_cache import question_bank
+
+
+class MenuCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._quizzes = None  # (expires_at, ((quiz_id, row), ...), полная клавиатура)
+        self._variants = {}  # variant_id -> (title, row, row с ✅)
+        self._lock = threading.Lock()
+
+    def _load_quizzes(self):
+        from .models import Quiz
+
+        rows = tuple(
+            (quiz_id, (InlineKeyboardButton(title, callback_data=f"quiz_{quiz_id}"),))
+            for quiz_id, title in Quiz.objects.order_by("id").values_list("id", "title")
+        )
+        markup = InlineKeyboardMarkup([row for _, row in rows]) if rows else None
+        self._quizzes = (time.monotonic() + self.ttl, rows, markup)
+        return self._quizzes
+
+    async def quiz_markup(self, quiz_ids=None):
+        """Клавиатура всех викторин или только quiz_ids (None, если показывать нечего)."""
+        quizzes = self._quizzes
+        if quizzes is None or quizzes[0] < time.monotonic():
+            quizzes = await sync_to_async(self._load_quizzes)()
+        _, rows, markup = quizzes
+        if quiz_ids is None:
+            return markup
+        rows = [row for quiz_id, row in rows if quiz_id in quiz_ids]
+        return InlineKeyboardMarkup(rows) if rows else None
+
+    def variant_markup(self, variants, passed_ids):
+        """variants — [(variant_id, title)] из get_quiz_access."""
+        keyboard = []
+        for variant_id, title in variants:
+            cached = self._variants.get(variant_id)
+            if cached is None or cached[0] != title:
+                callback_data = f"variant_{variant_id}"
+                cached = (
+                    title,
+                    (InlineKeyboardButton(title, callback_data=callback_data),),
+                    (InlineKeyboardButton(f"✅ {title}", callback_data=callback_data),),
+                )
+                with self._lock:
+                    self._variants[variant_id] = cached
+            keyboard.append(cached[2] if variant_id in passed_ids else cached[1])
+        return InlineKeyboardMarkup(keyboard)
+
+    def invalidate(self, variant_id=None):
+        with self._lock:
+            if variant_id is None:
+                self._quizzes = None
+                self._variants.clear()
+            else:
+                self._variants.pop(variant_id, None)
+
+
+menus = MenuCache(ttl=question_bank.ttl)
+question_bank.subscribe(menus.invalidate)
@@ -0,0 +1,164 @@
+"""Постраничный вывод результатов (/results) с keyset-пагинацией.
+
+Страница — не более RESULTS_PAGE_SIZE записей и не длиннее лимита сообщения
+Telegram; разрыв только между записями. Кнопки «← / →» несут курсор (id
+крайней записи) и смещение для нумерации. Недавно просмотренные страницы
+кэшируются и сбрасываются, когда у пользователя появляется новый результат.
+Сводка по викторинам на первой странице берётся из агрегата QuizProgress.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from telegram.helpers import escape_markdown
+
+from .models import QuizProgress, UserResult
+
+MESSAGE_LIMIT = 4096
+HEADER = "📊 *Сіздің нәтижелеріңіз:*\n\n"
+EMPTY = "📭 Әзірге нәтижелер жоқ."
+
+OLDER = "o"
+NEWER = "n"
+
+
+class ResultsPage:
+    __slots__ = ("text", "older", "newer")
+
+    def __init__(self, text, older=None, newer=None):
+        self.text = text
+        self.older = older  # callback_data следующей (более старой) страницы
+        self.newer = newer  # callback_data предыдущей (более новой) страницы
+
+
+def format_result(number, r):
+    date = r["timestamp"].strftime('%d.%m.%Y %H:%M') if r["timestamp"] else "—"
+    variant_title = escape_markdown(r["variant__title"]) if r["variant__title"] else "—"
+    return (
+        f"{number}) {escape_markdown(r['quiz__title'])}\n"
+        f"📄 {variant_title}\n"
+        f"✅ Балл: {r['score']}/{r['total']}\n"
+        f"📅 {date}\n\n"
+    )
+
+
+def format_summary(user_id, limit=MESSAGE_LIMIT // 2):
+    """Сводка по викторинам: только целые строки, не длиннее limit символов
+    (обрезка посреди строки могла оставить висящий «\\» от escape_markdown)."""
+    rows = (
+        QuizProgress.objects.filter(user_profile__user_id=user_id)
+        .order_by("-last_attempt_at")
+        .values_list("quiz__title", "attempts", "best_score", "best_total")
+    )
+    lines = []
+    size = 1  # завершающий перевод строки
+    for title, attempts, best_score, best_total in rows:
+        line = f"• {escape_markdown(title)}: {attempts} рет, үздік {best_score}/{best_total}\n"
+        if size + len(line) > limit:
+            break
+        lines.append(line)
+        size += len(line)
+    return "".join(lines) + "\n" if lines else ""
+
+
+def fetch_results_page(user_id, direction=None, cursor=None, offset=0, page_size=None):
+    """Страница результатов: direction=None — самые новые, OLDER/NEWER — относительно cursor."""
+    page_size = page_size or settings.RESULTS_PAGE_SIZE
+    qs = UserResult.objects.filter(user_profile__user_id=user_id).values(
+        "id", "score", "total", "timestamp", "quiz__title", "variant__title"
+    )
+    if direction == NEWER:
+        rows = list(qs.filter(id__gt=cursor).order_by("id")[:page_size + 1])
+    elif direction == OLDER:
+        rows = list(qs.filter(id__lt=cursor).order_by("-id")[:page_size + 1])
+    else:
+        rows = list(qs.order_by("-id")[:page_size + 1])
+
+    if not rows:
+        return ResultsPage(EMPTY) if direction is None else None
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    header = HEADER
+    if direction is None:
+        header += format_summary(user_id)
+
+    # Отсекаем записи, не помещающиеся в одно сообщение (ближайшие к курсору остаются)
+    budget = MESSAGE_LIMIT - len(header)
+    kept = []
+    for r in rows:
+        size = len(format_result(offset + page_size + 1, r))
+        if kept and size > budget:
+            has_more = True
+            break
+        budget -= size
+        kept.append(r)
+
+    if direction == NEWER:
+        kept.reverse()
+        start = max(offset - len(kept), 0)
+        has_newer, has_older = has_more, True
+    else:
+        start = offset if direction == OLDER else 0
+        has_newer, has_older = direction == OLDER, has_more
+
+    text = header + "".join(format_result(start + i, r) for i, r in enumerate(kept, 1))
+    first_id, last_id = kept[0]["id"], kept[-1]["id"]
+    return ResultsPage(
+        text,
+        older=f"results_{OLDER}_{last_id}_{start + len(kept)}" if has_older else None,
+        newer=f"results_{NEWER}_{first_id}_{start}" if has_newer else None,
+    )
+
+
+class ResultsPageCache:
+    """LRU недавно показанных страниц; сбрасывается по пользователю."""
+
+    def __init__(self, max_pages=1000, ttl=120):
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self._data = OrderedDict()  # (user_id, direction, cursor, offset) -> (expires_at, page)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, page):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, page)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_pages:
+                self._data.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k in self._data if k[0] == user_id]:
+                del self._data[key]
+
+
+results_cache = ResultsPageCache()
+
+
+async def get_results_page(user_id, direction=None, cursor=None, offset=0):
+    key = (user_id, direction, cursor, offset)
+    page = results_cache.get(key)
+    if page is None:
+        page = await sync_to_async(fetch_results_page)(user_id, direction, cursor, offset)
+        if page is not None:
+            results_cache.set(key, page)
+    return page
+
+
+def parse_page_callback(data):
+    """'results_o_123_10' -> ('o', 123, 10)."""
+    _, direction, cursor, offset = data.split("_")
+    return direction, int(cursor), int(offset)
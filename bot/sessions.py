@@ -0,0 +1,197 @@
+"""Хранилище состояний пользователей бота (сессий викторины).
+
+Состояние хранится в компактном сериализованном виде (JSON): только ID вопросов,
+индекс, счёт и ответы — никаких ORM-объектов.
+
+Бэкенды:
+    * MemorySessionStore — LRU с TTL и ограничением по памяти (в пределах процесса);
+    * DatabaseSessionStore — таблица QuizSession в БД Django, переживает перезапуск.
+
+Выбор бэкенда — через settings.QUIZ_SESSION_STORE ("memory" или "db").
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+
+def dumps(state):
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(raw):
+    return json.loads(raw)
+
+
+class SessionStore:
+    """Базовый интерфейс хранилища: get/save/delete по user_id."""
+
+    async def get(self, user_id):
+        raise NotImplementedError
+
+    async def save(self, user_id, state, persist=True):
+        """persist=False — только обновить состояние в памяти (где это применимо)."""
+        raise NotImplementedError
+
+    async def delete(self, user_id):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """LRU-хранилище в памяти процесса.
+
+    Вытесняет самые старые записи, если превышено число записей (max_entries)
+    или суммарный размер сериализованных состояний (max_bytes). Записи старше
+    ttl секунд считаются истёкшими.
+    """
+
+    def __init__(self, max_entries=10000, ttl=6 * 3600, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # user_id -> (expires_at, raw)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get_sync(self, user_id):
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                return None
+            expires_at, raw = item
+            if expires_at < time.monotonic():
+                self._pop(user_id)
+                return None
+            self._data.move_to_end(user_id)
+        return loads(raw)
+
+    def save_sync(self, user_id, state):
+        raw = dumps(state)
+        with self._lock:
+            self._pop(user_id)
+            self._data[user_id] = (time.monotonic() + self.ttl, raw)
+            self._bytes += len(raw)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+
+    def delete_sync(self, user_id):
+        with self._lock:
+            self._pop(user_id)
+
+    def _pop(self, user_id):
+        item = self._data.pop(user_id, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    async def get(self, user_id):
+        return self.get_sync(user_id)
+
+    async def save(self, user_id, state, persist=True):
+        self.save_sync(user_id, state)
+
+    async def delete(self, user_id):
+        self.delete_sync(user_id)
+
+
+class DatabaseSessionStore(SessionStore):
+    """Хранилище в таблице QuizSession с LRU-кэшем в памяти перед ней.
+
+    Чтение обслуживается из памяти, запись идёт в БД, поэтому викторина
+    продолжается с того же места после перезапуска/редеплоя. Промежуточные
+    шаги (save(..., persist=False)) пишутся только в память; on_load позволяет
+    досчитать их при загрузке из БД (например, из журнала ответов), а
+    before_load (async) — дописать их в БД перед загрузкой, если состояние
+    вытеснено из памяти, пока они ещё в очереди.
+    """
+
+    def __init__(self, ttl=6 * 3600, cache=None, on_load=None, before_load=None):
+        self.ttl = ttl
+        # Пустой MemorySessionStore ложен (__len__), поэтому сравнение с None
+        self.cache = cache if cache is not None else MemorySessionStore(ttl=ttl)
+        self.on_load = on_load
+        self.before_load = before_load
+
+    def _load(self, user_id):
+        from .models import QuizSession
+
+        row = QuizSession.objects.filter(user_id=user_id).values_list("data", "updated_at").first()
+        if row is None:
+            return None
+        data, updated_at = row
+        if updated_at < timezone.now() - timedelta(seconds=self.ttl):
+            QuizSession.objects.filter(user_id=user_id).delete()
+            return None
+        state = loads(data)
+        if self.on_load is not None:
+            state = self.on_load(state)
+        return state
+
+    def _store(self, user_id, raw):
+        from .models import QuizSession
+
+        QuizSession.objects.update_or_create(user_id=user_id, defaults={"data": raw})
+
+    def _remove(self, user_id):
+        from .models import QuizSession
+
+        QuizSession.objects.filter(user_id=user_id).delete()
+
+    async def get(self, user_id):
+        state = self.cache.get_sync(user_id)
+        if state is not None:
+            return state
+        if self.before_load is not None:
+            await self.before_load(user_id)
+        state = await sync_to_async(self._load)(user_id)
+        if state is not None:
+            self.cache.save_sync(user_id, state)
+        return state
+
+    async def save(self, user_id, state, persist=True):
+        self.cache.save_sync(user_id, state)
+        if persist:
+            await sync_to_async(self._store)(user_id, dumps(state))
+
+    async def delete(self, user_id):
+        self.cache.delete_sync(user_id)
+        await sync_to_async(self._remove)(user_id)
+
+    def purge_expired(self):
+        return purge_expired_sessions(self.ttl)
+
+
+def purge_expired_sessions(ttl):
+    """Удаляет из БД сессии старше ttl секунд. Возвращает число удалённых строк."""
+    from .models import QuizSession
+
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    deleted, _ = QuizSession.objects.filter(updated_at__lt=cutoff).delete()
+    return deleted
+
+
+def build_session_store(on_load=None, before_load=None):
+    backend = getattr(settings, "QUIZ_SESSION_STORE", "db")
+    ttl = getattr(settings, "QUIZ_SESSION_TTL", 6 * 3600)
+    memory = MemorySessionStore(
+        max_entries=getattr(settings, "QUIZ_SESSION_MAX_ENTRIES", 10000),
+        ttl=ttl,
+        max_bytes=getattr(settings, "QUIZ_SESSION_MAX_BYTES", 32 * 1024 * 1024),
+    )
+    if backend == "memory":
+        return memory
+    if backend == "db":
+        return DatabaseSessionStore(ttl=ttl, cache=memory, on_load=on_load, before_load=before_load)
+    raise ValueError(f"Неизвестный QUIZ_SESSION_STORE: {backend}")
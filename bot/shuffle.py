@@ -0,0 +1,38 @@
+"""Перемешивание вопросов и вариантов ответов в пределах одной попытки.
+
+В сессии хранится только seed: порядок вопросов перемешивается один раз при
+старте (state["question_ids"] и так хранится), а порядок ответов каждого
+вопроса вычисляется из (seed, question_id) — одна из 24 перестановок без
+копий вопросов в состоянии. Кнопка на экране переводится в канонический номер
+ответа (как в Question.correct_answer / UserAnswer.selected_option) за O(1).
+"""
+import random
+from itertools import permutations
+
+# Перестановки четырёх ответов: ORDERS[k][позиция на экране] = канонический индекс
+ORDERS = tuple(permutations(range(4)))
+
+_MASK = (1 << 64) - 1
+
+
+def new_seed():
+    return random.getrandbits(31)
+
+
+def shuffled(question_ids, seed):
+    ids = list(question_ids)
+    random.Random(seed).shuffle(ids)
+    return ids
+
+
+def option_order(seed, question_id):
+    """Перестановка ответов вопроса для попытки с этим seed (детерминированно)."""
+    x = (seed * 0x9E3779B97F4A7C15 + question_id) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return ORDERS[(x ^ (x >> 31)) % len(ORDERS)]
+
+
+def to_canonical(order, button):
+    """Номер нажатой кнопки (1–4) → канонический номер ответа (1–4)."""
+    return order[button - 1] + 1
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .images import image_files
+from .models import Question, Quiz, QuizVariant, UserResult
+from .progress import recompute_quiz_progress
+from .question_cache import question_bank
+
+
+@receiver(pre_save, sender=Question)
+def remember_question_variant(sender, instance, **kwargs):
+    # Если вопрос перенесли в другой вариант — сбрасываем и старый вариант;
+    # если сменили картинку — старый file_id больше не нужен
+    if instance.pk:
+        previous = Question.objects.filter(pk=instance.pk).values_list("variant_id", "image_url").first()
+        if previous:
+            instance._previous_variant_id, instance._previous_image_url = previous
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_variant(sender, instance, **kwargs):
+    question_bank.invalidate(instance.variant_id)
+    previous = getattr(instance, "_previous_variant_id", None)
+    if previous and previous != instance.variant_id:
+        question_bank.invalidate(previous)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def forget_question_image(sender, instance, **kwargs):
+    if kwargs.get("signal") is post_delete:
+        url = instance.image_url
+    else:
+        url = getattr(instance, "_previous_image_url", None)
+        if url == instance.image_url:
+            return
+    if url and not Question.objects.filter(image_url=url).exists():
+        image_files.forget(url)
+
+
+@receiver(post_save, sender=QuizVariant)
+@receiver(post_delete, sender=QuizVariant)
+def invalidate_variant(sender, instance, **kwargs):
+    question_bank.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def invalidate_quiz(sender, instance, **kwargs):
+    # Название викторины хранится в снимках вариантов
+    question_bank.invalidate()
+
+
+@receiver(post_delete, sender=UserResult)
+def recompute_progress_after_result_delete(sender, instance, **kwargs):
+    # Иначе попытки, лучший балл и ✅ у вариантов учитывали бы удалённый результат
+    recompute_quiz_progress(instance.user_profile_id, instance.quiz_id)
@@ -1,11 +1,41 @@
+import logging
+import uuid
+from functools import lru_cache
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
-from telegram.constants import ParseMode
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest
 from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import (Quiz, AllowedUser, InviteToken, UserProfile)
+from .access import get_quiz_access, redeem_invite_token
+from .completion import save_quiz_result
+from .images import send_photo_cached
+from .journal import answer_journal, restore_pending_answers
+from .question_cache import question_bank
+from .ratelimit import PRIORITY_MENU, PRIORITY_QUESTION
+from .render import menus
+from .results import get_results_page, parse_page_callback, results_cache
+from .sessions import build_session_store
+from .shuffle import new_seed, option_order, shuffled, to_canonical
+
+logger = logging.getLogger(__name__)
+
+
+async def flush_before_load(user_id):
+    # Состояние вытеснено из памяти, а ответы ещё в очереди журнала: дописываем
+    # их в PendingAnswer, чтобы restore_pending_answers их учёл
+    await answer_journal.flush()
+
 
-from .models import (Quiz, QuizVariant, Question, UserResult, UserAnswer, AllowedUser, InviteToken, UserProfile)
+# Состояния пользователей: компактный JSON (ID вопросов, индекс, счёт, ответы)
+user_states = build_session_store(on_load=restore_pending_answers, before_load=flush_before_load)
 
-user_states = {}
+# Приоритет в очереди исходящих (bot/ratelimit.py): вопросы раньше меню
+QUESTION_RL = {"priority": PRIORITY_QUESTION}
+MENU_RL = {"priority": PRIORITY_MENU}
 
 def extract_user_id(obj):
     if hasattr(obj, "effective_user") and obj.effective_user:
@@ -24,22 +54,6 @@ def set_user_profile_name(user_id, name):
     profile.user_name = name
     profile.save()
 
-@sync_to_async
-def check_quiz_access(user_id, quiz_id):
-    try:
-        quiz = Quiz.objects.get(id=quiz_id)
-        token = InviteToken.objects.filter(quiz=quiz).order_by('-id').first()
-        if not token:
-            return False, "🚫 Бұл викторинаға арналған токен жоқ."
-        if token.used_count >= token.usage_limit:
-            return False, "🚫 Токен қолданылып қойған. Қол жеткізу жабық."
-        allowed = AllowedUser.objects.filter(user_profile__user_id=user_id, quiz=quiz).exists()
-        if not allowed:
-            return False, "🚫 Бұл викторинаға қол жеткізу рұқсатыңыз жоқ."
-        return True, ""
-    except Quiz.DoesNotExist:
-        return False, "🚫 Викторина табылмады."
-
 @sync_to_async
 def check_quiz_access_by_title(user_id, quiz_title):
     try:
@@ -55,24 +69,11 @@ def check_quiz_access_by_title(user_id, quiz_title):
 
 @sync_to_async
 def get_valid_invite_token_and_quiz(code, user_id):
-    try:
-        token = InviteToken.objects.select_related("quiz").get(token=code)
-        if token.is_valid():
-            quiz = token.quiz
-            already_allowed = AllowedUser.objects.filter(user_profile__user_id=user_id, quiz=quiz).exists()
-            if not already_allowed:
-                token.used_count += 1
-                token.save()
-            return quiz
-    except InviteToken.DoesNotExist:
-        return None
-    return None
+    # Атомарное погашение: возвращает quiz_id или None
+    return redeem_invite_token(code, user_id=user_id)
 
 @sync_to_async
-def add_allowed_user_db(user_id, quiz, user_name, invite_token=None):
-    if not isinstance(quiz, Quiz):
-        raise ValueError(f"Күтілген Quiz үлгісі, бірақ {type(quiz)} табылды")
-
+def add_allowed_user_db(user_id, quiz_id, user_name, invite_token=None):
     profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
 
     if profile.user_name != user_name:
@@ -88,34 +89,41 @@ def add_allowed_user_db(user_id, quiz, user_name, invite_token=None):
 
     AllowedUser.objects.update_or_create(
         user_profile=profile,
-        quiz=quiz,
+        quiz_id=quiz_id,
         defaults={
             'invite_token': invite_token_obj
         }
     )
 
-@sync_to_async
-def clean_expired_access(user_id):
-    for allowed in AllowedUser.objects.filter(user_profile__user_id=user_id):
-        tokens = InviteToken.objects.filter(quiz=allowed.quiz)
-        if all(not t.is_valid() for t in tokens):
-            allowed.delete()
-
 @sync_to_async
 def is_user_allowed(user_id):
     return AllowedUser.objects.filter(user_profile__user_id=user_id).exists()
 
 @sync_to_async
-def get_allowed_quizzes(user_id):
-    return list(Quiz.objects.filter(alloweduser__user_profile__user_id=user_id))
+def get_allowed_quiz_ids(user_id):
+    return set(Quiz.objects.filter(alloweduser__user_profile__user_id=user_id).values_list("id", flat=True))
+
+async def get_current_question(state):
+    snapshot = await question_bank.aget(state["variant_id"])
+    if snapshot is None:
+        return None
+    question_id = state["question_ids"][state["index"]]
+    if question_id not in snapshot.by_id and snapshot.sample_size:
+        # Снимок пула перезагрузился — догружаем оставшиеся вопросы попытки
+        await question_bank.aprefetch(snapshot, state["question_ids"][state["index"]:])
+    return snapshot.by_id.get(question_id)
+
+def current_option_order(state, q):
+    """Порядок ответов на экране (None — канонический)."""
+    seed = state.get("option_seed")
+    return option_order(seed, q.id) if seed is not None else None
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = extract_user_id(update)
-    await clean_expired_access(user_id)
-
+    # Истёкший доступ удаляется фоновой очисткой (bot/maintenance.py)
     allowed = await is_user_allowed(user_id)
     if allowed:
-        user_states[user_id] = {"stage": "select_quiz"}
+        await user_states.save(user_id, {"stage": "select_quiz"})
         await update.message.reply_text("Сәлем! Саған қолжетімді викториналар:")
         await show_quiz_options(update, context, only_allowed=True)
     else:
@@ -128,25 +136,24 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = extract_user_id(update)
-    state = user_states.get(user_id, {})
+    state = await user_states.get(user_id) or {}
     text = update.message.text.strip()
 
     # 🔑 Пайдаланушы "Менде токен бар" деп таңдайды
     if text == "🔑 Менде токен бар":
-        user_states[user_id] = {"stage": "waiting_token"}
+        await user_states.save(user_id, {"stage": "waiting_token"})
         await update.message.reply_text("🔐 Қол жеткізу токенін енгізіңіз:")
         return
 
     # 🟠 Пайдаланушы токен енгізеді
     if state.get("stage") == "waiting_token":
-        quiz = await get_valid_invite_token_and_quiz(text, user_id)
-        if quiz:
-            user_states[user_id] = {
+        quiz_id = await get_valid_invite_token_and_quiz(text, user_id)
+        if quiz_id:
+            await user_states.save(user_id, {
                 "stage": "ask_name",
-                "quiz_id": quiz.id,
-                "quiz_obj": quiz,
+                "quiz_id": quiz_id,
                 "invite_token": text
-            }
+            })
             await update.message.reply_text("✅ Қол жеткізу рұқсат етілді!", reply_markup=ReplyKeyboardRemove())
             await update.message.reply_text("Енді өз атыңды жазыңыз:")
         else:
@@ -161,44 +168,37 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     # 🔄 Белгілі бір викторинаға арналған токен тексеру
     if state.get("stage") == "waiting_token_for_quiz":
         quiz_id = state.get("requested_quiz_id")
-        try:
-            token = await sync_to_async(
-                InviteToken.objects.select_related("quiz").get
-            )(token=text, quiz_id=quiz_id)
-
-            if await sync_to_async(token.is_valid)():
-                await sync_to_async(token.mark_used)()
-                quiz = token.quiz
-                profile = await get_user_profile(user_id)
-                user_name = profile.user_name if profile else "Аты белгісіз"
+        redeemed = await sync_to_async(redeem_invite_token)(text, user_id=user_id, quiz_id=quiz_id)
 
-                if not isinstance(quiz, Quiz):
-                    raise ValueError("quiz Quiz үлгісінде емес")
+        if redeemed:
+            profile = await get_user_profile(user_id)
+            user_name = profile.user_name if profile else "Аты белгісіз"
 
-                await add_allowed_user_db(user_id, quiz, user_name, invite_token=text)
+            await add_allowed_user_db(user_id, redeemed, user_name, invite_token=text)
 
-                user_states[user_id] = {
-                    "stage": "ask_name",
-                    "quiz_id": quiz.id,
-                    "quiz_obj": quiz
-                }
+            await user_states.save(user_id, {
+                "stage": "ask_name",
+                "quiz_id": redeemed
+            })
 
-                await context.bot.send_message(chat_id=user_id, text="✅ Қол жеткізу рұқсат етілді!")
-                await handle_quiz_selection_with_id(user_id, quiz.id, context)
-                return
-            else:
-                await context.bot.send_message(chat_id=user_id, text="❌ Токен жарамсыз.")
-                return
+            await context.bot.send_message(chat_id=user_id, text="✅ Қол жеткізу рұқсат етілді!")
+            await handle_quiz_selection_with_id(user_id, redeemed, context)
+            return
 
-        except InviteToken.DoesNotExist:
+        exists = await sync_to_async(
+            InviteToken.objects.filter(token=text, quiz_id=quiz_id).exists
+        )()
+        if exists:
+            await context.bot.send_message(chat_id=user_id, text="❌ Токен жарамсыз.")
+        else:
             await context.bot.send_message(chat_id=user_id, text="🚫 Токен табылмады.")
-            return
+        return
 
     await update.message.reply_text("Бастау үшін /start командасын пайдаланыңыз.")
 
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = extract_user_id(update)
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
     if not state or state.get("stage") != "ask_name":
         await update.message.reply_text("Өтінемін, /start командасынан бастаңыз.")
         return
@@ -208,34 +208,33 @@ async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     token_used = state.get("invite_token")  # ✅ Получаем токен
 
     if not quiz_id:
-        user_states[user_id] = {"stage": "waiting_token"}
+        await user_states.save(user_id, {"stage": "waiting_token"})
         await update.message.reply_text("🔑 Қол жеткізу токенін енгізіңіз:")
         return
 
-    quiz = await sync_to_async(Quiz.objects.get)(id=quiz_id)
-
     await set_user_profile_name(user_id, user_name)
-    await add_allowed_user_db(user_id, quiz, user_name, invite_token=token_used)  # ✅ Передаём токен
+    await add_allowed_user_db(user_id, quiz_id, user_name, invite_token=token_used)  # ✅ Передаём токен
 
-    user_states[user_id] = {
+    await user_states.save(user_id, {
         "stage": "select_quiz",
         "name": user_name
-    }
+    })
 
     await update.message.reply_text(f"Танысқаныма қуаныштымын, {user_name} ✨")
     await show_quiz_options(update, context, only_allowed=True)
 
 async def show_quiz_options(update_or_query, context: ContextTypes.DEFAULT_TYPE, only_allowed=False):
     user_id = extract_user_id(update_or_query)
-    quizzes = await get_allowed_quizzes(user_id) if only_allowed else await sync_to_async(list)(Quiz.objects.all())
-    if not quizzes:
+    # Кнопки готовые (bot/render.py); на запрос — только фильтр доступных
+    markup = await menus.quiz_markup(await get_allowed_quiz_ids(user_id) if only_allowed else None)
+    if markup is None:
         await context.bot.send_message(chat_id=user_id, text="Қол жетімді викториналар жоқ.")
         return
-    keyboard = [[InlineKeyboardButton(q.title, callback_data=f"quiz_{q.id}")] for q in quizzes]
     await context.bot.send_message(
         chat_id=user_id,
         text="📝 Викторинаны таңдаңыз:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=markup,
+        rate_limit_args=MENU_RL,
     )
 
 
@@ -244,40 +243,32 @@ async def handle_quiz_selection(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
     quiz_id = int(query.data.split("_")[1])
     user_id = extract_user_id(query)
-    allowed = await sync_to_async(
-        lambda: AllowedUser.objects.filter(user_profile__user_id=user_id, quiz_id=quiz_id).exists()
-    )()
-    if not allowed:
-        user_states[user_id] = {
+    # Доступ, варианты и пройденные варианты — одним запросом
+    access = await sync_to_async(get_quiz_access)(user_id, quiz_id)
+    if not access.allowed:
+        await user_states.save(user_id, {
             "stage": "waiting_token_for_quiz",
             "requested_quiz_id": quiz_id
-        }
+        })
         await query.message.reply_text("🚫 Бұл викторинаға қол жеткізу рұқсатыңыз жоқ.\nҚол жеткізу токенін енгізіңіз:")
         return
-    await handle_quiz_selection_with_id(user_id, quiz_id, context)
+    await handle_quiz_selection_with_id(user_id, quiz_id, context, access=access)
 
 
-async def handle_quiz_selection_with_id(user_id, quiz_id, context):
-    access_granted, message = await check_quiz_access(user_id, quiz_id)
-    if not access_granted:
-        await context.bot.send_message(chat_id=user_id, text=message)
+async def handle_quiz_selection_with_id(user_id, quiz_id, context, access=None):
+    if access is None:
+        access = await sync_to_async(get_quiz_access)(user_id, quiz_id)
+    if not access.granted:
+        await context.bot.send_message(chat_id=user_id, text=access.message)
         return
-    variants = await sync_to_async(list)(QuizVariant.objects.filter(quiz_id=quiz_id))
-    if not variants:
+    if not access.variants:
         await context.bot.send_message(chat_id=user_id, text="Бұл викторина үшін нұсқалар жоқ.")
         return
-    user_results = await sync_to_async(list)(
-        UserResult.objects.filter(user_profile__user_id=user_id, quiz_id=quiz_id)
-    )
-    passed_ids = [r.variant_id for r in user_results if r.variant_id]
-    keyboard = [
-        [InlineKeyboardButton(f"✅ {v.title}" if v.id in passed_ids else v.title, callback_data=f"variant_{v.id}")]
-        for v in variants
-    ]
     await context.bot.send_message(
         chat_id=user_id,
         text="📂 Викторина нұсқасын таңдаңыз:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=menus.variant_markup(access.variants, access.passed_ids),
+        rate_limit_args=MENU_RL,
     )
 
 async def handle_variant_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -292,212 +283,324 @@ async def handle_variant_selection(update: Update, context: ContextTypes.DEFAULT
 
     user_id = extract_user_id(query)
 
-    # Получаем вопросы по варианту
-    questions = await sync_to_async(list)(
-        Question.objects.filter(variant_id=variant_id)
-    )
+    # Снимок варианта из кэша банка вопросов
+    variant = await question_bank.aget(variant_id)
 
-    if not questions:
+    if variant is None or not variant.pool_ids:
         await query.message.reply_text("❌ Бұл вариантта сұрақтар табылмады.")
         return
 
-    # Получаем сам вариант и связанную викторину
-    variant = await sync_to_async(
-        QuizVariant.objects.select_related("quiz").get
-    )(id=variant_id)
-
     # Получаем имя пользователя из профиля
     user_profile = await get_user_profile(user_id)
     user_name = user_profile.user_name
 
-    # Сохраняем состояние
-    user_states[user_id] = {
-        "quiz_id": variant.quiz.id,
-        "variant_id": variant.id,
-        "questions": questions,
+    # Сохраняем состояние (answers: список [question_id, selected, is_correct],
+    # selected — канонический номер ответа независимо от перемешивания)
+    # Для пула — случайная выборка ID; записи грузятся только для неё
+    question_ids = variant.draw()
+    await question_bank.aprefetch(variant, question_ids)
+    if variant.shuffle_questions:
+        question_ids = shuffled(question_ids, new_seed())
+    state = {
+        "quiz_id": variant.quiz_id,
+        "variant_id": variant.variant_id,
+        "question_ids": question_ids,
         "index": 0,
         "score": 0,
         "answers": [],
         "name": user_name,
         "stage": "in_quiz",
         "answered": False,
+        "attempt": uuid.uuid4().hex,
     }
+    if variant.shuffle_options:
+        state["option_seed"] = new_seed()
+    await user_states.save(user_id, state)
 
     # Отправляем сообщение о выбранной теме и варианте
     await query.message.reply_text(
-        f"📘 Тақырып: *{variant.quiz.title}*\n"
-        f"📑 Таңдалған вариант: *{variant.title}*",
+        f"📘 Тақырып: *{variant.quiz_title}*\n"
+        f"📑 Таңдалған вариант: *{variant.variant_title}*",
         parse_mode=ParseMode.MARKDOWN,
     )
 
     # Показываем первый вопрос
     await send_question(query, context)
-async def send_question(update_or_query, context: ContextTypes.DEFAULT_TYPE):
+
+# Текст вопроса рендерится один раз в снимке варианта (QuestionRecord.render,
+# для каждой перестановки ответов), клавиатура ответов — одна на номер вопроса
+@lru_cache(maxsize=512)
+def answer_markup(index):
+    """Кнопки ответов вопроса №index: callback_data "index:кнопка". Номер отсекает
+    запоздалое нажатие, когда компактный режим правит то же сообщение (message_id
+    не меняется) — иначе двойной тап засчитался бы следующему вопросу."""
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(f"{i + 1}️⃣", callback_data=f"{index}:{i + 1}")] for i in range(4)]
+    )
+
+def parse_answer(data):
+    """callback_data ответа → (номер вопроса или None для старых кнопок, кнопка 1–4)."""
+    index, _, button = data.rpartition(":")
+    return (int(index) if index else None), int(button)
+
+AFTER_QUIZ_TEXT = "Қандай әрекет жасаймыз?"
+AFTER_QUIZ_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔁 Басқа викторинаны бастау", callback_data="again")],
+    [InlineKeyboardButton("📊 Нәтижелерімді көру", callback_data="view_results")]
+])
+
+def is_compact():
+    return settings.QUIZ_PRESENTATION == "compact"
+
+def closing_text(message, feedback):
+    """Отвеченный вопрос + отзыв; вопрос укорачивается, чтобы уложиться в лимит
+    подписи (1024) или текста (4096) Telegram."""
+    limit = MessageLimit.CAPTION_LENGTH if message.photo else MessageLimit.MAX_TEXT_LENGTH
+    original = message.caption if message.photo else message.text
+    if not original:
+        return feedback[:limit]
+    room = limit - len(feedback) - 2
+    if len(original) > room:
+        original = original[:max(room - 1, 0)] + "…"
+    return f"{original}\n\n{feedback}"
+
+async def replace_message(query, text, reply_markup=None):
+    """Заменяет текст (или подпись фото) сообщения с кнопками, на которое нажали."""
+    if query.message.photo:
+        await query.edit_message_caption(caption=text, reply_markup=reply_markup)
+    else:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def send_question(update_or_query, context: ContextTypes.DEFAULT_TYPE, feedback=None):
+    """Отправляет текущий вопрос (или итог викторины).
+
+    feedback передаётся только в компактном режиме: это отзыв на ответ из
+    сообщения update_or_query, он объединяется со следующим вопросом —
+    текстовый вопрос заменяет предыдущий на месте (edit_message_text).
+    """
     user_id = extract_user_id(update_or_query)
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
 
-    if not state:
+    if not state or "question_ids" not in state:
         await context.bot.send_message(chat_id=user_id, text="⚠️ Қате орын алды. Алдымен викторинаны бастаңыз.")
         return
 
     index = state["index"]
-    questions = state["questions"]
+    question_ids = state["question_ids"]
 
     # --- Если викторина завершена ---
-    if index >= len(questions):
-        quiz = await sync_to_async(Quiz.objects.get)(id=state["quiz_id"])
-        variant = await sync_to_async(QuizVariant.objects.get)(id=state["variant_id"])
-        profile = await get_user_profile(user_id)
-
-        result = await sync_to_async(UserResult.objects.create)(
-            user_profile=profile,
-            quiz=quiz,
-            variant=variant,
-            score=state["score"],
-            total=len(questions)
-        )
-
-        # Сохраняем все ответы пользователя
-        for answer in state["answers"]:
-            await sync_to_async(UserAnswer.objects.create)(
-                result=result,
-                question=answer["question"],
-                selected_option=answer["selected"],
-                is_correct=answer["is_correct"]
+    if index >= len(question_ids):
+        # Результат и все ответы — одной транзакцией
+        attempt = state.get("attempt")
+        pending = await answer_journal.discard(attempt) if attempt else []
+        try:
+            await sync_to_async(save_quiz_result)(
+                user_id,
+                state["quiz_id"],
+                state["variant_id"],
+                state["score"],
+                len(question_ids),
+                state["answers"],
+                attempt,
             )
+        except Exception:
+            # Результат не записан — ответы попытки остаются в журнале
+            await answer_journal.requeue(pending)
+            raise
+        results_cache.invalidate_user(user_id)
+
+        await user_states.save(user_id, {"stage": "select_quiz", "name": state.get("name")})
+
+        final = f"🎉 Викторина аяқталды! Сіздің нәтижеңіз: {state['score']} / {len(question_ids)}."
+        if feedback is not None:
+            # Отзыв, итог и действия — одним редактированием
+            try:
+                await replace_message(update_or_query, f"{feedback}\n\n{final}\n\n{AFTER_QUIZ_TEXT}", AFTER_QUIZ_MARKUP)
+                return
+            except BadRequest as e:
+                logger.warning("Не удалось отредактировать сообщение %s: %s", user_id, e)
+                await context.bot.send_message(chat_id=user_id, text=feedback, rate_limit_args=QUESTION_RL)
 
         # Отправляем итоговый результат
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"🎉 Викторина аяқталды! Сіздің нәтижеңіз: {state['score']} / {len(questions)}."
-        )
+        await context.bot.send_message(chat_id=user_id, text=final)
 
         # Предлагаем действия после викторины
         await context.bot.send_message(
-            chat_id=user_id,
-            text="Қандай әрекет жасаймыз?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔁 Басқа викторинаны бастау", callback_data="again")],
-                [InlineKeyboardButton("📊 Нәтижелерімді көру", callback_data="view_results")]
-            ])
+            chat_id=user_id, text=AFTER_QUIZ_TEXT, reply_markup=AFTER_QUIZ_MARKUP, rate_limit_args=MENU_RL
         )
         return
 
     # --- Получаем текущий вопрос ---
-    q = questions[index]
-    text = (
-        f"{q.question}\n\n"
-        f"1️⃣ {q.option1}\n\n"
-        f"2️⃣ {q.option2}\n\n"
-        f"3️⃣ {q.option3}\n\n"
-        f"4️⃣ {q.option4}"
-    )
-
-    # --- Кнопки для ответов ---
-    buttons = [[InlineKeyboardButton(f"{i + 1}️⃣", callback_data=str(i + 1))] for i in range(4)]
-    markup = InlineKeyboardMarkup(buttons)
+    q = await get_current_question(state)
+    if q is None:
+        await context.bot.send_message(chat_id=user_id, text="⚠️ Қате орын алды. Алдымен викторинаны бастаңыз.")
+        return
+    text = q.render(current_option_order(state, q))
+    markup = answer_markup(index)
 
     # --- Отправляем вопрос с поддержкой только image_url ---
-    image_url_field = getattr(q, "image_url", None)
+    image_url_field = q.image_url
+    message = None
 
-    try:
-        if image_url_field:
-            # Если есть ссылка на изображение — отправляем с фото
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=image_url_field,
-                caption=text,
-                reply_markup=markup
-            )
-        else:
-            # Если картинки нет — просто текст
-            await context.bot.send_message(
+    if feedback is not None:
+        answered = update_or_query.message
+        combined = f"{feedback}\n\n{text}"
+        try:
+            if not image_url_field and not answered.photo and len(combined) <= MessageLimit.MAX_TEXT_LENGTH:
+                # Текст → текст: отзыв и следующий вопрос в том же сообщении
+                await update_or_query.edit_message_text(combined, reply_markup=markup)
+                message = answered
+            else:
+                # Фото нельзя превратить в текст (и наоборот): закрываем отвеченный
+                # вопрос отзывом, следующий отправляем новым сообщением
+                await replace_message(update_or_query, closing_text(answered, feedback))
+        except BadRequest as e:
+            # Сообщение не отредактировать (старое, удалено, ...) — отзыв и вопрос
+            # отдельными сообщениями, как в подробном режиме
+            logger.warning("Не удалось отредактировать сообщение %s: %s", user_id, e)
+            await context.bot.send_message(chat_id=user_id, text=feedback, rate_limit_args=QUESTION_RL)
+
+    if message is None:
+        try:
+            if image_url_field:
+                # Если есть ссылка на изображение — отправляем с фото (по file_id, если уже загружали)
+                message = await send_photo_cached(
+                    context.bot,
+                    user_id,
+                    image_url_field,
+                    caption=text,
+                    reply_markup=markup,
+                    rate_limit_args=QUESTION_RL,
+                )
+            else:
+                # Если картинки нет — просто текст
+                message = await context.bot.send_message(
+                    chat_id=user_id,
+                    text=text,
+                    reply_markup=markup,
+                    rate_limit_args=QUESTION_RL,
+                )
+
+        except Exception as e:
+            # Если картинка не загрузилась — не прерываем викторину
+            logger.warning("Ошибка при отправке фото %s пользователю %s: %s", image_url_field, user_id, e)
+            message = await context.bot.send_message(
                 chat_id=user_id,
                 text=text,
-                reply_markup=markup
+                reply_markup=markup,
+                rate_limit_args=QUESTION_RL,
             )
 
-    except Exception as e:
-        # Если картинка не загрузилась — не прерываем викторину
-        print("Ошибка при отправке фото:", e)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=text,
-            reply_markup=markup
-        )
-
     state["answered"] = False
+    state["message_id"] = message.message_id
+    state.pop("restored", None)
+    await user_states.save(user_id, state, persist=False)
 
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = extract_user_id(query)
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
 
-    if not state or "questions" not in state or "index" not in state:
+    if not state or "question_ids" not in state or "index" not in state:
         await context.bot.send_message(chat_id=user_id, text="Қате орын алды. /start командасынан қайта бастаңыз.")
         return
 
+    # Повторное нажатие: апдейты одного пользователя обрабатываются строго
+    # по очереди (PerUserUpdateProcessor), поэтому проверка без гонок
     if state.get("answered"):
         return
 
+    # Нажатие на кнопку уже отвеченного (старого) вопроса: по номеру вопроса
+    # в callback_data, у кнопок без номера — по сообщению
+    token, selected = parse_answer(query.data)
+    if token is not None and token != state["index"]:
+        # Состояние восстановлено из БД и отстаёт от показанного вопроса
+        # (ответы не успели записаться до падения) — показываем вопрос заново
+        if state.pop("restored", False):
+            await send_question(query, context)
+        return
+    if state.get("message_id") and query.message and query.message.message_id != state["message_id"]:
+        return
+
     state["answered"] = True
+    await user_states.save(user_id, state, persist=False)
 
-    # ✅ Безопасное удаление inline клавиатуры
-    if query.message.reply_markup is not None:
+    # ✅ Безопасное удаление inline клавиатуры (в компактном режиме её заменит следующий вопрос)
+    compact = is_compact()
+    if not compact and query.message.reply_markup is not None:
         await query.edit_message_reply_markup(reply_markup=None)
 
-    index = state["index"]
-    questions = state["questions"]
-    selected = int(query.data)
-    correct = int(questions[index].correct_answer)
+    q = await get_current_question(state)
+    if q is None:
+        await context.bot.send_message(chat_id=user_id, text="Қате орын алды. /start командасынан қайта бастаңыз.")
+        return
+    order = current_option_order(state, q)
+    if order is not None:
+        selected = to_canonical(order, selected)
+    correct = int(q.correct_answer)
 
     feedback = (
         "✅ Дұрыс!" if selected == correct else
-        f"❌ Қате. Дұрыс жауап: {[questions[index].option1, questions[index].option2, questions[index].option3, questions[index].option4][correct - 1]}"
+        f"❌ Қате. Дұрыс жауап: {q.options[correct - 1]}"
     )
 
     if selected == correct:
         state["score"] += 1
 
-    state["answers"].append({
-        "question": questions[index],
-        "selected": selected,
-        "is_correct": selected == correct
-    })
+    state["answers"].append([q.id, selected, selected == correct])
+    # Ответ уходит в БД фоновой пачкой — без ожидания записи здесь
+    if state.get("attempt"):
+        answer_journal.append(state["attempt"], user_id, q.id, selected, selected == correct)
 
     state["index"] += 1
+    await user_states.save(user_id, state, persist=False)
 
-    await context.bot.send_message(chat_id=user_id, text=feedback)
+    if compact:
+        await send_question(query, context, feedback=feedback)
+        return
+
+    await context.bot.send_message(chat_id=user_id, text=feedback, rate_limit_args=QUESTION_RL)
     await send_question(query, context)
 
-@sync_to_async
-def get_results_with_variants(user_id):
-    results = UserResult.objects.filter(user_profile__user_id=user_id).select_related("quiz", "variant").order_by('-id')
-    output = []
-    for i, r in enumerate(results, 1):
-        date = r.timestamp.strftime('%d.%m.%Y %H:%M') if r.timestamp else "—"
-        variant_title = r.variant.title if r.variant else "—"
-        output.append(
-            f"{i}) {r.quiz.title}\n"
-            f"📄 {variant_title}\n"
-            f"✅ Балл: {r.score}/{r.total}\n"
-            f"📅 {date}\n\n"
-        )
-    return output
+def results_markup(page):
+    buttons = []
+    if page.newer:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=page.newer))
+    if page.older:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=page.older))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
 
 async def show_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = extract_user_id(update)
-    lines = await get_results_with_variants(user_id)
-    text = "📊 *Сіздің нәтижелеріңіз:*\n\n" + "".join(lines) if lines else "📭 Әзірге нәтижелер жоқ."
-    parts = [text[i:i+4096] for i in range(0, len(text), 4096)]
+    page = await get_results_page(user_id)
     if update.callback_query:
         await update.callback_query.answer()  # ✅ Telegram требует ответ
-        for part in parts:
-            await update.callback_query.message.reply_text(part, parse_mode=ParseMode.MARKDOWN)
+        message = update.callback_query.message
     elif update.message:
-        for part in parts:
-            await update.message.reply_text(part, parse_mode=ParseMode.MARKDOWN)
+        message = update.message
+    else:
+        return
+    await message.reply_text(page.text, parse_mode=ParseMode.MARKDOWN, reply_markup=results_markup(page))
+
+async def handle_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = extract_user_id(query)
+    try:
+        direction, cursor, offset = parse_page_callback(query.data)
+    except ValueError:
+        return
+    page = await get_results_page(user_id, direction, cursor, offset)
+    if page is None:
+        return
+    # Листаем в том же сообщении
+    try:
+        await query.edit_message_text(page.text, parse_mode=ParseMode.MARKDOWN, reply_markup=results_markup(page))
+    except BadRequest as e:
+        # Повторное нажатие на кнопку уже показанной страницы — менять нечего
+        if "message is not modified" not in str(e).lower():
+            raise
 
 async def handle_quiz_repeat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
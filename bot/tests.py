@@ -1,3 +1,1868 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+from openpyxl import Workbook, load_workbook
+from PIL import Image
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import BaseRequest
+
+from . import application as application_module
+from . import images as images_module
+from . import telegram_logic as tl
+from .analytics import group_thresholds, question_stats, variant_summary
+from .access import get_quiz_access, redeem_invite_token
+from .application import with_bot_lifespan
+from .completion import save_quiz_result
+from .dispatcher import PerUserUpdateProcessor
+from .exports import ANSWER_COLUMNS, export_rows
+from .images import image_files, prewarm_variants, send_photo_cached
+from .importers import QuestionImportError, XlsxSource, import_questions, import_questions_csv, open_google_sheet
+from .journal import AnswerJournal, answer_journal
+from .maintenance import expire_access, maintenance_loop, run_maintenance
+from .models import (
+    AllowedUser, InviteToken, PendingAnswer, Question, Quiz, QuizProgress, QuizSession, QuizVariant, TelegramImage,
+    UserAnswer, UserProfile, UserResult,
+)
+from .progress import rebuild_quiz_progress
+from .question_cache import QuestionBankCache, QuestionRecord, allocate, question_bank
+from .ratelimit import PRIORITY_MENU, PRIORITY_QUESTION, QuizRateLimiter
+from .render import menus
+from .results import MESSAGE_LIMIT, fetch_results_page, format_summary, parse_page_callback
+from .sessions import DatabaseSessionStore, MemorySessionStore, dumps, loads
+from .shuffle import ORDERS, option_order, to_canonical
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ImageStubHandler(BaseHTTPRequestHandler):
+    files = {
+        "/small.png": png_bytes(100, 80),
+        "/large.png": png_bytes(4000, 3000),
+        "/broken.png": b"not an image",
+    }
+
+    def do_GET(self):
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePhoto:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    def __init__(self, file_id):
+        self.photo = [FakePhoto(file_id + "-thumb"), FakePhoto(file_id)]
+
+
+class FakeBot:
+    def __init__(self):
+        self.uploads = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.uploads.append(photo)
+        with Image.open(io.BytesIO(photo)) as image:
+            return FakeMessage(f"file-{len(self.uploads)}-{image.width}x{image.height}")
+
+
+@override_settings(IMAGE_MAX_SIDE=1280)
+class PrewarmImagesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageStubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        image_files.clear_local()
+        quiz = Quiz.objects.create(title="Exam")
+        self.variant = QuizVariant.objects.create(title="A", quiz=quiz)
+        for name in ("small.png", "large.png", "broken.png", "missing.png", "small.png"):
+            Question.objects.create(
+                variant=self.variant, question=name, option1="1", option2="2", option3="3", option4="4",
+                correct_answer=1, image_url=f"{self.base}/{name}",
+            )
+
+    def test_prewarm_uploads_each_url_once_and_reports_failures(self):
+        bot = FakeBot()
+        report = prewarm_variants([self.variant.id], chat_id="-100", bot=bot, concurrency=2)
+
+        self.assertEqual(report.total, 4)
+        self.assertEqual(report.warmed, 2)
+        self.assertEqual(report.resized, 1)
+        self.assertEqual(
+            sorted(url.rsplit("/", 1)[1] for url, _ in report.failed), ["broken.png", "missing.png"]
+        )
+        cached = dict(TelegramImage.objects.values_list("url", "file_id"))
+        self.assertEqual(set(cached), {f"{self.base}/small.png", f"{self.base}/large.png"})
+        self.assertTrue(cached[f"{self.base}/large.png"].endswith("1280x960"))
+
+        image_files.clear_local()
+        with self.assertNumQueries(2):  # URL вариантов и уже загруженные — по одному запросу
+            again = prewarm_variants([self.variant.id], chat_id="-100", bot=bot)
+        self.assertEqual(again.cached, 2)
+        self.assertEqual(again.warmed, 0)
+        self.assertEqual(len(bot.uploads), 2)
+
+    def test_uploads_to_staging_chat_respect_telegram_limits(self):
+        files = {f"/photo{i}.png": png_bytes(50 + i, 40) for i in range(6)}
+        variant = QuizVariant.objects.create(title="B")
+        for path in files:
+            Question.objects.create(variant=variant, question=path, correct_answer=1, image_url=f"{self.base}{path}")
+        bot = ChatLimitedBot(interval=0.05)
+        with mock.patch.dict(ImageStubHandler.files, files), self.assertLogs("bot.images", "WARNING"):
+            report = prewarm_variants([variant.id], chat_id="-100", bot=bot, concurrency=6)
+        self.assertEqual((report.warmed, report.failed), (6, []))
+        self.assertEqual(bot.max_in_flight, 1)
+        self.assertGreater(bot.rejected, 0)  # RetryAfter не стал ошибкой — загрузка повторена
+
+    def test_downloaded_payloads_held_in_memory_are_bounded(self):
+        files = {f"/held{i}.png": png_bytes(60 + i, 40) for i in range(8)}
+        variant = QuizVariant.objects.create(title="C")
+        for path in files:
+            Question.objects.create(variant=variant, question=path, correct_answer=1, image_url=f"{self.base}{path}")
+        bot = ChatLimitedBot(interval=0.02)
+        held = []
+        download = images_module._download
+
+        async def counting_download(client, url):
+            data = await download(client, url)
+            held.append(len(held) + 1 - len(bot.uploads))  # скачано, но ещё не загружено в чат
+            return data
+
+        with mock.patch.dict(ImageStubHandler.files, files), mock.patch.object(
+            images_module, "_download", counting_download
+        ), self.assertLogs("bot.images", "WARNING"):
+            report = prewarm_variants([variant.id], chat_id="-100", bot=bot, concurrency=2)
+        self.assertEqual(report.warmed, 8)
+        self.assertLessEqual(max(held), 2)
+
+
+class ChatLimitedBot(FakeBot):
+    """Как Telegram для одного чата: RetryAfter, если загрузки идут чаще interval."""
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self.in_flight = self.max_in_flight = self.rejected = 0
+        self.last = 0.0
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        now = time.monotonic()
+        if self.in_flight or now - self.last < self.interval:
+            self.rejected += 1
+            raise RetryAfter(timedelta(seconds=self.interval))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            return await super().send_photo(chat_id, photo, **kwargs)
+        finally:
+            self.in_flight -= 1
+            self.last = time.monotonic()
+
+
+class LimitEnforcingApi:
+    """Фейковый Bot API: RetryAfter, если за последнюю секунду запросов больше,
+    чем допускают token bucket'ы (ёмкость + скорость за окно)."""
+
+    def __init__(self, global_limit, chat_limit, fail_first=0):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.fail_first = fail_first
+        self.calls = deque()  # (время, chat_id)
+        self.delivered = []
+        self.rejected = 0
+
+    async def send(self, chat_id, text):
+        now = time.monotonic()
+        while self.calls and self.calls[0][0] < now - 1:
+            self.calls.popleft()
+        in_chat = sum(1 for _, c in self.calls if c == chat_id)
+        if self.fail_first or len(self.calls) >= self.global_limit or in_chat >= self.chat_limit:
+            self.fail_first = max(0, self.fail_first - 1)
+            self.rejected += 1
+            raise RetryAfter(1)
+        self.calls.append((now, chat_id))
+        self.delivered.append(text)
+        return True
+
+
+class StaleFileIdBot:
+    """Отклоняет file_id из rejected, по URL «загружает» фото с новым file_id."""
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        if photo in self.rejected:
+            raise BadRequest("Wrong file identifier/http url specified")
+        return FakeMessage(f"fresh-{len(self.sent)}")
+
+
+class ImageFileCacheTests(TestCase):
+    url = "https://example.com/q1.png"
+
+    def setUp(self):
+        image_files.clear_local()
+        self.addCleanup(image_files.clear_local)
+        self.variant = QuizVariant.objects.create(title="Картинки")
+
+    def question(self, url):
+        return Question.objects.create(variant=self.variant, question="?", correct_answer=1, image_url=url)
+
+    def test_changing_image_url_forgets_the_old_file_id(self):
+        question = self.question(self.url)
+        image_files.remember(self.url, "old-id")
+        question.question = "Жаңа мәтін"
+        question.save()
+        self.assertEqual(image_files.get(self.url), "old-id")  # картинка та же — file_id остаётся
+
+        question.image_url = "https://example.com/q2.png"
+        question.save()
+        image_files.clear_local()
+        self.assertIsNone(image_files.get(self.url))
+        self.assertFalse(TelegramImage.objects.filter(url=self.url).exists())
+
+    def test_file_id_shared_with_another_question_is_kept_until_last_use(self):
+        first, second = self.question(self.url), self.question(self.url)
+        image_files.remember(self.url, "shared-id")
+        first.image_url = ""
+        first.save()
+        self.assertEqual(image_files.get(self.url), "shared-id")
+
+        second.delete()
+        self.assertIsNone(image_files.get(self.url))
+
+    async def test_rejected_file_id_is_replaced_by_sending_the_url(self):
+        await image_files.aremember(self.url, "stale-id")
+        bot = StaleFileIdBot(rejected={"stale-id"})
+        with self.assertLogs("bot.images", "WARNING") as logs:
+            message = await send_photo_cached(bot, 1, self.url, caption="?")
+
+        self.assertEqual(bot.sent, ["stale-id", self.url])
+        self.assertEqual(message.photo[-1].file_id, "fresh-2")
+        self.assertIn("отклонён", logs.output[0])
+        image_files.clear_local()
+        self.assertEqual(await image_files.aget(self.url), "fresh-2")
+
+        # Следующая отправка идёт уже по новому file_id
+        await send_photo_cached(bot, 1, self.url)
+        self.assertEqual(bot.sent[-1], "fresh-2")
+
+
+class RateLimiterTests(SimpleTestCase):
+    def request(self, limiter, api, chat_id, text, priority=None):
+        return limiter.process_request(
+            api.send, (chat_id, text), {}, "sendMessage", {"chat_id": chat_id, "text": text},
+            {"priority": priority} if priority is not None else None,
+        )
+
+    async def test_burst_stays_within_global_and_per_chat_limits(self):
+        limiter = QuizRateLimiter(global_rate=10, chat_rate=5, chat_burst=2, max_retries=0)
+        api = LimitEnforcingApi(global_limit=10 + 10, chat_limit=2 + 5)
+        await asyncio.gather(*(self.request(limiter, api, i % 5, str(i)) for i in range(30)))
+
+        self.assertEqual(api.rejected, 0)
+        self.assertEqual(len(api.delivered), 30)
+        stats = limiter.stats()
+        self.assertEqual(stats["sent"], 30)
+        self.assertEqual(stats["queued"], 0)
+        self.assertGreater(stats["max_wait"], 1)
+
+    async def test_questions_are_sent_before_menus(self):
+        limiter = QuizRateLimiter(global_rate=5, chat_rate=100, chat_burst=100)
+        api = LimitEnforcingApi(global_limit=100, chat_limit=100)
+        await asyncio.gather(*(self.request(limiter, api, 0, "filler") for _ in range(5)))
+
+        await asyncio.gather(
+            *(self.request(limiter, api, i, "menu", PRIORITY_MENU) for i in range(3)),
+            *(self.request(limiter, api, i, "question", PRIORITY_QUESTION) for i in range(3, 6)),
+        )
+        self.assertEqual(api.delivered[5:], ["question"] * 3 + ["menu"] * 3)
+
+    async def test_retry_after_pauses_and_retries(self):
+        limiter = QuizRateLimiter(max_retries=2)
+        api = LimitEnforcingApi(global_limit=100, chat_limit=100, fail_first=1)
+        started = time.monotonic()
+        self.assertTrue(await self.request(limiter, api, 1, "question"))
+
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual(api.delivered, ["question"])
+        self.assertEqual(limiter.stats()["retries"], 1)
+
+
+def user_update(update_id, user_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+        },
+    }, None)
+
+
+class UpdateProcessorTests(SimpleTestCase):
+    def setUp(self):
+        self.running = Counter()  # user_id -> сколько его обработчиков выполняется сейчас
+        self.peak_per_user = 0
+        self.peak_total = 0
+        self.done = []
+
+    async def handler(self, user_id, tag, delay):
+        self.running[user_id] += 1
+        self.peak_per_user = max(self.peak_per_user, self.running[user_id])
+        self.peak_total = max(self.peak_total, sum(self.running.values()))
+        await asyncio.sleep(delay)
+        self.running[user_id] -= 1
+        self.done.append((user_id, tag))
+
+    def submit(self, processor, updates):
+        return asyncio.gather(*(
+            processor.process_update(user_update(i, user_id), self.handler(user_id, i, delay))
+            for i, (user_id, delay) in enumerate(updates)
+        ))
+
+    async def test_updates_of_one_user_run_in_order(self):
+        processor = PerUserUpdateProcessor(max_concurrent_handlers=8)
+        # Первые апдейты «медленнее» — без очереди они завершились бы в обратном порядке
+        await self.submit(processor, [(1, 0.05 - i * 0.01) for i in range(5)])
+
+        self.assertEqual(self.done, [(1, i) for i in range(5)])
+        self.assertEqual(self.peak_per_user, 1)
+        self.assertEqual(processor.stats()["max_queue_depth"], 5)
+
+    async def test_different_users_run_in_parallel(self):
+        processor = PerUserUpdateProcessor(max_concurrent_handlers=8)
+        started = time.monotonic()
+        await self.submit(processor, [(user_id, 0.2) for user_id in range(4)])
+
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(self.peak_total, 4)
+
+    async def test_handlers_are_capped(self):
+        processor = PerUserUpdateProcessor(max_concurrent_handlers=2)
+        updates = self.submit(processor, [(user_id, 0.05) for user_id in range(6)])
+        await asyncio.sleep(0.01)
+        self.assertEqual(processor.stats()["active"], 2)
+        self.assertEqual(processor.stats()["pending"], 6)
+        await updates
+
+        self.assertEqual(self.peak_total, 2)
+        self.assertEqual(
+            processor.stats(),
+            {"active": 0, "users": 0, "pending": 0, "max_queue_depth": 1, "processed": 6},
+        )
+        self.assertEqual(processor.queue_depths(), {})
+
+    async def test_maintenance_loop_reports_dispatcher_load(self):
+        processor = PerUserUpdateProcessor(max_concurrent_handlers=1)
+        updates = self.submit(processor, [(7, 0.1), (7, 0.1), (8, 0.1)])
+        await asyncio.sleep(0.01)
+        with mock.patch("bot.maintenance.run_maintenance", return_value={}), \
+                self.assertLogs("bot.maintenance", "INFO") as logs:
+            loop = asyncio.create_task(maintenance_loop(3600, processor))
+            await asyncio.sleep(0.05)
+            loop.cancel()
+        await updates
+
+        report = next(line for line in logs.output if "Апдейты" in line)
+        self.assertIn("'pending': 3", report)
+        self.assertIn("[(7, 2), (8, 1)]", report)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class AdminChangelistQueryTests(TestCase):
+    """Число запросов страницы списка не зависит от числа строк на ней."""
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+
+        cls.admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        cls.quiz = Quiz.objects.create(title="Exam")
+        cls.variant = QuizVariant.objects.create(title="A", quiz=cls.quiz)
+        cls.questions = [
+            Question.objects.create(
+                variant=cls.variant, question=f"Q{i}", option1="1", option2="2", option3="3", option4="4",
+                correct_answer=1,
+            )
+            for i in range(3)
+        ]
+        cls.token = InviteToken.objects.create(token="EXAM", quiz=cls.quiz, usage_limit=1000)
+        cls.add_rows(10)
+
+    @classmethod
+    def add_rows(cls, count):
+        start = UserProfile.objects.count()
+        for user_id in range(start, start + count):
+            profile = UserProfile.objects.create(user_id=user_id, user_name=f"user{user_id}")
+            AllowedUser.objects.create(user_profile=profile, quiz=cls.quiz, invite_token=cls.token)
+            result = UserResult.objects.create(
+                user_profile=profile, quiz=cls.quiz, variant=cls.variant, score=2, total=3
+            )
+            UserAnswer.objects.bulk_create(
+                UserAnswer(result=result, question=q, selected_option=1, is_correct=True) for q in cls.questions
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def assert_changelist_queries(self, url, expected):
+        with self.assertNumQueries(expected):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_rows(20)
+        with self.assertNumQueries(expected):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_user_result_changelist(self):
+        self.assert_changelist_queries("/admin/bot/userresult/", 5)
+
+    def test_user_result_changelist_filtered_by_variant(self):
+        self.assert_changelist_queries(
+            f"/admin/bot/userresult/?quiz__id__exact={self.quiz.id}&variant={self.variant.id}", 6
+        )
+
+    def test_user_answer_changelist(self):
+        self.assert_changelist_queries("/admin/bot/useranswer/", 5)
+
+    def test_allowed_user_changelist(self):
+        self.assert_changelist_queries("/admin/bot/alloweduser/", 5)
+
+    def test_user_result_change_form(self):
+        result = UserResult.objects.first()
+        url = f"/admin/bot/userresult/{result.pk}/change/"
+        self.client.get(url)  # прогрев кэша ContentType
+        with self.assertNumQueries(10):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        UserAnswer.objects.bulk_create(
+            UserAnswer(result=result, question=q, selected_option=2, is_correct=False) for q in self.questions * 5
+        )
+        with self.assertNumQueries(10):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+
+        cls.admin_user = User.objects.create_superuser("export-admin", "admin@example.com", "x")
+        cls.quiz = Quiz.objects.create(title="Экзамен")
+        cls.variant = QuizVariant.objects.create(quiz=cls.quiz, title="В1")
+        cls.questions = [
+            Question.objects.create(
+                variant=cls.variant, question=f"Вопрос {i}", option1="1", option2="2", option3="3", option4="4",
+                correct_answer=1,
+            )
+            for i in range(3)
+        ]
+        for user_id in range(25):
+            name = "=HYPERLINK()" if user_id == 0 else f"Ученик {user_id}"
+            profile = UserProfile.objects.create(user_id=user_id, user_name=name)
+            result = UserResult.objects.create(
+                user_profile=profile, quiz=cls.quiz, variant=cls.variant, score=1, total=3
+            )
+            UserAnswer.objects.bulk_create(
+                UserAnswer(result=result, question=q, selected_option=i + 1, is_correct=i == 0)
+                for i, q in enumerate(cls.questions)
+            )
+
+    async def run_action(self, url, action, ids):
+        await self.async_client.aforce_login(self.admin_user)
+        response = await self.async_client.post(url, {"action": action, "_selected_action": ids})
+        self.assertTrue(response.is_async)
+        return [chunk async for chunk in response.streaming_content]
+
+    @override_settings(EXPORT_CHUNK_SIZE=10)
+    async def test_results_csv_streams_selected_rows_chunk_by_chunk(self):
+        ids = [pk async for pk in UserResult.objects.values_list("id", flat=True)]
+        chunks = await self.run_action("/admin/bot/userresult/", "export_results_csv", ids)
+        self.assertEqual(len(chunks), 1 + 3)  # заголовок и по порции на каждые 10 строк
+        lines = b"".join(chunks).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0], "result_id,user_id,user_name,quiz,variant,score,total,timestamp")
+        self.assertEqual(len(lines), 26)
+        self.assertIn("'=HYPERLINK()", lines[1])  # формула не исполняется в Excel
+        self.assertIn("Экзамен,В1,1,3", lines[2])
+
+    async def test_answers_csv_for_selected_results(self):
+        ids = [pk async for pk in UserResult.objects.order_by("id").values_list("id", flat=True)[:2]]
+        chunks = await self.run_action("/admin/bot/userresult/", "export_answers_csv", ids)
+        lines = b"".join(chunks).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0], ",".join(header for header, _ in ANSWER_COLUMNS))
+        self.assertEqual(len(lines), 1 + 2 * 3)
+        self.assertIn("Вопрос 0", lines[1])
+
+    def test_rows_are_read_in_keyset_chunks(self):
+        # 75 строк по 10: 7 полных порций и последняя неполная
+        with self.assertNumQueries(8):
+            self.assertEqual(sum(1 for _ in export_rows(UserAnswer.objects.all(), ANSWER_COLUMNS, 10)), 75)
+
+    def test_command_filters_by_variant(self):
+        other = QuizVariant.objects.create(quiz=self.quiz, title="В2")
+        UserResult.objects.create(
+            user_profile=UserProfile.objects.first(), quiz=self.quiz, variant=other, score=0, total=3
+        )
+        out = io.StringIO()
+        call_command("export_results", "--variant", str(other.id), "--chunk-size", "5", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "answers.xlsx")
+            call_command("export_results", "--answers", "--format", "xlsx", "-o", path, stdout=io.StringIO())
+            self.assertEqual(len(list(load_workbook(path, read_only=True).active.values)), 76)
+
+            path = os.path.join(directory, "results.xlsx")
+            call_command("export_results", "--format", "xlsx", "-o", path, stdout=io.StringIO())
+            names = [row[2] for row in load_workbook(path).active.iter_rows(min_row=2)]
+            self.assertEqual((names[0].value, names[0].data_type), ("=HYPERLINK()", "s"))  # не формула
+            self.assertEqual({cell.data_type for cell in names}, {"s"})
+
+
+BANK_HEADER = [
+    "variant_title", "question_text", "answer_1", "answer_2", "answer_3", "answer_4",
+    "is_correct_1", "is_correct_2", "is_correct_3", "is_correct_4", "tag", "difficulty",
+]
+
+
+def bank_row(variant, number, correct=1, difficulty=None):
+    flags = [i == correct for i in range(1, 5)]
+    return [variant, f"Вопрос {number}", "a", "b", "c", "d", *flags, "алгебра", difficulty]
+
+
+class FakeWorksheet:
+    """gspread.Worksheet: row_values, row_count и get(диапазон A1)."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.row_count = len(rows) + 3  # пустые строки в конце листа, как в Sheets
+        self.ranges = []
+
+    def row_values(self, row):
+        return [str(value) for value in self.rows[row - 1]]
+
+    def get(self, range_name):
+        self.ranges.append(range_name)
+        (start, _), (end, width) = (a1_to_rowcol(part) for part in range_name.split(":"))
+        values = []
+        for cells in self.rows[start - 1:end]:
+            # Sheets отдаёт строки как текст и обрезает пустые ячейки справа
+            cells = ["" if v is None else ("TRUE" if v is True else "FALSE" if v is False else str(v)) for v in cells]
+            while cells and not cells[-1]:
+                cells.pop()
+            values.append(cells[:width])
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+class FakeGspreadClient:
+    def __init__(self, worksheets):
+        self.worksheets = worksheets
+        self.opened = []
+
+    def open_by_key(self, key):
+        self.opened.append(key)
+        client = self
+
+        class Spreadsheet:
+            sheet1 = next(iter(client.worksheets.values()))
+
+            @staticmethod
+            def worksheet(name):
+                if name not in client.worksheets:
+                    raise WorksheetNotFound(name)
+                return client.worksheets[name]
+
+        return Spreadsheet
+
+
+class ImportSourceTests(TestCase):
+    def xlsx(self, rows, title="Вопросы"):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = title
+        for row in rows:
+            sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def test_xlsx_rows_are_imported_with_native_cell_types(self):
+        fileobj = self.xlsx([
+            BANK_HEADER,
+            bank_row("В1", 1, correct=2, difficulty=3),
+            [None] * len(BANK_HEADER),
+            bank_row("В1", 2, correct=None),
+            bank_row("В2", 3, difficulty=1.0),
+        ])
+        report = import_questions(XlsxSource(fileobj, "Вопросы"), "XLSX")
+        self.assertEqual((report.created, report.variants), (2, 2))
+        self.assertEqual(report.skipped, [(4, "не указан правильный ответ (is_correct_1..4)")])
+        first = Question.objects.get(question="Вопрос 1")
+        self.assertEqual((first.correct_answer, first.difficulty, first.tag), (2, 3, "алгебра"))
+        self.assertEqual(Question.objects.get(question="Вопрос 3").difficulty, 1)
+
+    def test_xlsx_workbook_is_closed_when_import_fails(self):
+        source = XlsxSource(self.xlsx([["variant_title", "question_text"], ["В1", "?"]]), "Вопросы")
+        with mock.patch.object(source, "close", wraps=source.close) as close:
+            with self.assertRaises(QuestionImportError):
+                import_questions(source, "XLSX")
+        close.assert_called_once_with()
+        self.assertIsNone(source._workbook._archive.fp)
+
+        source = XlsxSource(self.xlsx([BANK_HEADER, bank_row("В1", 1)]), "Вопросы")
+        with mock.patch.object(Question.objects, "bulk_create", side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                import_questions(source, "XLSX")
+        self.assertIsNone(source._workbook._archive.fp)
+        self.assertFalse(Quiz.objects.filter(title="XLSX").exists())
+
+    def test_xlsx_missing_sheet(self):
+        with self.assertRaises(QuestionImportError):
+            XlsxSource(self.xlsx([BANK_HEADER]), "Нет такого")
+
+    def test_google_sheet_is_read_in_batches(self):
+        worksheet = FakeWorksheet([BANK_HEADER] + [bank_row("В1", i) for i in range(5)])
+        client = FakeGspreadClient({"Лист1": worksheet})
+        source = open_google_sheet(
+            "https://docs.google.com/spreadsheets/d/abc123/edit#gid=0", client=client, batch_rows=2
+        )
+        report = import_questions(source, "Sheets")
+        self.assertEqual(client.opened, ["abc123"])
+        self.assertEqual(worksheet.ranges, ["A2:L3", "A4:L5", "A6:L7", "A8:L9"])
+        self.assertEqual(report.created, 5)
+        self.assertEqual(Question.objects.filter(variant__quiz__title="Sheets", correct_answer=1).count(), 5)
+
+        report = import_questions(open_google_sheet("abc123", "Лист1", client=client), "Sheets", incremental=True)
+        self.assertEqual((report.created, report.unchanged), (0, 5))
+
+    def test_google_sheet_missing_worksheet(self):
+        client = FakeGspreadClient({"Лист1": FakeWorksheet([BANK_HEADER])})
+        with self.assertRaises(QuestionImportError):
+            open_google_sheet("abc123", "Лист2", client=client)
+
+
+def bank_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(BANK_HEADER)
+    writer.writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+class IncrementalImportTests(TestCase):
+    def test_only_the_difference_is_written(self):
+        first = import_questions_csv(
+            bank_csv([bank_row("В1", i) for i in range(1, 5)] + [bank_row("В1", 1)]), "Синхрон"
+        )
+        self.assertEqual(first.created, 5)  # обычный импорт: дубликат «Вопрос 1» тоже создан
+        kept_id = Question.objects.filter(question="Вопрос 1").earliest("id").id
+        answered = Question.objects.get(question="Вопрос 2")
+        profile = UserProfile.objects.create(user_id=9100, user_name="Ученик")
+        result = UserResult.objects.create(
+            user_profile=profile, quiz=answered.variant.quiz, variant=answered.variant, score=1, total=1
+        )
+        UserAnswer.objects.create(result=result, question=answered, selected_option=1, is_correct=True)
+
+        report = import_questions_csv(
+            bank_csv([bank_row("В1", 1), bank_row("В1", 3, correct=2), bank_row("В1", 5), bank_row("В1", 5)]),
+            "Синхрон", incremental=True,
+        )
+        self.assertEqual(
+            (report.created, report.updated, report.unchanged, report.detached, report.deleted),
+            (1, 1, 1, 1, 2),
+        )
+        self.assertEqual(report.skipped, [(5, "дубликат вопроса в файле")])
+
+        variant = QuizVariant.objects.get(title="В1")
+        self.assertEqual(
+            list(variant.questions.order_by("id").values_list("question", "correct_answer")),
+            [("Вопрос 1", 1), ("Вопрос 3", 2), ("Вопрос 5", 1)],
+        )
+        self.assertTrue(variant.questions.filter(id=kept_id).exists())
+        # Отвеченный вопрос откреплён, а не удалён: история ответов цела
+        answered.refresh_from_db()
+        self.assertIsNone(answered.variant_id)
+        self.assertEqual(UserAnswer.objects.get().question_id, answered.id)
+        self.assertFalse(Question.objects.filter(question="Вопрос 4").exists())
+
+        again = import_questions_csv(
+            bank_csv([bank_row("В1", 1), bank_row("В1", 3, correct=2), bank_row("В1", 5)]),
+            "Синхрон", incremental=True,
+        )
+        self.assertEqual(
+            (again.created, again.updated, again.unchanged, again.detached, again.deleted), (0, 0, 3, 0, 0)
+        )
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN горячих запросов: нужный индекс используется и не нужна сортировка.
+
+    На PostgreSQL таблицы в тестах крошечные, поэтому seq scan и sort отключаются —
+    планировщик выбирает индекс, если он вообще подходит."""
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off; SET enable_sort = off")
+            self.addCleanup(self.reset_planner)
+
+    @staticmethod
+    def reset_planner():
+        with connection.cursor() as cursor:
+            cursor.execute("RESET enable_seqscan; RESET enable_sort")
+
+    def assert_plan(self, queryset, index, sorted_by_index=False):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        if sorted_by_index:
+            self.assertNotIn("TEMP B-TREE", plan)  # SQLite
+            self.assertNotRegex(plan, r"\bSort\b")  # PostgreSQL
+
+    def test_results_page_by_user_newest_first(self):
+        results = UserResult.objects.filter(user_profile__user_id=5).order_by("-id").values("id")
+        # Первой странице SQLite хватает FK-индекса (он содержит rowid), PostgreSQL — нужен составной
+        first_page_index = (
+            "userresult_profile_latest_idx" if connection.vendor == "postgresql" else "bot_userresult_user_profile_id"
+        )
+        self.assert_plan(results[:11], first_page_index, sorted_by_index=True)
+        self.assert_plan(results.filter(id__lt=100)[:11], "userresult_profile_latest_idx", sorted_by_index=True)
+
+    def test_results_by_user_and_quiz(self):
+        self.assert_plan(UserResult.objects.filter(user_profile__user_id=5, quiz_id=3), "userresult_profile_quiz_idx")
+
+    def test_quiz_by_title(self):
+        self.assert_plan(Quiz.objects.filter(title="Экзамен"), "bot_quiz_title")
+
+    def test_allowed_user_by_user_id(self):
+        self.assert_plan(AllowedUser.objects.filter(user_profile__user_id=5), "bot_alloweduser_user_profile_id")
+
+    def test_latest_token_of_quiz(self):
+        self.assert_plan(
+            InviteToken.objects.filter(quiz_id=3).order_by("-id")[:1], "invitetoken_quiz_latest_idx", sorted_by_index=True
+        )
+
+    def test_valid_tokens_use_partial_index(self):
+        valid = InviteToken.objects.filter(quiz=OuterRef("quiz"), used_count__lt=F("usage_limit"))
+        self.assert_plan(AllowedUser.objects.filter(~Exists(valid)), "invitetoken_quiz_valid_idx")
+
+    def test_correct_answer_range_is_enforced_by_database(self):
+        variant = QuizVariant.objects.create(title="В1")
+        Question.objects.bulk_create([Question(variant=variant, question="ok", correct_answer=None)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Question.objects.bulk_create([Question(variant=variant, question="bad", correct_answer=5)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Question.objects.filter(variant=variant).update(correct_answer=0)
+
+
+class SessionStoreTests(TestCase):
+    state = {"stage": "in_quiz", "question_ids": [3, 1, 2], "index": 1, "score": 1, "answers": [[3, 2, True]]}
+
+    async def test_memory_round_trip_returns_a_copy(self):
+        store = MemorySessionStore()
+        await store.save(1, self.state)
+        loaded = await store.get(1)
+        self.assertEqual(loaded, self.state)
+        loaded["index"] = 2
+        self.assertEqual((await store.get(1))["index"], 1)
+        await store.delete(1)
+        self.assertIsNone(await store.get(1))
+        self.assertEqual((len(store), store.size_bytes), (0, 0))
+
+    def test_memory_evicts_least_recently_used(self):
+        store = MemorySessionStore(max_entries=2)
+        store.save_sync(1, {"n": 1})
+        store.save_sync(2, {"n": 2})
+        store.get_sync(1)
+        store.save_sync(3, {"n": 3})
+        self.assertEqual([store.get_sync(i) for i in (1, 2, 3)], [{"n": 1}, None, {"n": 3}])
+
+        store = MemorySessionStore(max_bytes=len(dumps(self.state)) * 2)
+        for user_id in range(3):
+            store.save_sync(user_id, self.state)
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get_sync(0))
+        self.assertLessEqual(store.size_bytes, store.max_bytes)
+
+    def test_memory_entries_expire(self):
+        store = MemorySessionStore(ttl=60)
+        with mock.patch("bot.sessions.time.monotonic", return_value=1000.0):
+            store.save_sync(1, self.state)
+        with mock.patch("bot.sessions.time.monotonic", return_value=1059.0):
+            self.assertEqual(store.get_sync(1), self.state)
+        with mock.patch("bot.sessions.time.monotonic", return_value=1061.0):
+            self.assertIsNone(store.get_sync(1))
+        self.assertEqual(len(store), 0)
+
+    async def test_database_round_trip_and_memory_only_steps(self):
+        store = DatabaseSessionStore()
+        await store.save(1, self.state)
+        self.assertEqual(loads(await QuizSession.objects.values_list("data", flat=True).aget(user_id=1)), self.state)
+        await store.save(1, dict(self.state, index=2), persist=False)
+        self.assertEqual((await store.get(1))["index"], 2)
+        stored = await QuizSession.objects.values_list("data", flat=True).aget(user_id=1)
+        self.assertEqual(loads(stored)["index"], 1)
+
+        await store.delete(1)
+        self.assertIsNone(await store.get(1))
+        self.assertFalse(await QuizSession.objects.filter(user_id=1).aexists())
+
+    async def test_evicted_state_is_reloaded_from_database(self):
+        loaded = []
+        before = []
+
+        async def before_load(user_id):
+            before.append(user_id)
+
+        def on_load(state):
+            loaded.append(state["index"])
+            return dict(state, restored=True)
+
+        store = DatabaseSessionStore(
+            cache=MemorySessionStore(max_entries=1), on_load=on_load, before_load=before_load,
+        )
+        await store.save(1, self.state)
+        await store.save(2, {"stage": "select_quiz"})  # вытесняет пользователя 1 из памяти
+        self.assertIsNone(store.cache.get_sync(1))
+
+        state = await store.get(1)
+        self.assertEqual(state, dict(self.state, restored=True))
+        self.assertEqual((before, loaded), ([1], [1]))
+        self.assertEqual(await store.get(1), state)  # снова из памяти
+        self.assertEqual((before, loaded), ([1], [1]))
+
+    async def test_expired_database_session_is_dropped(self):
+        store = DatabaseSessionStore(ttl=60)
+        await store.save(1, self.state)
+        await store.save(2, self.state)
+        await QuizSession.objects.filter(user_id=1).aupdate(updated_at=timezone.now() - timedelta(seconds=61))
+        store.cache.delete_sync(1)
+        self.assertIsNone(await store.get(1))
+        self.assertFalse(await QuizSession.objects.filter(user_id=1).aexists())
+
+        await QuizSession.objects.filter(user_id=2).aupdate(updated_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(await sync_to_async(store.purge_expired)(), 1)
+        self.assertEqual(await QuizSession.objects.acount(), 0)
+
+
+class QuestionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = Quiz.objects.create(title="Кэш")
+        cls.variant = QuizVariant.objects.create(quiz=cls.quiz, title="В1")
+        cls.other = QuizVariant.objects.create(quiz=cls.quiz, title="В2")
+        cls.questions = [
+            Question.objects.create(
+                variant=cls.variant, question=f"Сұрақ {i}", option1="a", option2="b", option3="c", option4="d",
+                correct_answer=1,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        question_bank.invalidate()
+        self.addCleanup(question_bank.invalidate)
+
+    def test_second_read_is_served_from_memory(self):
+        with self.assertNumQueries(2):
+            snapshot = question_bank.get(self.variant.id)
+        with self.assertNumQueries(0):
+            self.assertIs(question_bank.get(self.variant.id), snapshot)
+        self.assertEqual(snapshot.question_ids, [q.id for q in self.questions])
+        self.assertEqual(snapshot.by_id[self.questions[0].id].text.split("\n")[0], "Сұрақ 0")
+
+    def test_questions_without_correct_answer_are_left_out(self):
+        blank = Question.objects.create(variant=self.variant, question="Жауапсыз", option1="a", option2="b")
+        snapshot = question_bank.get(self.variant.id)
+        self.assertEqual(snapshot.question_ids, [q.id for q in self.questions])
+        self.assertNotIn(blank.id, snapshot.by_id)
+
+    def test_index_migration_refuses_out_of_range_answers(self):
+        migration = importlib.import_module("bot.migrations.0011_query_indexes")
+        migration.check_correct_answer(django_apps, None)  # корректные данные — проходит молча
+
+        # Ограничение БД уже не даст записать 5 или 0 — подменяем модель с «грязными» строками
+        model = mock.MagicMock()
+        model.objects.exclude.return_value.exclude.return_value.order_by.return_value.values_list.return_value = [7, 9]
+        with self.assertRaisesMessage(RuntimeError, "ID: 7, 9"):
+            migration.check_correct_answer(SimpleNamespace(get_model=lambda app, name: model), None)
+
+    def test_question_save_and_delete_invalidate_the_variant(self):
+        invalidated = []
+        question_bank.subscribe(invalidated.append)
+        self.addCleanup(question_bank._subscribers.remove, invalidated.append)
+
+        question_bank.get(self.variant.id)
+        question = self.questions[0]
+        question.question = "Жаңа мәтін"
+        question.save()
+        snapshot = question_bank.get(self.variant.id)
+        self.assertEqual(snapshot.by_id[question.id].question, "Жаңа мәтін")
+
+        self.questions[1].delete()
+        self.assertNotIn(self.questions[1].id, question_bank.get(self.variant.id).question_ids)
+
+        # Перенос в другой вариант сбрасывает оба
+        question_bank.get(self.other.id)
+        question.variant = self.other
+        question.save()
+        self.assertEqual(question_bank.get(self.other.id).question_ids, [question.id])
+        self.assertEqual(question_bank.get(self.variant.id).question_ids, [self.questions[2].id])
+        self.assertEqual(invalidated, [self.variant.id, self.variant.id, self.other.id, self.variant.id])
+
+    def test_entries_expire_after_ttl(self):
+        cache = QuestionBankCache(ttl=300)
+        with mock.patch("bot.question_cache.time.monotonic", return_value=1000.0):
+            snapshot = cache.get(self.variant.id)
+        with mock.patch("bot.question_cache.time.monotonic", return_value=1300.0), self.assertNumQueries(0):
+            self.assertIs(cache.get(self.variant.id), snapshot)
+        with mock.patch("bot.question_cache.time.monotonic", return_value=1301.0), self.assertNumQueries(2):
+            self.assertIsNot(cache.get(self.variant.id), snapshot)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "size": 1})
+
+    def test_least_recently_used_variant_is_evicted(self):
+        cache = QuestionBankCache(max_variants=1)
+        cache.get(self.variant.id)
+        cache.get(self.other.id)
+        self.assertEqual(len(cache), 1)
+        with self.assertNumQueries(2):
+            cache.get(self.variant.id)
+
+
+class MenuCacheTests(TestCase):
+    def setUp(self):
+        question_bank.invalidate()
+        self.addCleanup(question_bank.invalidate)
+
+    async def test_quiz_keyboard_is_reused_until_question_bank_is_invalidated(self):
+        first = await sync_to_async(Quiz.objects.create)(title="Бірінші")
+        markup = await menus.quiz_markup()
+        self.assertIs(await menus.quiz_markup(), markup)
+        only_first = await menus.quiz_markup({first.id})
+        self.assertIs(only_first.inline_keyboard[0], markup.inline_keyboard[0])
+        self.assertIsNone(await menus.quiz_markup({-1}))
+
+        # Новая викторина сбрасывает кэш через question_bank.invalidate()
+        second = await sync_to_async(Quiz.objects.create)(title="Екінші")
+        fresh = await menus.quiz_markup()
+        self.assertIsNot(fresh, markup)
+        self.assertEqual(
+            [row[0].callback_data for row in fresh.inline_keyboard], [f"quiz_{first.id}", f"quiz_{second.id}"]
+        )
+
+    def test_variant_buttons_are_reused_and_reset_per_variant(self):
+        a, b = (QuizVariant.objects.create(title=title) for title in ("A", "B"))
+        variants = [(a.id, "A"), (b.id, "B")]
+        markup = menus.variant_markup(variants, passed_ids=set())
+        again = menus.variant_markup(variants, passed_ids={b.id})
+        self.assertIs(again.inline_keyboard[0], markup.inline_keyboard[0])
+        self.assertEqual(again.inline_keyboard[1][0].text, "✅ B")
+
+        question_bank.invalidate(a.id)
+        fresh = menus.variant_markup(variants, passed_ids=set())
+        self.assertIsNot(fresh.inline_keyboard[0], markup.inline_keyboard[0])
+        self.assertIs(fresh.inline_keyboard[1], markup.inline_keyboard[1])
+
+        # Новое название варианта не берётся из кэша
+        renamed = menus.variant_markup([(a.id, "A2")], passed_ids=set())
+        self.assertEqual(renamed.inline_keyboard[0][0].text, "A2")
+
+
+class QuizAccessTests(TestCase):
+    user_id = 8001
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = UserProfile.objects.create(user_id=cls.user_id, user_name="Ученик")
+        cls.quiz = Quiz.objects.create(title="Доступ")
+        cls.variants = [QuizVariant.objects.create(quiz=cls.quiz, title=f"В{i}") for i in range(1, 4)]
+        InviteToken.objects.create(token="access-1", quiz=cls.quiz, usage_limit=5, used_count=1)
+        AllowedUser.objects.create(user_profile=cls.profile, quiz=cls.quiz)
+        QuizProgress.objects.create(
+            user_profile=cls.profile, quiz=cls.quiz, attempts=1, passed_variant_ids=[cls.variants[1].id]
+        )
+
+    def test_allowed_user_gets_variants_and_passed_ids_in_one_query(self):
+        with self.assertNumQueries(1):
+            access = get_quiz_access(self.user_id, self.quiz.id)
+        self.assertTrue(access.granted)
+        self.assertEqual(access.variants, [(v.id, v.title) for v in self.variants])
+        self.assertEqual(access.passed_ids, {self.variants[1].id})
+
+    def test_user_without_access_is_refused(self):
+        UserProfile.objects.create(user_id=8002, user_name="Бөтен")
+        access = get_quiz_access(8002, self.quiz.id)
+        self.assertEqual((access.allowed, access.granted, access.variants), (False, False, []))
+        self.assertIn("рұқсатыңыз жоқ", access.message)
+
+    def test_quiz_without_variants(self):
+        quiz = Quiz.objects.create(title="Бос")
+        InviteToken.objects.create(token="empty-1", quiz=quiz)
+        AllowedUser.objects.create(user_profile=self.profile, quiz=quiz)
+        access = get_quiz_access(self.user_id, quiz.id)
+        self.assertTrue(access.granted)
+        self.assertEqual((access.variants, access.passed_ids), ([], set()))
+
+    def test_missing_quiz_token_and_exhausted_latest_token(self):
+        self.assertIn("табылмады", get_quiz_access(self.user_id, 10 ** 6).message)
+
+        quiz = Quiz.objects.create(title="Токенсіз")
+        AllowedUser.objects.create(user_profile=self.profile, quiz=quiz)
+        self.assertIn("токен жоқ", get_quiz_access(self.user_id, quiz.id).message)
+
+        # Решает последний токен викторины
+        InviteToken.objects.create(token="access-2", quiz=self.quiz, usage_limit=1, used_count=1)
+        access = get_quiz_access(self.user_id, self.quiz.id)
+        self.assertFalse(access.granted)
+        self.assertIn("қолданылып қойған", access.message)
+
+
+class MaintenanceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = UserProfile.objects.create(user_id=8101, user_name="Alice")
+        cls.bob = UserProfile.objects.create(user_id=8102, user_name="Bob")
+        cls.open_quiz = Quiz.objects.create(title="Действует")
+        cls.used_up = Quiz.objects.create(title="Исчерпан")
+        cls.tokenless = Quiz.objects.create(title="Без токенов")
+        InviteToken.objects.create(token="m-open", quiz=cls.open_quiz, usage_limit=5, used_count=1)
+        InviteToken.objects.create(token="m-full", quiz=cls.used_up, usage_limit=3, used_count=3)
+        for profile in (cls.alice, cls.bob):
+            for quiz in (cls.open_quiz, cls.used_up, cls.tokenless):
+                AllowedUser.objects.create(user_profile=profile, quiz=quiz)
+        cls.question = Question.objects.create(
+            variant=QuizVariant.objects.create(quiz=cls.open_quiz, title="В1"), question="?", correct_answer=1,
+        )
+
+    def allowed(self):
+        return set(AllowedUser.objects.values_list("user_profile__user_name", "quiz__title"))
+
+    def test_expire_access_keeps_only_quizzes_with_valid_tokens(self):
+        self.assertEqual(expire_access(), 4)
+        self.assertEqual(self.allowed(), {("Alice", "Действует"), ("Bob", "Действует")})
+        self.assertEqual(expire_access(), 0)
+
+    def test_expire_access_for_one_user(self):
+        self.assertEqual(expire_access(user_id=self.bob.user_id), 2)
+        self.assertEqual(
+            self.allowed(),
+            {("Alice", "Действует"), ("Alice", "Исчерпан"), ("Alice", "Без токенов"), ("Bob", "Действует")},
+        )
+
+    @override_settings(QUIZ_SESSION_TTL=3600)
+    def test_run_maintenance_command_reports_removed_rows(self):
+        stale = timezone.now() - timedelta(hours=2)
+        for user_id in (1, 2, 3):
+            QuizSession.objects.create(user_id=user_id, data="{}")
+        QuizSession.objects.filter(user_id__in=[1, 2]).update(updated_at=stale)
+        for attempt in ("old", "new"):
+            PendingAnswer.objects.create(
+                attempt=attempt, user_id=1, question=self.question, selected_option=1, is_correct=True,
+            )
+        PendingAnswer.objects.filter(attempt="old").update(created_at=stale)
+
+        self.assertEqual(run_maintenance(), {"access": 4, "sessions": 2, "pending_answers": 1})
+        self.assertEqual(list(QuizSession.objects.values_list("user_id", flat=True)), [3])
+        self.assertEqual(list(PendingAnswer.objects.values_list("attempt", flat=True)), ["new"])
+
+        out = io.StringIO()
+        call_command("run_maintenance", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Удалено: доступов 0, сессий 0, ответов журнала 0")
+
+
+class RedeemInviteTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = Quiz.objects.create(title="Токен")
+        cls.other_quiz = Quiz.objects.create(title="Басқа")
+        cls.profiles = [UserProfile.objects.create(user_id=9000 + i, user_name=f"U{i}") for i in range(3)]
+        cls.token = InviteToken.objects.create(token="redeem-1", quiz=cls.quiz, usage_limit=2)
+
+    def used_count(self):
+        return InviteToken.objects.get(pk=self.token.pk).used_count
+
+    def assert_redemptions(self):
+        self.assertEqual(redeem_invite_token("redeem-1", user_id=9000), self.quiz.id)
+        self.assertEqual(self.used_count(), 1)
+
+        # Уже есть доступ — использование не списывается, quiz_id возвращается
+        AllowedUser.objects.create(user_profile=self.profiles[0], quiz=self.quiz, invite_token=self.token)
+        self.assertEqual(redeem_invite_token("redeem-1", user_id=9000), self.quiz.id)
+        self.assertEqual(self.used_count(), 1)
+
+        self.assertIsNone(redeem_invite_token("redeem-1", user_id=9001, quiz_id=self.other_quiz.id))
+        self.assertEqual(redeem_invite_token("redeem-1", user_id=9001, quiz_id=self.quiz.id), self.quiz.id)
+        self.assertEqual(self.used_count(), 2)
+
+        # Исчерпан: ни новый пользователь, ни пользователь с доступом не проходят
+        self.assertIsNone(redeem_invite_token("redeem-1", user_id=9002))
+        self.assertIsNone(redeem_invite_token("redeem-1", user_id=9000))
+        self.assertIsNone(redeem_invite_token("unknown", user_id=9002))
+        self.assertEqual(self.used_count(), 2)
+
+    def test_each_use_is_redeemed_once(self):
+        self.assertTrue(connection.features.can_return_columns_from_insert)
+        with self.assertNumQueries(1):
+            redeem_invite_token("redeem-1")
+        InviteToken.objects.filter(pk=self.token.pk).update(used_count=0)
+        self.assert_redemptions()
+
+    def test_fallback_without_returning(self):
+        with mock.patch.object(connection.features, "can_return_columns_from_insert", False):
+            with CaptureQueriesContext(connection) as queries:
+                self.assert_redemptions()
+        self.assertFalse([q["sql"] for q in queries.captured_queries if "RETURNING" in q["sql"]])
+
+
+class SamplingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = Quiz.objects.create(title="Пул")
+        cls.variant = QuizVariant.objects.create(quiz=cls.quiz, title="Пул", sample_size=12, sample_strata="tag")
+        tags = ["алгебра"] * 15 + ["геометрия"] * 10 + ["логика"] * 5
+        Question.objects.bulk_create(
+            Question(variant=cls.variant, question=f"Сұрақ {i}", option1="a", option2="b", option3="c", option4="d",
+                     correct_answer=1, tag=tag, difficulty=i % 3)
+            for i, tag in enumerate(tags)
+        )
+        cls.tags = dict(Question.objects.filter(variant=cls.variant).values_list("id", "tag"))
+
+    def setUp(self):
+        question_bank.invalidate()
+        self.addCleanup(question_bank.invalidate)
+
+    def test_stratified_draws_keep_size_and_proportions(self):
+        snapshot = question_bank.get(self.variant.id)
+        self.assertEqual((len(snapshot.pool_ids), snapshot.by_id), (30, {}))  # в пуле только ID
+        rng = random.Random(7)
+        drawn = set()
+        for _ in range(50):
+            ids = snapshot.draw(rng)
+            self.assertEqual(len(ids), 12)
+            self.assertEqual(len(set(ids)), 12)
+            self.assertEqual(ids, sorted(ids))
+            counts = Counter(self.tags[qid] for qid in ids)
+            self.assertEqual(counts, {"алгебра": 6, "геометрия": 4, "логика": 2})
+            drawn.update(ids)
+        self.assertEqual(drawn, set(self.tags))
+
+        with self.assertNumQueries(1):
+            question_bank.prefetch(snapshot, ids)
+        self.assertEqual(set(snapshot.by_id), set(ids))
+
+    def test_unstratified_and_oversized_samples(self):
+        QuizVariant.objects.filter(id=self.variant.id).update(sample_strata="")
+        snapshot = question_bank.get(self.variant.id)
+        self.assertEqual(snapshot.strata, {})
+        ids = snapshot.draw(random.Random(1))
+        self.assertEqual((len(ids), len(set(ids))), (12, 12))
+        self.assertTrue(set(ids) <= set(self.tags))
+
+        QuizVariant.objects.filter(id=self.variant.id).update(sample_size=50, sample_strata="difficulty")
+        question_bank.invalidate(self.variant.id)
+        self.assertEqual(question_bank.get(self.variant.id).draw(), sorted(self.tags))
+
+    def test_allocation_uses_largest_remainders(self):
+        self.assertEqual(allocate({"a": 7, "b": 7, "c": 7}, 10), {"a": 4, "b": 3, "c": 3})
+        self.assertEqual(allocate({"a": 1, "b": 9}, 5), {"a": 1, "b": 4})
+        self.assertEqual(allocate({"a": 2, "b": 1, "c": 1}, 3), {"a": 1, "b": 1, "c": 1})
+        self.assertEqual(allocate({"a": 1, "b": 1}, 2), {"a": 1, "b": 1})
+
+
+# Правильность ответов на вопросы 1–3 в каждой попытке варианта
+ANALYTICS_ATTEMPTS = [
+    (0, 0, 1), (0, 0, 1), (0, 1, 1), (1, 0, 0), (1, 1, 0), (1, 0, 1),
+    (1, 1, 0), (1, 1, 0), (1, 1, 1), (1, 1, 1), (0, 0, 0),
+]
+# Выбранный ответ при ошибке: вопрос 1 (i — номер попытки)
+WRONG_Q1 = {0: 2, 1: 2, 2: 3, 10: 4}
+
+
+class AnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = Quiz.objects.create(title="Аналитика")
+        cls.variant = QuizVariant.objects.create(quiz=cls.quiz, title="А")
+        cls.empty = QuizVariant.objects.create(quiz=cls.quiz, title="Б")
+        cls.questions = [
+            Question.objects.create(
+                variant=cls.variant, question=f"Сұрақ {n}", option1="a", option2="b", option3="c", option4="d",
+                correct_answer=n,
+            )
+            for n in (1, 2, 3)
+        ]
+        for i, marks in enumerate(ANALYTICS_ATTEMPTS):
+            profile = UserProfile.objects.create(user_id=9500 + i, user_name=f"U{i}")
+            result = UserResult.objects.create(
+                user_profile=profile, quiz=cls.quiz, variant=cls.variant, score=sum(marks), total=3
+            )
+            for question, correct in zip(cls.questions, marks):
+                n = question.correct_answer
+                selected = n if correct else (WRONG_Q1[i] if n == 1 else {2: 1, 3: 4}[n])
+                UserAnswer.objects.create(result=result, question=question, selected_option=selected, is_correct=correct)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_variant_summary(self):
+        summary = {row["title"]: row for row in variant_summary()}
+        self.assertEqual((summary["А"]["attempts"], summary["А"]["avg_percent"]), (11, 57.6))
+        self.assertEqual((summary["Б"]["attempts"], summary["Б"]["avg_percent"]), (0, None))
+
+    def test_question_percentages_and_discrimination(self):
+        # 11 попыток: группы по 27 % — нижняя (результат ≤ 1/3) 4 попытки, верхняя (3/3) 2
+        self.assertEqual(group_thresholds(self.variant.id), (11, 1 / 3, 1.0))
+        # Число попыток, два порога групп, агрегат по вопросам и их тексты
+        with self.assertNumQueries(5):
+            stats = question_stats(self.variant.id)
+        self.assertEqual((stats["results"], stats["grouped"]), (11, True))
+        rows = {row["question"]: row for row in stats["questions"]}
+        self.assertEqual(
+            [(rows[f"Сұрақ {n}"]["percent_correct"], rows[f"Сұрақ {n}"]["discrimination"]) for n in (1, 2, 3)],
+            [(63.6, 0.75), (54.5, 1.0), (54.5, 0.5)],
+        )
+        self.assertEqual(
+            rows["Сұрақ 1"]["options"], [(1, 63.6, True), (2, 18.2, False), (3, 9.1, False), (4, 9.1, False)]
+        )
+        with self.assertNumQueries(0):
+            question_stats(self.variant.id)  # из кэша
+
+    def test_too_few_attempts_are_not_grouped(self):
+        UserResult.objects.filter(variant=self.variant, user_profile__user_id__gte=9503).delete()
+        stats = question_stats(self.variant.id)
+        self.assertEqual((stats["results"], stats["grouped"]), (3, False))
+        self.assertEqual({row["discrimination"] for row in stats["questions"]}, {None})
+        self.assertEqual(stats["questions"][0]["percent_correct"], 0.0)
+
+
+class CompletionTests(TestCase):
+    user_id = 9700
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = UserProfile.objects.create(user_id=cls.user_id, user_name="Ученик")
+        cls.quiz = Quiz.objects.create(title="Нәтиже")
+        cls.variant = QuizVariant.objects.create(quiz=cls.quiz, title="В1")
+        cls.questions = [
+            Question.objects.create(variant=cls.variant, question=f"Q{i}", correct_answer=1) for i in range(30)
+        ]
+
+    def statements(self, count, attempt=None):
+        """SQL-запросы save_quiz_result без SAVEPOINT (в проде это внешняя транзакция)."""
+        answers = [[q.id, 1 + i % 2, i % 2 == 0] for i, q in enumerate(self.questions[:count])]
+        with CaptureQueriesContext(connection) as queries:
+            save_quiz_result(self.user_id, self.quiz.id, self.variant.id, count // 2, count, answers, attempt)
+        return [q["sql"].split()[0] for q in queries.captured_queries if "SAVEPOINT" not in q["sql"]]
+
+    def test_query_count_does_not_depend_on_answers(self):
+        # Первая попытка викторины: QuizProgress ещё создаётся
+        self.assertEqual(self.statements(30), ["SELECT", "INSERT", "INSERT", "SELECT", "INSERT", "UPDATE"])
+        PendingAnswer.objects.create(
+            attempt="a-1", user_id=self.user_id, question=self.questions[0], selected_option=1, is_correct=True
+        )
+        self.assertEqual(self.statements(30, "a-1"), ["SELECT", "INSERT", "INSERT", "DELETE", "SELECT", "UPDATE"])
+        self.assertEqual(len(self.statements(3, "a-2")), 6)
+        self.assertFalse(PendingAnswer.objects.exists())
+        self.assertEqual(UserAnswer.objects.count(), 63)
+        progress = QuizProgress.objects.get(user_profile=self.profile, quiz=self.quiz)
+        self.assertEqual((progress.attempts, progress.passed_variant_ids), (3, [self.variant.id]))
+
+    def progress(self):
+        return QuizProgress.objects.filter(user_profile=self.profile, quiz=self.quiz).values_list(
+            "attempts", "best_score", "best_total", "passed_variant_ids"
+        ).first()
+
+    def test_deleting_a_result_recomputes_progress(self):
+        other = QuizVariant.objects.create(quiz=self.quiz, title="В2")
+        save_quiz_result(self.user_id, self.quiz.id, self.variant.id, 4, 5, [])
+        best = save_quiz_result(self.user_id, self.quiz.id, other.id, 5, 5, [])
+        self.assertEqual(self.progress(), (2, 5, 5, [self.variant.id, other.id]))
+
+        UserResult.objects.filter(id=best.id).delete()
+        self.assertEqual(self.progress(), (1, 4, 5, [self.variant.id]))
+        UserResult.objects.all().delete()
+        self.assertIsNone(self.progress())
+
+    def test_migration_fill_matches_rebuild(self):
+        other = QuizVariant.objects.create(quiz=self.quiz, title="В2")
+        for variant, score in ((self.variant, 2), (other, 4), (self.variant, 3)):
+            save_quiz_result(self.user_id, self.quiz.id, variant.id, score, 5, [])
+        expected = self.progress()
+        QuizProgress.objects.all().delete()
+
+        migration = importlib.import_module("bot.migrations.0007_quizprogress")
+        migration.fill_quiz_progress(django_apps, None)
+        self.assertEqual(self.progress(), expected)
+        self.assertEqual(rebuild_quiz_progress(), 1)
+        self.assertEqual(self.progress(), expected)
+
+
+class ResultsPageTests(TestCase):
+    user_id = 6001
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = UserProfile.objects.create(user_id=cls.user_id, user_name="Ученик")
+
+    def test_summary_is_cut_on_whole_lines(self):
+        quizzes = Quiz.objects.bulk_create(Quiz(title=f"Тест_{i}_*жаттығу*_" + "_" * 40) for i in range(60))
+        QuizProgress.objects.bulk_create(
+            QuizProgress(user_profile=self.profile, quiz=quiz, attempts=1, best_score=5, best_total=10)
+            for quiz in quizzes
+        )
+        UserResult.objects.create(user_profile=self.profile, quiz=quizzes[0], score=5, total=10)
+
+        summary = format_summary(self.user_id)
+        self.assertLessEqual(len(summary), MESSAGE_LIMIT // 2)
+        lines = summary.split("\n")
+        self.assertEqual(lines[-2:], ["", ""])
+        for line in lines[:-2]:
+            self.assertRegex(line, r"^• .+: 1 рет, үздік 5/10$")
+        self.assertLess(len(lines) - 2, len(quizzes))
+
+        page = fetch_results_page(self.user_id)
+        self.assertIn(summary, page.text)
+        self.assertLessEqual(len(page.text), MESSAGE_LIMIT)
+
+
+    def make_results(self, count, quiz_title="Нәтиже", variant_title="В1"):
+        quiz = Quiz.objects.create(title=quiz_title)
+        variant = QuizVariant.objects.create(quiz=quiz, title=variant_title)
+        UserResult.objects.bulk_create(
+            UserResult(user_profile=self.profile, quiz=quiz, variant=variant, score=i, total=count)
+            for i in range(count)
+        )
+
+    def walk(self, page, key):
+        pages = [page]
+        while getattr(page, key):
+            page = fetch_results_page(self.user_id, *parse_page_callback(getattr(page, key)))
+            pages.append(page)
+        return pages
+
+    @staticmethod
+    def entries(page):
+        return [
+            (int(number), int(score))
+            for number, score in re.findall(r"^(\d+)\) .*?✅ Балл: (\d+)/", page.text, re.MULTILINE | re.DOTALL)
+        ]
+
+    @override_settings(RESULTS_PAGE_SIZE=10)
+    async def test_tapping_the_shown_page_again_is_ignored(self):
+        await sync_to_async(self.make_results)(23)
+        older = (await sync_to_async(fetch_results_page)(self.user_id)).older
+        edit = mock.AsyncMock(side_effect=BadRequest(
+            "Message is not modified: specified new message content and reply markup are exactly the same"
+        ))
+        query = SimpleNamespace(
+            data=older, from_user=SimpleNamespace(id=self.user_id), answer=mock.AsyncMock(), edit_message_text=edit,
+        )
+        await tl.handle_results_page(SimpleNamespace(callback_query=query), None)
+        edit.assert_awaited_once()
+
+        edit.side_effect = BadRequest("Message to edit not found")
+        with self.assertRaises(BadRequest):
+            await tl.handle_results_page(SimpleNamespace(callback_query=query), None)
+
+    @override_settings(RESULTS_PAGE_SIZE=10)
+    def test_pages_walk_both_directions_without_gaps(self):
+        self.make_results(23)
+        first = fetch_results_page(self.user_id)
+        self.assertIsNone(first.newer)
+
+        older = self.walk(first, "older")
+        self.assertEqual([len(self.entries(p)) for p in older], [10, 10, 3])
+        walked = [entry for p in older for entry in self.entries(p)]
+        self.assertEqual(walked, [(n, 23 - n) for n in range(1, 24)])  # новые сверху, сквозная нумерация
+
+        # Новый результат во время листания не сдвигает старые страницы
+        self.make_results(1, quiz_title="Кейін")
+        newer = self.walk(older[-1], "newer")
+        self.assertEqual([self.entries(p) for p in newer[:3]], [self.entries(p) for p in reversed(older)])
+        self.assertEqual(len(newer), 4)
+        self.assertIsNone(newer[-1].newer)
+
+    @override_settings(RESULTS_PAGE_SIZE=10)
+    def test_long_entries_are_split_by_message_limit(self):
+        self.make_results(12, quiz_title="_" * 255, variant_title="*" * 100)
+        pages = self.walk(fetch_results_page(self.user_id), "older")
+        self.assertGreater(len(pages), 2)
+        for page in pages:
+            self.assertLessEqual(len(page.text), MESSAGE_LIMIT)
+        walked = [entry for p in pages for entry in self.entries(p)]
+        self.assertEqual(walked, [(n, 12 - n) for n in range(1, 13)])
+
+        back = self.walk(pages[-1], "newer")
+        self.assertEqual([entry for p in reversed(back) for entry in self.entries(p)], walked)
+
+
+class ChatMessage:
+    _ids = iter(range(1, 10 ** 9))
+
+    def __init__(self, text=None, caption=None, photo=None, reply_markup=None):
+        self.message_id = next(self._ids)
+        self.text, self.caption, self.photo, self.reply_markup = text, caption, photo, reply_markup
+
+
+class RecordingBot:
+    """Записывает вызовы Bot API и, как Telegram, отклоняет слишком длинные тексты."""
+
+    def __init__(self, fail_edits=False):
+        self.calls = []
+        self.fail_edits = fail_edits
+
+    def check(self, method, text, limit):
+        self.calls.append(method)
+        if text is not None and len(text) > limit:
+            raise BadRequest("Message is too long")
+        if self.fail_edits and method.startswith("edit_"):
+            raise BadRequest("Message to edit not found")
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.check("send_message", text, 4096)
+        return ChatMessage(text=text, reply_markup=reply_markup)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        self.check("send_photo", caption, 1024)
+        return ChatMessage(caption=caption, photo=[FakePhoto(f"file-{photo}")], reply_markup=reply_markup)
+
+
+class FakeQuery:
+    def __init__(self, bot, user_id, data, message):
+        self.bot, self.data, self.message = bot, data, message
+        self.from_user = SimpleNamespace(id=user_id)
+
+    async def answer(self):
+        self.bot.calls.append("answer_callback_query")
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.bot.check("edit_message_text", text, 4096)
+        self.message.text, self.message.reply_markup = text, reply_markup
+
+    async def edit_message_caption(self, caption=None, reply_markup=None, **kwargs):
+        self.bot.check("edit_message_caption", caption, 1024)
+        self.message.caption, self.message.reply_markup = caption, reply_markup
+
+    async def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        self.bot.check("edit_message_reply_markup", None, 0)
+        self.message.reply_markup = reply_markup
+
+
+class ShuffleTests(SimpleTestCase):
+    def test_every_button_maps_back_to_the_option_it_shows(self):
+        record = QuestionRecord(1, "Сұрақ", ("a", "b", "c", "d"), 3, None)
+        seen = set()
+        for seed in range(200):
+            order = option_order(seed, 1000 + seed % 7)
+            self.assertEqual(order, option_order(seed, 1000 + seed % 7))
+            seen.add(order)
+            shown = re.findall(r"^[1-4]️⃣ (\S+)$", record.render(order), re.MULTILINE)
+            for button, text in enumerate(shown, 1):
+                self.assertEqual(record.options[to_canonical(order, button) - 1], text)
+            self.assertEqual(to_canonical(order, shown.index("c") + 1), record.correct_answer)
+        self.assertEqual(seen, set(ORDERS))
+
+
+class QuizFlowTests(TestCase):
+    user_id = 7001
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = UserProfile.objects.create(user_id=cls.user_id, user_name="Ученик")
+        cls.quiz = Quiz.objects.create(title="Поток")
+
+    def setUp(self):
+        question_bank.invalidate()
+        self.addCleanup(question_bank.invalidate)
+
+    def make_variant(self, count, image_first=False, long_first=False):
+        variant = QuizVariant.objects.create(quiz=self.quiz, title="В1")
+        questions = [
+            Question.objects.create(
+                variant=variant, question=("Ұзын сұрақ " * 150 if long_first and i == 0 else f"Сұрақ {i}"),
+                option1="a", option2="b", option3="c", option4="d", correct_answer=1,
+                image_url="http://example.com/q.png" if image_first and i == 0 else None,
+            )
+            for i in range(count)
+        ]
+        return variant, [q.id for q in questions]
+
+    async def start_quiz(self, bot, count, attempt=None, **kwargs):
+        variant, question_ids = await sync_to_async(self.make_variant)(count, **kwargs)
+        await tl.user_states.save(self.user_id, {
+            "quiz_id": self.quiz.id, "variant_id": variant.id, "question_ids": question_ids, "index": 0,
+            "score": 0, "answers": [], "stage": "in_quiz", "answered": False, "attempt": attempt,
+        })
+        context = SimpleNamespace(bot=bot)
+        await tl.send_question(SimpleNamespace(effective_user=SimpleNamespace(id=self.user_id)), context)
+        return context
+
+    async def tap(self, bot, context, message, data):
+        query = FakeQuery(bot, self.user_id, data, message)
+        await tl.handle_answer(SimpleNamespace(callback_query=query), context)
+
+    async def play(self, mode, count=10):
+        bot = RecordingBot()
+        sent = []
+        send_message = bot.send_message
+
+        async def recording_send(*args, **kwargs):
+            message = await send_message(*args, **kwargs)
+            sent.append(message)
+            return message
+
+        bot.send_message = recording_send
+        with override_settings(QUIZ_PRESENTATION=mode):
+            context = await self.start_quiz(bot, count)
+            for _ in range(count):
+                state = await tl.user_states.get(self.user_id)
+                question_message = next(m for m in reversed(sent) if m.message_id == state["message_id"])
+                await self.tap(bot, context, question_message, f"{state['index']}:1")
+        return bot.calls
+
+    async def test_compact_mode_halves_api_calls(self):
+        verbose = await self.play("verbose")
+        compact = await self.play("compact")
+        # Подробно: ответ на нажатие, снятие кнопок, отзыв, следующий вопрос (в конце — итог и меню)
+        self.assertEqual(len(verbose), 1 + 9 * 4 + 5)
+        # Компактно: ответ на нажатие и одно редактирование (последнее — с итогом)
+        self.assertEqual(len(compact), 1 + 10 * 2)
+        self.assertEqual(await sync_to_async(UserResult.objects.filter(score=10, total=10).count)(), 2)
+
+    async def test_queued_double_tap_is_not_credited_to_next_question(self):
+        bot = RecordingBot()
+        with override_settings(QUIZ_PRESENTATION="compact"):
+            context = await self.start_quiz(bot, 3)
+            state = await tl.user_states.get(self.user_id)
+            message = ChatMessage(text="Сұрақ 0")
+            message.message_id = state["message_id"]
+            await self.tap(bot, context, message, "0:1")
+            await self.tap(bot, context, message, "0:2")  # второй тап из очереди, то же сообщение
+            state = await tl.user_states.get(self.user_id)
+            self.assertEqual((state["index"], len(state["answers"]), state["message_id"]), (1, 1, message.message_id))
+            await self.tap(bot, context, message, "1:2")
+        state = await tl.user_states.get(self.user_id)
+        self.assertEqual([a[1] for a in state["answers"]], [1, 2])
+
+    async def test_long_caption_is_shortened_when_closing_photo_question(self):
+        bot = RecordingBot()
+        await sync_to_async(TelegramImage.objects.create)(url="http://example.com/q.png", file_id="cached")
+        image_files.clear_local()
+        self.addCleanup(image_files.clear_local)
+        with override_settings(QUIZ_PRESENTATION="compact"):
+            context = await self.start_quiz(bot, 2, image_first=True)
+            state = await tl.user_states.get(self.user_id)
+            photo = ChatMessage(caption="Сұрақ 0 " * 126, photo=[FakePhoto("cached")])
+            photo.message_id = state["message_id"]
+            await self.tap(bot, context, photo, "0:1")
+        self.assertLessEqual(len(photo.caption), 1024)
+        self.assertTrue(photo.caption.endswith("✅ Дұрыс!"))
+        self.assertEqual(bot.calls[-2:], ["edit_message_caption", "send_message"])
+
+    async def test_failed_edit_falls_back_to_new_messages(self):
+        bot = RecordingBot(fail_edits=True)
+        with override_settings(QUIZ_PRESENTATION="compact"):
+            context = await self.start_quiz(bot, 2)
+            state = await tl.user_states.get(self.user_id)
+            message = ChatMessage(text="Сұрақ 0")
+            message.message_id = state["message_id"]
+            with self.assertLogs("bot.telegram_logic", "WARNING"):
+                await self.tap(bot, context, message, "0:1")
+            state = await tl.user_states.get(self.user_id)
+            self.assertEqual((state["index"], state["answered"]), (1, False))
+            self.assertNotEqual(state["message_id"], message.message_id)
+            self.assertEqual(bot.calls[-3:], ["edit_message_text", "send_message", "send_message"])
+
+            await self.tap(bot, context, ChatMessage(), "1:1")  # устаревшее сообщение — не засчитывается
+            next_message = ChatMessage()
+            next_message.message_id = state["message_id"]
+            with self.assertLogs("bot.telegram_logic", "WARNING"):
+                await self.tap(bot, context, next_message, "1:1")
+        self.assertEqual(await sync_to_async(UserResult.objects.filter(user_profile=self.profile).count)(), 1)
+
+    async def test_shuffled_buttons_are_scored_against_stored_correct_answer(self):
+        def make_variant():
+            variant = QuizVariant.objects.create(quiz=self.quiz, title="Аралас", shuffle_options=True)
+            return [
+                Question.objects.create(
+                    variant=variant, question=f"Сұрақ {i}", option1=f"a{i}", option2=f"b{i}", option3=f"c{i}",
+                    option4=f"d{i}", correct_answer=i % 4 + 1,
+                )
+                for i in range(8)
+            ], variant
+
+        questions, variant = await sync_to_async(make_variant)()
+        await tl.user_states.save(self.user_id, {
+            "quiz_id": self.quiz.id, "variant_id": variant.id, "question_ids": [q.id for q in questions],
+            "index": 0, "score": 0, "answers": [], "stage": "in_quiz", "answered": False, "option_seed": 12345,
+        })
+        bot = RecordingBot()
+        sent = []
+        send_message = bot.send_message
+
+        async def recording_send(*args, **kwargs):
+            message = await send_message(*args, **kwargs)
+            sent.append(message)
+            return message
+
+        bot.send_message = recording_send
+        context = SimpleNamespace(bot=bot)
+        orders = set()
+        with override_settings(QUIZ_PRESENTATION="verbose"):
+            await tl.send_question(SimpleNamespace(effective_user=SimpleNamespace(id=self.user_id)), context)
+            for i, question in enumerate(questions):
+                state = await tl.user_states.get(self.user_id)
+                message = next(m for m in reversed(sent) if m.message_id == state["message_id"])
+                shown = re.findall(r"^[1-4]️⃣ (\S+)$", message.text, re.MULTILINE)
+                orders.add(tuple(text[0] for text in shown))
+                wanted = getattr(question, f"option{question.correct_answer}") if i % 2 == 0 else f"a{i}"
+                await self.tap(bot, context, message, f"{i}:{shown.index(wanted) + 1}")
+
+        self.assertGreater(len(orders - {("a", "b", "c", "d")}), 0)
+        result = await UserResult.objects.aget(user_profile=self.profile, variant=variant)
+        answers = {a.question_id: a async for a in UserAnswer.objects.filter(result=result)}
+        for i, question in enumerate(questions):
+            expected = question.correct_answer if i % 2 == 0 else 1
+            self.assertEqual(answers[question.id].selected_option, expected)
+            self.assertEqual(answers[question.id].is_correct, expected == question.correct_answer)
+        self.assertEqual(result.score, sum(1 for a in answers.values() if a.is_correct))
+
+    async def test_evicted_state_is_reloaded_with_buffered_answers(self):
+        bot = RecordingBot()
+        journal = AnswerJournal(flush_interval=3600)
+        with mock.patch.object(tl, "answer_journal", journal), override_settings(QUIZ_PRESENTATION="compact"):
+            try:
+                context = await self.start_quiz(bot, 3, attempt="evicted")
+                state = await tl.user_states.get(self.user_id)
+                message = ChatMessage(text="Сұрақ 0")
+                message.message_id = state["message_id"]
+                await self.tap(bot, context, message, "0:1")
+                self.assertEqual(len(journal), 1)
+
+                tl.user_states.cache.delete_sync(self.user_id)  # LRU вытеснило состояние
+                await self.tap(bot, context, message, "1:2")
+                self.assertEqual(len(journal), 1)  # первый ответ записан перед загрузкой из БД
+            finally:
+                await journal.stop()
+        state = await tl.user_states.get(self.user_id)
+        question_ids = state["question_ids"]
+        self.assertEqual(state["index"], 2)
+        self.assertEqual(state["answers"], [[question_ids[0], 1, True], [question_ids[1], 2, False]])
+
+    async def test_lost_answers_after_crash_reask_the_restored_question(self):
+        bot = RecordingBot()
+        journal = AnswerJournal(flush_interval=3600)
+        with mock.patch.object(tl, "answer_journal", journal), override_settings(QUIZ_PRESENTATION="compact"):
+            try:
+                context = await self.start_quiz(bot, 3, attempt="crashed")
+                state = await tl.user_states.get(self.user_id)
+                message = ChatMessage(text="Сұрақ 0")
+                message.message_id = state["message_id"]
+                await self.tap(bot, context, message, "0:1")
+                # Падение процесса: очередь журнала и память потеряны
+                journal._buffer.clear()
+                tl.user_states.cache.delete_sync(self.user_id)
+
+                await self.tap(bot, context, message, "1:1")  # на экране вопрос 1, в БД — 0 ответов
+                state = await tl.user_states.get(self.user_id)
+                self.assertEqual((state["index"], state["answers"]), (0, []))
+                self.assertNotIn("restored", state)
+                self.assertEqual(bot.calls[-1], "send_message")  # вопрос 0 показан заново
+
+                reasked = ChatMessage()
+                reasked.message_id = state["message_id"]
+                await self.tap(bot, context, reasked, "0:2")
+            finally:
+                await journal.stop()
+        state = await tl.user_states.get(self.user_id)
+        self.assertEqual(state["answers"], [[state["question_ids"][0], 2, False]])
+
+
+class AnswerJournalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = Question.objects.create(question="Q", correct_answer=1)
+
+    async def test_failed_batch_is_kept_and_retried(self):
+        journal = AnswerJournal()
+        await journal.requeue([("a", 1, self.question.id, 1, True), ("a", 1, self.question.id, 2, False)])
+        with mock.patch("bot.journal.write_pending_answers", side_effect=DatabaseError("database is locked")):
+            with self.assertLogs("bot.journal", "ERROR"):
+                self.assertFalse(await journal.flush())
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(await PendingAnswer.objects.acount(), 0)
+
+        self.assertTrue(await journal.flush())
+        self.assertEqual(len(journal), 0)
+        self.assertEqual(await PendingAnswer.objects.filter(attempt="a").acount(), 2)
+
+    async def test_discarded_answers_can_be_requeued(self):
+        journal = AnswerJournal()
+        await journal.requeue([("a", 1, self.question.id, 1, True), ("b", 2, self.question.id, 3, False)])
+        removed = await journal.discard("a")
+        self.assertEqual(removed, [("a", 1, self.question.id, 1, True)])
+        self.assertEqual(len(journal), 1)
+        await journal.requeue(removed)
+        self.assertTrue(await journal.flush())
+        self.assertEqual(await PendingAnswer.objects.acount(), 2)
+
+
+class RecordingRequest(BaseRequest):
+    """Bot API без сети: записывает вызовы и отвечает как Telegram."""
+
+    def __init__(self):
+        self.calls = []
+        self.message_ids = iter(range(1, 10 ** 6))
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((endpoint, params))
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Quiz", "username": "quiz_bot"}
+        elif endpoint == "sendMessage":
+            result = {
+                "message_id": next(self.message_ids), "date": 0, "text": params.get("text"),
+                "chat": {"id": params["chat_id"], "type": "private"},
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+START_UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1, "date": 1700000000, "text": "/start",
+        "chat": {"id": 4242, "type": "private"},
+        "from": {"id": 4242, "is_bot": False, "first_name": "Test"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], TELEGRAM_TOKEN="123:TEST", TELEGRAM_WEBHOOK_SECRET="s3cret")
+class WebhookLifecycleTests(TestCase):
+    def setUp(self):
+        self.api = RecordingRequest()
+        build = application_module.build_application
+        patcher = mock.patch.object(application_module, "build_application", lambda: build(request=self.api))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def send_lifespan(self, event):
+        await self.inbox.put({"type": f"lifespan.{event}"})
+        return (await asyncio.wait_for(self.outbox.get(), timeout=10))["type"]
+
+    async def wait_for_call(self, endpoint):
+        for _ in range(200):
+            calls = [params for name, params in self.api.calls if name == endpoint]
+            if calls:
+                return calls
+            await asyncio.sleep(0.02)
+        self.fail(f"{endpoint} не вызван: {self.api.calls}")
+
+    async def test_recorded_update_is_processed_and_journal_drained_on_shutdown(self):
+        # Как uvicorn: одна lifespan-корутина на всё время работы сервера, в своём
+        # контексте — иначе задачи бота видят executor вложенного async_to_sync
+        # из middleware тестового запроса и их sync_to_async может зависнуть
+        self.inbox, self.outbox = asyncio.Queue(), asyncio.Queue()
+        server = asyncio.create_task(
+            with_bot_lifespan(None)({"type": "lifespan"}, self.inbox.get, self.outbox.put),
+            context=contextvars.Context(),
+        )
+        self.assertEqual(await self.send_lifespan("startup"), "lifespan.startup.complete")
+        bot_app = await application_module.get_webhook_application()
+        maintenance = bot_app.bot_data["maintenance_task"]
+        self.assertEqual(self.api.calls[0][0], "getMe")
+
+        forbidden = await self.async_client.post(
+            "/telegram/webhook/", START_UPDATE, content_type="application/json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+        )
+        self.assertEqual(forbidden.status_code, 403)
+        response = await self.async_client.post(
+            "/telegram/webhook/", START_UPDATE, content_type="application/json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+        )
+        self.assertEqual(response.status_code, 200)
+        sent = await self.wait_for_call("sendMessage")
+        self.assertEqual(sent[0]["chat_id"], 4242)
+
+        # Ответ, ещё не записанный фоновой задачей, должен попасть в БД при остановке
+        question = await Question.objects.acreate(question="Q", correct_answer=1)
+        answer_journal.flush_interval = 3600
+        self.addCleanup(setattr, answer_journal, "flush_interval", 1.0)
+        answer_journal.append("attempt-1", 4242, question.id, 1, True)
+
+        self.assertEqual(await self.send_lifespan("shutdown"), "lifespan.shutdown.complete")
+        await server
+        self.assertTrue(maintenance.cancelled() or maintenance.done())
+        self.assertFalse(bot_app.running)
+        self.assertEqual(await PendingAnswer.objects.filter(attempt="attempt-1").acount(), 1)
+        self.assertIsNone(application_module._webhook_app)
@@ -0,0 +1,29 @@
+import hmac
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from telegram import Update
+
+from .application import get_webhook_application
+
+
+@csrf_exempt
+@require_POST
+async def telegram_webhook(request):
+    """Принимает апдейты Telegram и передаёт их в очередь того же Application."""
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not secret or not hmac.compare_digest(received, secret):
+        return HttpResponseForbidden()
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON")
+
+    application = await get_webhook_application()
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return HttpResponse()
@@ -1,41 +1,16 @@
 import os
 import django
 from telegram import BotCommand
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters,
-)
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "telegramquiz.settings")
 django.setup()
 
-from bot.telegram_logic import (
-    start,
-    handle_quiz_selection,
-    handle_variant_selection,
-    handle_answer,
-    handle_quiz_repeat,
-    show_results,
-    handle_text_message
-)
-
-TOKEN = os.environ.get("TOKEN")
-if not TOKEN:
-    raise ValueError("Не найден TOKEN в переменных окружения")
-
-app = ApplicationBuilder().token(TOKEN).build()
-
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("results", show_results))
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-app.add_handler(CallbackQueryHandler(handle_answer, pattern="^[1-4]$"))
-app.add_handler(CallbackQueryHandler(handle_quiz_selection, pattern="^quiz_"))
-app.add_handler(CallbackQueryHandler(handle_variant_selection, pattern="^variant_"))
-app.add_handler(CallbackQueryHandler(handle_quiz_repeat, pattern="^again$"))
-app.add_handler(CallbackQueryHandler(show_results, pattern="^view_results$"))
+from django.conf import settings
+from bot.application import build_application
+
+BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+
+app = build_application()
 
 async def init_bot_commands():
     await app.bot.delete_webhook(drop_pending_updates=True)
@@ -45,8 +20,32 @@ async def init_bot_commands():
     ])
     print("Бот готов и команды установлены")
 
+async def init_webhook():
+    # В webhook-режиме апдейты принимает ASGI-приложение (telegramquiz.asgi),
+    # здесь только регистрируем URL и секрет в Telegram.
+    if not settings.TELEGRAM_WEBHOOK_URL or not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise ValueError("Для BOT_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    async with app.bot:
+        await app.bot.set_webhook(
+            url=settings.TELEGRAM_WEBHOOK_URL,
+            secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+            max_connections=settings.TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=True,
+        )
+        await app.bot.set_my_commands([
+            BotCommand("start", "Тестілеуді бастау"),
+            BotCommand("results", "Нәтижелерді көру"),
+        ])
+    print("Webhook установлен:", settings.TELEGRAM_WEBHOOK_URL)
+
 if __name__ == "__main__":
-    if os.environ.get("RUN_BOT", "false").lower() == "true":
+    if os.environ.get("RUN_BOT", "false").lower() != "true":
+        print("RUN_BOT=false — бот не запущен.")
+    elif BOT_MODE == "webhook":
+        import asyncio
+
+        asyncio.run(init_webhook())
+    else:
         import asyncio
 
         asyncio.get_event_loop().create_task(init_bot_commands())
@@ -54,5 +53,3 @@ if __name__ == "__main__":
         print("Бот запущен и работает через polling")
 
         app.run_polling(close_loop=False)
-    else:
-        print("RUN_BOT=false — бот не запущен.")
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telegramquiz.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после get_asgi_application(): Django уже настроен
+from bot.application import with_bot_lifespan  # noqa: E402
+
+application = with_bot_lifespan(django_application)
@@ -29,7 +29,7 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "insecure-default-key")
 
 DEBUG = False
 
-ALLOWED_HOSTS = ['.onrender.com']
+ALLOWED_HOSTS = ['.onrender.com'] + os.environ.get("EXTRA_ALLOWED_HOSTS", "").split()
 
 CSRF_TRUSTED_ORIGINS = ['https://telegramquiz-soey.onrender.com']
 
@@ -134,6 +134,62 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Хранилище состояний бота: "db" (переживает перезапуск) или "memory"
+QUIZ_SESSION_STORE = os.environ.get("QUIZ_SESSION_STORE", "db")
+QUIZ_SESSION_TTL = int(os.environ.get("QUIZ_SESSION_TTL", 6 * 3600))
+QUIZ_SESSION_MAX_ENTRIES = int(os.environ.get("QUIZ_SESSION_MAX_ENTRIES", 10000))
+QUIZ_SESSION_MAX_BYTES = int(os.environ.get("QUIZ_SESSION_MAX_BYTES", 32 * 1024 * 1024))
+
+# Кэш банка вопросов (снимки вариантов)
+QUESTION_CACHE_MAX_VARIANTS = int(os.environ.get("QUESTION_CACHE_MAX_VARIANTS", 256))
+QUESTION_CACHE_TTL = int(os.environ.get("QUESTION_CACHE_TTL", 300))
+
+# Журнал ответов: период и размер пачки отложенной записи
+ANSWER_JOURNAL_FLUSH_INTERVAL = float(os.environ.get("ANSWER_JOURNAL_FLUSH_INTERVAL", 1.0))
+ANSWER_JOURNAL_BATCH_SIZE = int(os.environ.get("ANSWER_JOURNAL_BATCH_SIZE", 200))
+
+# Telegram-бот: токен и webhook-режим (см. run_bot.py, bot/views.py)
+TELEGRAM_TOKEN = os.environ.get("TOKEN")
+TELEGRAM_WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+# Апдейты разных пользователей — параллельно, одного пользователя — по порядку
+BOT_CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", 16))
+BOT_MAX_PENDING_UPDATES = int(os.environ.get("BOT_MAX_PENDING_UPDATES", 1024))
+# Исходящие запросы (bot/ratelimit.py): сообщений в секунду на бота и на чат
+BOT_RATE_LIMIT_GLOBAL = float(os.environ.get("BOT_RATE_LIMIT_GLOBAL", 25))
+BOT_RATE_LIMIT_PER_CHAT = float(os.environ.get("BOT_RATE_LIMIT_PER_CHAT", 1))
+BOT_RATE_LIMIT_CHAT_BURST = int(os.environ.get("BOT_RATE_LIMIT_CHAT_BURST", 3))
+BOT_RATE_LIMIT_MAX_RETRIES = int(os.environ.get("BOT_RATE_LIMIT_MAX_RETRIES", 3))
+
+# Вывод вопросов: "compact" — отзыв и следующий вопрос одним сообщением, текстовые
+# вопросы редактируются на месте; "verbose" — каждый ответ отдельными сообщениями
+QUIZ_PRESENTATION = os.environ.get("QUIZ_PRESENTATION", "compact")
+
+# Прогрев картинок перед экзаменом (manage.py prewarm_images): служебный чат для
+# загрузки, число одновременных скачиваний, предельная сторона после уменьшения
+IMAGE_STAGING_CHAT_ID = os.environ.get("IMAGE_STAGING_CHAT_ID")
+IMAGE_PREWARM_CONCURRENCY = int(os.environ.get("IMAGE_PREWARM_CONCURRENCY", 8))
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", 2560))
+
+# Период фоновой очистки (истёкший доступ, старые сессии), секунды
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", 300))
+
+# Число результатов на странице /results
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", 10))
+
+# Сколько секунд кэшируется аналитика вопросов в админке
+ANALYTICS_CACHE_TTL = int(os.environ.get("ANALYTICS_CACHE_TTL", 300))
+
+# Сколько строк выгрузки CSV/XLSX читается из БД за один запрос
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 2000))
+
+# Импорт вопросов из Google Sheets: ключ сервисного аккаунта и сколько строк
+# листа запрашивается за один вызов API
+GOOGLE_SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE")
+SHEETS_BATCH_ROWS = int(os.environ.get("SHEETS_BATCH_ROWS", 1000))
+
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
@@ -20,8 +20,11 @@ from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from bot.views import telegram_webhook
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('telegram/webhook/', telegram_webhook, name='telegram-webhook'),
 ]
 
 if settings.DEBUG: